@@ -0,0 +1,4 @@
+"""
+Modules shared by evaluate and data_engine. Their scripts run from their own directory, so
+they put the repository root at the end of sys.path before importing from here.
+"""
@@ -0,0 +1,181 @@
+"""
+Background frame writer. Frames are encoded and written by worker threads, the caller
+gets the final path right away and can read the encoded bytes back from memory while
+(or after) the file is written.
+
+FRAME_CODEC: png (default), png_fast (zlib level 1), jpeg (quality 95) or webp (lossless).
+The extension of the path is replaced by the codec's. With keep_name=True (the data engine)
+the file name is kept and the codec follows the extension: .jpg/.jpeg are jpeg, .webp is webp
+and .png uses FRAME_CODEC if it is png or png_fast. FRAME_WRITER_THREADS=0 encodes and
+writes on the calling thread like before.
+"""
+import io
+import os
+import queue
+import atexit
+import threading
+import contextlib
+from collections import OrderedDict
+
+from PIL import Image
+
+try:
+    # evaluate/perf.py, the data engine doesn't time its frames
+    import perf
+except ImportError:
+    perf = None
+
+FRAME_CODEC = os.getenv("FRAME_CODEC", "png")
+FRAME_WRITER_THREADS = int(os.getenv("FRAME_WRITER_THREADS", 2))
+FRAME_WRITER_QUEUE = int(os.getenv("FRAME_WRITER_QUEUE", 16)) # frames waiting per thread
+FRAME_BUFFER_MB = int(os.getenv("FRAME_BUFFER_MB", 64)) # encoded frames kept for read()
+
+# codec -> (extension, PIL save arguments)
+CODECS = {
+    "png": (".png", {"format": "PNG"}),
+    "png_fast": (".png", {"format": "PNG", "compress_level": 1}),
+    "jpeg": (".jpg", {"format": "JPEG", "quality": 95}),
+    "webp": (".webp", {"format": "WEBP", "lossless": True}),
+}
+EXTENSION_CODECS = {".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp"}
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+def encode_frame(frame, codec):
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, **CODECS[codec][1])
+    return buffer.getvalue()
+
+def mime_type(path):
+    return MIME_TYPES.get(os.path.splitext(path)[1].lower(), "image/png")
+
+class FrameJob:
+    def __init__(self):
+        self.encoded = threading.Event() # read() can return the bytes
+        self.written = threading.Event() # the file is on disk
+
+class FrameWriter:
+    def __init__(self, codec=FRAME_CODEC, threads=FRAME_WRITER_THREADS, queue_size=FRAME_WRITER_QUEUE, buffer_mb=FRAME_BUFFER_MB):
+        if codec not in CODECS:
+            raise ValueError(f"unknown FRAME_CODEC {codec}, choose from {list(CODECS)}")
+        self.codec = codec
+        self.pending = {} # path -> FrameJob of the latest submit, until it is written
+        self.buffers = OrderedDict() # path -> encoded bytes, least recently used first
+        self.buffer_bytes = 0
+        self.buffer_limit = buffer_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.stats = {"frames": 0, "bytes": 0, "errors": 0}
+        # one queue per thread, a path always goes to the same thread so rewrites stay in order
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(threads)]
+        for q in self.queues:
+            threading.Thread(target=self.run, args=(q,), daemon=True).start()
+
+    def frame_path(self, path):
+        return os.path.splitext(path)[0] + CODECS[self.codec][0]
+
+    def path_codec(self, path):
+        codec = EXTENSION_CODECS.get(os.path.splitext(path)[1].lower())
+        if codec is not None:
+            return codec
+        return self.codec if CODECS[self.codec][0] == ".png" else "png"
+
+    def submit(self, path, frame, keep_name=False):
+        """
+        Queue frame (RGB array, not modified afterwards) and return the path it is written to.
+        Blocks while the queue is full.
+        """
+        if keep_name:
+            codec = self.path_codec(path)
+        else:
+            path, codec = self.frame_path(path), self.codec
+        if not self.queues:
+            self.write(path, frame, codec)
+            return path
+        job = FrameJob()
+        with self.lock:
+            self.pending[path] = job
+        self.queues[hash(path) % len(self.queues)].put((path, frame, codec, job))
+        return path
+
+    def run(self, q):
+        while True:
+            path, frame, codec, job = q.get()
+            try:
+                self.write(path, frame, codec, job)
+            except Exception as e:
+                print(f"write frame {path} failed: {e}")
+                with self.lock:
+                    self.stats["errors"] += 1
+            finally:
+                with self.lock:
+                    if self.pending.get(path) is job:
+                        del self.pending[path]
+                job.encoded.set()
+                job.written.set()
+
+    def write(self, path, frame, codec, job=None):
+        # inline writes (FRAME_WRITER_THREADS=0) are part of the caller's io time
+        timer = perf.timer("frame_write", "background" if job is not None else "io") if perf is not None else contextlib.nullcontext()
+        with timer:
+            data = encode_frame(frame, codec)
+            self.keep(path, data)
+            if job is not None:
+                job.encoded.set()
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def keep(self, path, data):
+        with self.lock:
+            self.stats["frames"] += 1
+            self.stats["bytes"] += len(data)
+            if path in self.buffers:
+                self.buffer_bytes -= len(self.buffers.pop(path))
+            self.buffers[path] = data
+            self.buffer_bytes += len(data)
+            while self.buffer_bytes > self.buffer_limit and len(self.buffers) > 1:
+                self.buffer_bytes -= len(self.buffers.popitem(last=False)[1])
+
+    def read(self, path):
+        """
+        Encoded bytes of path, from memory if it was written recently, else from disk.
+        """
+        with self.lock:
+            job = self.pending.get(path)
+        if job is not None:
+            job.encoded.wait()
+        with self.lock:
+            data = self.buffers.get(path)
+            if data is not None:
+                self.buffers.move_to_end(path)
+                return data
+        with open(path, "rb") as f:
+            return f.read()
+
+    def flush(self, prefix=""):
+        """
+        Wait until the queued frames whose path starts with prefix are written.
+        """
+        with self.lock:
+            pending = [job for path, job in self.pending.items() if path.startswith(prefix)]
+        for job in pending:
+            job.written.wait()
+
+writer = None
+writer_lock = threading.Lock()
+
+def get_writer():
+    global writer
+    with writer_lock:
+        if writer is None:
+            writer = FrameWriter()
+            atexit.register(writer.flush)
+        return writer
+
+def save(path, frame, keep_name=False):
+    return get_writer().submit(path, frame, keep_name)
+
+def read(path):
+    return get_writer().read(path)
+
+def flush(prefix=""):
+    if writer is not None:
+        writer.flush(prefix)
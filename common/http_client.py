@@ -0,0 +1,87 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 300))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+RETRY_STATUS = (502, 503, 504)
+
+local = threading.local()
+stats = {}
+stats_lock = threading.Lock()
+
+def get_session():
+    """
+    One keep-alive session per thread, requests.Session is not thread safe.
+    """
+    session = getattr(local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        local.session = session
+    return session
+
+def endpoint(url):
+    parts = urlsplit(url)
+    return f"{parts.netloc}{parts.path}"
+
+def record(url, elapsed, error=False, retry=False):
+    key = endpoint(url)
+    with stats_lock:
+        s = stats.setdefault(key, {"count": 0, "errors": 0, "retries": 0, "total_time": 0.0, "max_time": 0.0})
+        if retry:
+            s["retries"] += 1
+            return
+        s["count"] += 1
+        s["errors"] += int(error)
+        s["total_time"] += elapsed
+        s["max_time"] = max(s["max_time"], elapsed)
+
+def post(url, json=None, data=None, headers=None, timeout=None, retries=None):
+    """
+    POST through the pooled session. Connection failures and 502/503/504 are retried
+    up to `retries` times with jittered exponential backoff; read timeouts are not
+    retried since the server may still be working on the request.
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    if retries is None:
+        retries = HTTP_RETRIES
+    attempt = 0
+    while True:
+        t = time.time()
+        try:
+            response = get_session().post(url, json=json, data=data, headers=headers, timeout=timeout)
+            if response.status_code not in RETRY_STATUS or attempt >= retries:
+                record(url, time.time() - t, error=response.status_code >= 400)
+                return response
+        except requests.ConnectionError:
+            if attempt >= retries:
+                record(url, time.time() - t, error=True)
+                raise
+        except Exception:
+            record(url, time.time() - t, error=True)
+            raise
+        record(url, 0, retry=True)
+        time.sleep(random.uniform(0, HTTP_BACKOFF * 2 ** attempt))
+        attempt += 1
+
+def latency_stats():
+    with stats_lock:
+        result = {}
+        for key, s in stats.items():
+            result[key] = dict(s)
+            result[key]["avg_time"] = round(s["total_time"] / s["count"], 4) if s["count"] else 0.0
+            result[key]["total_time"] = round(s["total_time"], 4)
+            result[key]["max_time"] = round(s["max_time"], 4)
+        return result
@@ -5,6 +5,10 @@ import time
 from PIL import Image
 import numpy as np
 from abc import ABC
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import frame_writer
 
 class BaseAgent(ABC):
 
@@ -56,13 +60,11 @@ class BaseAgent(ABC):
                 image_name += f"_{kargs[key]}"
 
         if "third_party_camera_frames" in kargs.keys():
-            image = Image.fromarray(self.controller.last_event.third_party_camera_frames[-1])
-            image.save(f"{path}/{self.scene}_third_party{image_name}.png", format="PNG")
+            frame_writer.save(f"{path}/{self.scene}_third_party{image_name}.png", self.controller.last_event.third_party_camera_frames[-1], keep_name=True)
             kargs.pop("third_party_camera_frames")
         
         if "no_agent_view" not in kargs.keys():
-            image = Image.fromarray(self.controller.last_event.frame)
-            image.save(f"{path}/{self.scene}{image_name}.png", format="PNG")
+            frame_writer.save(f"{path}/{self.scene}{image_name}.png", self.controller.last_event.frame, keep_name=True)
             
 
     def compute_position(self, item):
@@ -0,0 +1,128 @@
+"""
+Regression check of utils.get_volume_distance_rate against the original per-object loop.
+
+Compares the returned lists (order, keys and values, exactly) on the scene metadata under
+./taskgenerate and on synthetic scenes that hit the navigability thresholds and rate ties.
+
+    cd data_engine && python check_volume_distance_rate.py
+"""
+import glob
+import json
+import math
+import random
+import argparse
+from utils import get_volume_distance_rate
+
+def reference_volume_distance_rate(metadata):
+    # the loop get_volume_distance_rate replaced, kept as is
+    volumes = []
+    objectid2object={}
+    for obj in metadata["objects"]:
+        objectid2object[obj["objectId"]]=obj
+        if obj["objectType"]!="Floor":
+            size=obj["axisAlignedBoundingBox"]["size"]
+            v=size["x"]*size["y"]*size["z"]
+            dx=obj["axisAlignedBoundingBox"]["center"]["x"]
+            dz=obj["axisAlignedBoundingBox"]["center"]["z"]
+            agentx=metadata["agent"]["position"]["x"]
+            agentz=metadata["agent"]["position"]["z"]
+            d=math.sqrt((dx-agentx)**2+(dz-agentz)**2)
+
+            sxz = size["x"] * size["z"]
+            sxy = size["x"] * size["y"]
+            szy = size["y"] * size["z"]
+            s = max(sxz, sxy, szy)
+            if d != 0:
+                rate = v / d
+            else:
+                rate = 0
+            rate=v/d
+            isnavigable=False
+            # if obj["visible"]==True:
+            if True:
+                if v<0.01:
+                    isnavigable=False
+                    if s>0.5 and d<10:
+                        isnavigable=True
+                    elif s>0.15 and d<4:
+                        isnavigable=True
+                    elif s>0.08 and d<2.5:
+                        isnavigable=True
+                    elif v>0.005 and d<2:
+                        isnavigable=True
+                    elif v>0.001 and d<1.5:
+                        isnavigable=True
+                    elif d<1:
+                        isnavigable=True
+                else:
+                    isnavigable=True
+                    if rate<=0.02:
+                        isnavigable=False
+                        if s>0.5 and d<10:
+                            isnavigable=True
+                        elif s>0.15 and d<4:
+                            isnavigable=True
+                        elif s>0.08 and d<2.5:
+                            isnavigable=True
+                        elif v>0.005 and d<2:
+                            isnavigable=True
+                        elif v>0.001 and d<1.5:
+                            isnavigable=True
+                        elif d<1:
+                            isnavigable=True
+            volumes.append({
+                "objectId":obj["objectId"],
+                "objectType":obj["objectType"],
+                "visible":obj["visible"],
+                "volume":v,
+                "s":s,
+                "distance":d,
+                "rate":rate,
+                "isnavigable":isnavigable
+            })
+            sorted_volumes = sorted(volumes, key=lambda v: v["rate"])
+    return sorted_volumes
+
+def synthetic_metadata(rng, count):
+    # sizes and distances around the thresholds, repeated boxes give equal rates
+    sizes = [0.0, 0.05, 0.1, 0.2, 0.25, 0.3, 0.5, 0.7071, 1.0, 2.0]
+    distances = [0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 6.0, 10.0, 12.0]
+    objects = [{"objectId": "Floor|+00.00|+00.00|+00.00", "objectType": "Floor", "visible": False,
+                "axisAlignedBoundingBox": {"size": {"x": 5, "y": 0.1, "z": 5}, "center": {"x": 0, "y": 0, "z": 0}}}]
+    for i in range(count):
+        size = {axis: rng.choice(sizes) if rng.random() < 0.5 else rng.uniform(0, 1.5) for axis in "xyz"}
+        d = rng.choice(distances) if rng.random() < 0.5 else rng.uniform(0.1, 12)
+        angle = rng.choice([0, math.pi / 2, math.pi / 3]) if rng.random() < 0.5 else rng.uniform(0, 2 * math.pi)
+        objects.append({
+            "objectId": f"Object{i}",
+            "objectType": rng.choice(["Apple", "Fridge", "Mug", "CounterTop", "Cabinet"]),
+            "visible": rng.random() < 0.5,
+            "axisAlignedBoundingBox": {"size": size, "center": {"x": d * math.cos(angle), "y": 1.0, "z": d * math.sin(angle)}},
+        })
+    rng.shuffle(objects)
+    return {"objects": objects, "agent": {"position": {"x": 0.0, "y": 0.9, "z": 0.0}}}
+
+def check(metadata, name):
+    expected = reference_volume_distance_rate(metadata)
+    actual = get_volume_distance_rate(metadata)
+    assert actual == expected, f"{name}: get_volume_distance_rate differs from the reference loop"
+    assert [type(v) for item in actual for v in item.values()] == [type(v) for item in expected for v in item.values()], f"{name}: value types differ"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metadata_glob", type=str, default="./taskgenerate/*/FloorPlan*/metadata.json", help="scene metadata files")
+    parser.add_argument("--synthetic", type=int, default=200, help="number of synthetic scenes")
+    parser.add_argument("--seed", type=int, default=0, help="")
+    args = parser.parse_args()
+
+    scenes = 0
+    for path in sorted(glob.glob(args.metadata_glob)):
+        with open(path) as f:
+            metadata = json.load(f)
+        for i, event in enumerate(metadata if isinstance(metadata, list) else [metadata]):
+            check(event, f"{path}[{i}]")
+            scenes += 1
+    rng = random.Random(args.seed)
+    for i in range(args.synthetic):
+        check(synthetic_metadata(rng, rng.randint(1, 60)), f"synthetic scene {i}")
+    print(f"get_volume_distance_rate matches the reference loop on {scenes} scenes and {args.synthetic} synthetic scenes")
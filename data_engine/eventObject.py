@@ -1,101 +1,156 @@
 import ai2thor.server
 from typing import List, Dict, Tuple
 import re
+import weakref
 
-class EventObject:
+class ObjectIndex:
+    """
+    Lookups over event.metadata["objects"], built once per event and shared by every
+    EventObject created for it. Filters by a boolean property are computed on first use.
+    """
     def __init__(self, event: ai2thor.server.Event):
         self.objects = event.metadata["objects"]
+        self.by_id = {}
+        self.by_type = {}
+        self.item2object = {}
+        for obj in self.objects:
+            self.by_id.setdefault(obj["objectId"], obj)
+            self.by_type.setdefault(obj["objectType"], []).append(obj)
+            self.item2object[obj["name"]] = obj
+        self.filters = {}
+        self.volumes = {}
+        self.surface_areas = {}
+
+    def filter(self, prop):
+        if prop not in self.filters:
+            self.filters[prop] = [obj for obj in self.objects if obj[prop]]
+        return self.filters[prop]
+
+    def volume(self, item_name):
+        if item_name not in self.volumes:
+            item_size = self.item2object[item_name]["axisAlignedBoundingBox"]["size"]
+            # 保留四位小数
+            self.volumes[item_name] = round(item_size["x"] * item_size["y"] * item_size["z"], 4)
+        return self.volumes[item_name]
+
+    # 获取物品平面面积
+    def surface_area(self, item_name):
+        if item_name not in self.surface_areas:
+            item_size = self.item2object[item_name]["axisAlignedBoundingBox"]["size"]
+            x = item_size["x"]
+            y = item_size["y"]
+            z = item_size["z"]
+            self.surface_areas[item_name] = round(max(x*y, x*z, y*z), 4)
+        return self.surface_areas[item_name]
+
+object_indexes = weakref.WeakKeyDictionary()
+
+def object_index(event: ai2thor.server.Event) -> ObjectIndex:
+    index = object_indexes.get(event)
+    if index is None or index.objects is not event.metadata["objects"]:
+        index = ObjectIndex(event)
+        object_indexes[event] = index
+    return index
+
+class EventObject:
+    def __init__(self, event: ai2thor.server.Event):
+        self.index = object_index(event)
+        self.objects = self.index.objects
         self.object2color = event.object_id_to_color
         self.color2object = event.color_to_object_id
-        _,self.item2object = self.get_objects()  
+        self.item2object = self.index.item2object
 
 
     def get_objects(self) -> Tuple[List[dict], Dict[str, dict]]:
-        item2object = {}
-        for item in self.objects:
-            item2object[item["name"]] = item
-        return self.objects, item2object    
+        return self.objects, dict(self.item2object)
+
+    def get_object_by_id(self, obj_id):
+        return self.index.by_id.get(obj_id)
+
+    def get_objects_by_type(self, object_type: str) -> List[dict]:
+        return list(self.index.by_type.get(object_type, []))
     
     def get_all_item_position(self) -> dict:
         item2position = {}
-        for item in self.objects:
-            item2position[item["name"]] = item["position"]
+        for name, item in self.item2object.items():
+            item2position[name] = item["position"]
         return item2position     
 
     def get_visible_objects(self) -> Tuple[List[dict],List[dict]]:
-        return [obj['name'] for obj in self.objects if obj["visible"]], [obj for obj in self.objects if obj["visible"]]
+        objects = self.index.filter("visible")
+        return [obj['name'] for obj in objects], list(objects)
 
     def get_isInteractable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isInteractable"]]
+        return list(self.index.filter("isInteractable"))
 
     def get_receptacle_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["receptacle"]]
+        return list(self.index.filter("receptacle"))
 
     def get_toggleable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["toggleable"]]
+        return list(self.index.filter("toggleable"))
 
     def get_breakable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["breakable"]]
+        return list(self.index.filter("breakable"))
 
     def get_isToggled_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isToggled"]]
+        return list(self.index.filter("isToggled"))
 
     def get_isBroken_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isBroken"]]
+        return list(self.index.filter("isBroken"))
 
     def get_canFillWithLiquid_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["canFillWithLiquid"]]
+        return list(self.index.filter("canFillWithLiquid"))
 
     def get_isFilledWithLiquid_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isFilledWithLiquid"]]
+        return list(self.index.filter("isFilledWithLiquid"))
 
     def get_fillLiquid_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["fillLiquid"]]
+        return list(self.index.filter("fillLiquid"))
 
     def get_dirtyable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["dirtyable"]]
+        return list(self.index.filter("dirtyable"))
 
     def get_isDirty_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isDirty"]]
+        return list(self.index.filter("isDirty"))
 
     def get_canBeUsedUp_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["canBeUsedUp"]]
+        return list(self.index.filter("canBeUsedUp"))
 
     def get_isUsedUp_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isUsedUp"]]
+        return list(self.index.filter("isUsedUp"))
 
     def get_cookable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["cookable"]]
+        return list(self.index.filter("cookable"))
 
     def get_isCooked_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isCooked"]]
+        return list(self.index.filter("isCooked"))
 
     def get_isHeatSource_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isHeatSource"]]
+        return list(self.index.filter("isHeatSource"))
 
     def get_isColdSource_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isColdSource"]]
+        return list(self.index.filter("isColdSource"))
 
     def get_sliceable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["sliceable"]]
+        return list(self.index.filter("sliceable"))
 
     def get_openable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["openable"]]
+        return list(self.index.filter("openable"))
 
     def get_isOpen_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isOpen"]]
+        return list(self.index.filter("isOpen"))
 
     def get_pickupable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["pickupable"]]
+        return list(self.index.filter("pickupable"))
 
     def get_isPickedUp_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isPickedUp"]]
+        return list(self.index.filter("isPickedUp"))
 
     def get_moveable_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["moveable"]]
-    
+        return list(self.index.filter("moveable"))
+
     def get_isMoving_objects(self, ) -> List[dict]:
-        return [obj for obj in self.objects if obj["isMoving"]]
+        return list(self.index.filter("isMoving"))
     
     def get_object_color(self, object_id: str) -> str:
         return self.object2color[object_id]
@@ -107,19 +162,10 @@ class EventObject:
         return self.item2object[item_name]["mass"]
     
     def get_item_volume(self, item_name: str) -> float:
-        item_size = self.item2object[item_name]["axisAlignedBoundingBox"]["size"]
-        # 保留四位小数
-        return round(item_size["x"] * item_size["y"] * item_size["z"], 4)
+        return self.index.volume(item_name)
     
-    # 获取物品平面面积
     def get_item_surface_area(self, item_name: str) -> float:
-        item_size = self.item2object[item_name]["axisAlignedBoundingBox"]["size"]
-        x = item_size["x"]
-        y = item_size["y"]
-        z = item_size["z"]
-        max_surface= max(x*y, x*z, y*z)
-        # 保留四位小数
-        return round(max_surface, 4)
+        return self.index.surface_area(item_name)
     
     def get_item_position(self, item_name: str) -> dict:
         return self.item2object[item_name]["position"]
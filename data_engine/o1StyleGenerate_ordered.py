@@ -6,6 +6,12 @@ import time
 import threading
 import copy
 from PIL import Image
+import io
+import numpy as np
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import frame_writer
 from vlmCall import VLMAPI
 from utils import save_data_to_json,save_image,clear_folder,load_json,get_volume_distance_rate
 
@@ -936,7 +942,7 @@ class O1StyleGenerate_ordered:
     
     def crop_and_save(self,image_path1, image_path2, crop_margin=150):
         try:
-            img = Image.open(image_path1)
+            img = Image.open(io.BytesIO(frame_writer.read(image_path1)))
             width, height = img.size
             left = crop_margin
             top = crop_margin
@@ -945,7 +951,8 @@ class O1StyleGenerate_ordered:
             if left < 0 or top < 0 or right > width or bottom > height:
                 raise ValueError("error")
             cropped_img = img.crop((left, top, right, bottom))
-            cropped_img.save(image_path2)
+            # through the frame writer, so frame_writer.read(image_path2) sees the cropped image
+            frame_writer.save(image_path2, np.asarray(cropped_img.convert("RGB")), keep_name=True)
             print(f"image save {image_path2}")
         
         except Exception as e:
@@ -6,78 +6,60 @@ import numpy as np
 from ai2thor.controller import Controller
 import math
 import shutil
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import frame_writer
 
 
+def navigable_mask(v, s, d, rate):
+    # small objects must be large or close enough, the others also pass on volume/distance rate
+    close = (s > 0.5) & (d < 10)
+    close |= (s > 0.15) & (d < 4)
+    close |= (s > 0.08) & (d < 2.5)
+    close |= (v > 0.005) & (d < 2)
+    close |= (v > 0.001) & (d < 1.5)
+    close |= d < 1
+    return np.where(v < 0.01, close, (rate > 0.02) | close)
+
 def get_volume_distance_rate(metadata):
-    volumes = []
-    objectid2object={}
-    for obj in metadata["objects"]:
-        objectid2object[obj["objectId"]]=obj
-        if obj["objectType"]!="Floor":
-            size=obj["axisAlignedBoundingBox"]["size"]
-            v=size["x"]*size["y"]*size["z"]
-            dx=obj["axisAlignedBoundingBox"]["center"]["x"]
-            dz=obj["axisAlignedBoundingBox"]["center"]["z"]
-            agentx=metadata["agent"]["position"]["x"]
-            agentz=metadata["agent"]["position"]["z"]
-            d=math.sqrt((dx-agentx)**2+(dz-agentz)**2)
+    """
+    Non-floor objects sorted by volume / planar distance to the agent, with their navigability.
+    """
+    objects = [obj for obj in metadata["objects"] if obj["objectType"] != "Floor"]
+    if not objects:
+        return []
+    # x, y, z size and x, z center of every axis aligned bounding box
+    geometry = np.array([
+        (b["size"]["x"], b["size"]["y"], b["size"]["z"], b["center"]["x"], b["center"]["z"])
+        for b in (obj["axisAlignedBoundingBox"] for obj in objects)
+    ], dtype=np.float64)
+    x, y, z, cx, cz = geometry.T
+    agent = metadata["agent"]["position"]
+    v = x * y * z
+    # float_power calls libm pow like python's **, numpy's ** squares and can differ in the last bit
+    d = np.sqrt(np.float_power(cx - agent["x"], 2) + np.float_power(cz - agent["z"], 2))
+    if (d == 0).any():
+        raise ZeroDivisionError("float division by zero")
+    s = np.maximum(np.maximum(x * z, x * y), y * z)
+    rate = v / d
+    isnavigable = navigable_mask(v, s, d, rate)
 
-            sxz = size["x"] * size["z"]
-            sxy = size["x"] * size["y"]
-            szy = size["y"] * size["z"]
-            s = max(sxz, sxy, szy)
-            if d != 0: 
-                rate = v / d
-            else:
-                rate = 0 
-            rate=v/d
-            isnavigable=False
-            # if obj["visible"]==True:
-            if True:
-                if v<0.01:
-                    isnavigable=False
-                    if s>0.5 and d<10:
-                        isnavigable=True
-                    elif s>0.15 and d<4:
-                        isnavigable=True
-                    elif s>0.08 and d<2.5:
-                        isnavigable=True 
-                    elif v>0.005 and d<2:
-                        isnavigable=True 
-                    elif v>0.001 and d<1.5:
-                        isnavigable=True
-                    elif d<1:
-                        isnavigable=True
-                else:
-                    isnavigable=True
-                    if rate<=0.02:
-                        isnavigable=False
-                        if s>0.5 and d<10:
-                            isnavigable=True
-                        elif s>0.15 and d<4:
-                            isnavigable=True
-                        elif s>0.08 and d<2.5:
-                            isnavigable=True 
-                        elif v>0.005 and d<2:
-                            isnavigable=True 
-                        elif v>0.001 and d<1.5:
-                            isnavigable=True
-                        elif d<1:
-                            isnavigable=True                        
-            volumes.append({
-                "objectId":obj["objectId"],
-                "objectType":obj["objectType"],
-                "visible":obj["visible"],
-                "volume":v,
-                "s":s,
-                "distance":d,
-                "rate":rate,
-                "isnavigable":isnavigable
-            })
-            sorted_volumes = sorted(volumes, key=lambda v: v["rate"])
+    volumes = []
+    for i in np.argsort(rate, kind="stable").tolist():
+        obj = objects[i]
+        volumes.append({
+            "objectId":obj["objectId"],
+            "objectType":obj["objectType"],
+            "visible":obj["visible"],
+            "volume":float(v[i]),
+            "s":float(s[i]),
+            "distance":float(d[i]),
+            "rate":float(rate[i]),
+            "isnavigable":bool(isnavigable[i])
+        })
 
-    # save_data_to_json(sorted_volumes,"./test/navigable_list.json")
-    return sorted_volumes
+    # save_data_to_json(volumes,"./test/navigable_list.json")
+    return volumes
 
 
 def get_scene_metadata(scene,base_path):
@@ -139,7 +121,8 @@ def save_image(event, file_path):
     if frame.dtype != np.uint8:
         frame = (frame - np.min(frame)) / (np.max(frame) - np.min(frame)) * 255
         frame = frame.astype(np.uint8)
-    Image.fromarray(frame).save(file_path)
+    # encoded and written in the background, frame_writer.read(file_path) returns the bytes
+    frame_writer.save(file_path, frame, keep_name=True)
     print(f"Saved frame as {file_path}.")
     return file_path
 
@@ -1,4 +1,7 @@
-import http.client
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import http_client, frame_writer
 import json
 import random
 
@@ -21,7 +24,9 @@ class VLMAPI:
         
 
     def encode_image(self, image_path):
-        with Image.open(image_path) as img:
+        # frames saved by the frame writer may not be on disk yet
+        data = frame_writer.read(image_path)
+        with Image.open(io.BytesIO(data)) as img:
             original_width, original_height = img.size
 
             if original_width == 1600 and original_height == 800:
@@ -32,8 +37,7 @@ class VLMAPI:
                 resized_img.save(buffered, format="JPEG")
                 base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
             else:
-                with open(image_path, "rb") as image_file:
-                    base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+                base64_image = base64.b64encode(data).decode('utf-8')
 
         return base64_image
     
@@ -109,7 +113,6 @@ class VLMAPI:
             }
         )
         
-        conn = http.client.HTTPSConnection("us.ifopen.ai")
         
         retry_count = 0
         while retry_count < retry_limit: 
@@ -124,13 +127,8 @@ class VLMAPI:
                 t1=time.time()
                 print(f"********* start call {self.model} *********")
                 
-                test=conn.request("POST", "/v1/chat/completions", payload, headers)
-
-                res = conn.getresponse()
-
-                data = res.read()
-                data=data.decode("utf-8")
-                data_dict = json.loads(data)
+                res = http_client.post("https://us.ifopen.ai/v1/chat/completions", data=payload, headers=headers)
+                data_dict = res.json()
                 content = data_dict["choices"][0]["message"]["content"]
 
                 current_time = int(datetime.now().timestamp())  
@@ -10,6 +10,9 @@ import os
 import json
 import requests
 import logging
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import http_client, frame_writer
 
 def load_prompt_config(config_path="config/prompt_config.json"):
     """加载 prompt 配置文件"""
@@ -35,7 +38,9 @@ class VLMAPI:
 
     def encode_image(self, image_path):
         """编码图像为base64格式"""
-        with Image.open(image_path) as img:
+        # frames saved by the frame writer may not be on disk yet
+        data = frame_writer.read(image_path)
+        with Image.open(io.BytesIO(data)) as img:
             original_width, original_height = img.size
 
             if original_width == 1600 and original_height == 800:
@@ -46,8 +51,7 @@ class VLMAPI:
                 resized_img.save(buffered, format="JPEG")
                 base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
             else:
-                with open(image_path, "rb") as image_file:
-                    base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+                base64_image = base64.b64encode(data).decode('utf-8')
 
         return base64_image
     
@@ -110,7 +114,7 @@ class VLMAPI:
                 print(f"********* start call {self.model} *********")
                 
                 # 发送请求到Ollama API
-                response = requests.post(self.api_url, json=payload, timeout=60)
+                response = http_client.post(self.api_url, json=payload, timeout=(http_client.HTTP_CONNECT_TIMEOUT, 60))
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -136,6 +140,7 @@ class VLMAPI:
                 else:
                     print(f"API request failed with status code: {response.status_code}")
                     print(f"Response: {response.text}")
+                    retry_count += 1
                     
             except Exception as ex:
                 print(f"Attempt call {self.model} {retry_count + 1} failed: {ex}")
@@ -1,4 +1,7 @@
-import http.client
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import http_client
 import json
 from mimetypes import guess_type
 import random
@@ -17,6 +20,14 @@ from VLMCallapi_keys import moda_keys,api_keys
 class VLMRequestError(Exception):
     pass  
 
+openai_clients = {}
+
+def get_openai_client(api_key, base_url):
+    # reuse clients (and their connection pools) across requests
+    if (api_key, base_url) not in openai_clients:
+        openai_clients[(api_key, base_url)] = OpenAI(api_key=api_key, base_url=base_url)
+    return openai_clients[(api_key, base_url)]
+
 
 moda_models=[
     "Qwen/Qwen2.5-72B-Instruct",
@@ -46,10 +57,7 @@ class VLMAPI:
                     print(f"********* start call {self.model} *********")
                     
                     api_key=random.choice(moda_keys)
-                    client = OpenAI(
-                        api_key=api_key, # 请替换成您的ModelScope SDK Token
-                        base_url="https://api-inference.modelscope.cn/v1"
-                    )
+                    client = get_openai_client(api_key, "https://api-inference.modelscope.cn/v1") # 请替换成您的ModelScope SDK Token
                     if self.model=="Qwen/Qwen2-VL-7B-Instruct":
                         max_tokens=2000
                     outputs = client.chat.completions.create(
@@ -106,8 +114,6 @@ class VLMAPI:
                 }
             )
             
-            conn = http.client.HTTPSConnection("api2.aigcbest.top")
-            
             retry_count = 0
             while retry_count < retry_limit: 
                 try:
@@ -122,14 +128,8 @@ class VLMAPI:
                     # import pdb;pdb.set_trace()
                     print(f"********* start call {self.model} *********")
                     
-                    test=conn.request("POST", "/v1/chat/completions", payload, headers)
-
-                    res = conn.getresponse()
-                    
-                    
-                    data = res.read()
-                    data=data.decode("utf-8")
-                    data_dict = json.loads(data)
+                    res = http_client.post("https://api2.aigcbest.top/v1/chat/completions", data=payload, headers=headers)
+                    data_dict = res.json()
                     # print(data)
                     content = data_dict["choices"][0]["message"]["content"]
 
@@ -4,11 +4,15 @@ try:
 except Exception as e:
     print(e)
 try:
-    from .utils import add_text_to_image, add_border, EventObject
+    from .utils import add_text_to_image, add_border, EventObject, scene_type_index
 except Exception as e:
     print(e)
 
-from .baseAgent import BaseAgent
+from .baseAgent import BaseAgent, OBSERVE_VIEWS
+from . import reachable
+from . import scene_poses
+from .replay import is_recorded
+import perf
 from tqdm import tqdm
 import numpy as np
 import cv2, json
@@ -56,24 +60,16 @@ class RocAgent(BaseAgent):
                 self.target_item_type2obj_id[target_obj.split("|")[0]] = []
             self.target_item_type2obj_id[target_obj.split("|")[0]].append(target_obj)
         
-        for obj in self.controller.last_event.metadata['objects']:
-            if obj['objectType'] not in self.objecttype2object:
-                self.objecttype2object[obj['objectType']]=[]
-            self.objecttype2object[obj['objectType']].append(obj)
+        # 按objectType分组的物体, 同一场景的任务共用 (场景刚加载时的状态)
+        self.objecttype2object = scene_type_index(scene, self.controller.last_event)
         
         for navigable_obj in navigable_objects:
             if navigable_obj not in self.navigable_objects:
                 self.navigable_objects[navigable_obj] = 0
             self.navigable_objects[navigable_obj] += 1
         self.taskid = str(taskid)
-        self.objid2position={}
-        with open("./data/agent_positions.json") as f:
-            custom_position_data = json.load(f)
-        for taskid in custom_position_data:
-            temp_data = custom_position_data[taskid]
-            for objid in temp_data:
-                if objid != "scene" and objid != "tasktype" and objid != "taskname":
-                    self.objid2position[objid] = temp_data[objid]
+        # 手动设定的位置 (data/agent_positions.json), 每个进程只解析一次
+        self.objid2position = scene_poses.agent_positions.scene_view(scene)
 
         # if self.taskid in custom_position_data:
         #     self.objid2position = custom_position_data[self.taskid]
@@ -127,74 +123,27 @@ class RocAgent(BaseAgent):
 
 
     def init_agent_corner(self):
-        scene_bounds2 = self.controller.last_event.metadata['sceneBounds']['cornerPoints'][2]
-        scene_bounds3 = self.controller.last_event.metadata['sceneBounds']['cornerPoints'][3]
-        scene_bounds6 = self.controller.last_event.metadata['sceneBounds']['cornerPoints'][6]
-        scene_bounds7 = self.controller.last_event.metadata['sceneBounds']['cornerPoints'][7]
+        corner_points = self.controller.last_event.metadata['sceneBounds']['cornerPoints']
+        corners = [(corner_points[i][0], corner_points[i][2]) for i in (2, 3, 6, 7)]
+        # 面向场景内部: 180-270, 270-360, 90-180, 0-90
+        corner_rotations = [225, 315, 135, 45]
 
         # 3. 获取agent可达位置
-        event = self.controller.step(dict(action='GetReachablePositions'))
-        reachable_positions = event.metadata['actionReturn']
+        grid = reachable.load_reachable_grid(self.controller, self.scene)
         pre_target_positions = []
-        # 4. 计算与四个点最近的可达位置
-        min_distance = float("inf")
-        for i, scene_bounds in enumerate([scene_bounds2, scene_bounds3, scene_bounds6, scene_bounds7]):
-            for position in reachable_positions:
-                distance = math.sqrt((position['x']-scene_bounds[0])**2 + (position['z']-scene_bounds[2])**2)
-                if distance < min_distance:
-                    min_distance = distance
-                    target_position = position
-                    index = i
-        # 5. 设置agent的旋转角度
-        if index == 0:
-            # 180, 270
-            target_rotation = dict(x=0, y=225, z=0)
-        elif index == 1:
-            # 270, 360
-            target_rotation = dict(x=0, y=315, z=0)
-        elif index == 2:
-            # 90,180
-            target_rotation = dict(x=0, y=135, z=0)
-        else:
-            # 0,90
-            target_rotation = dict(x=0, y=45, z=0)
-        
-        # 6. agent导航到可达位置
+        # 6. agent导航到与四个点最近的可达位置, 失败则换下一个最近的位置
         while True:
+            nearest = grid.nearest_to_any(corners, exclude=pre_target_positions)
+            if nearest is None:
+                raise RuntimeError(f"no reachable position to start from in {self.scene}")
+            index, target_position = nearest
+            target_rotation = dict(x=0, y=corner_rotations[index], z=0)
             event = self.action.action_mapping["teleport"](self.controller, position=target_position, rotation=target_rotation, horizon=0)
             self.update_event()
             if event.metadata['lastActionSuccess']:
                 break
-            else:
-                pre_target_positions.append(target_position)
-                event = self.controller.step(dict(action='GetReachablePositions'))
-                reachable_positions = event.metadata['actionReturn']
-                
-                # 4. 计算与四个点最近的可达位置
-                min_distance = float("inf")
-                for i, scene_bounds in enumerate([scene_bounds2, scene_bounds3, scene_bounds6, scene_bounds7]):
-                    for position in reachable_positions:
-                        if position in pre_target_positions:
-                            continue
-                        distance = math.sqrt((position['x']-scene_bounds[0])**2 + (position['z']-scene_bounds[2])**2)
-                        if distance < min_distance:
-                            min_distance = distance
-                            target_position = position
-                            index = i
-                # 5. 设置agent的旋转角度
-                if index == 0:
-                    # 180, 270
-                    target_rotation = dict(x=0, y=225, z=0)
-                elif index == 1:
-                    # 270, 360
-                    target_rotation = dict(x=0, y=315, z=0)
-                elif index == 2:
-                    # 90,180
-                    target_rotation = dict(x=0, y=135, z=0)
-                else:
-                    # 0,90
-                    target_rotation = dict(x=0, y=45, z=0)
-                print("Teleport failed, retrying...")
+            pre_target_positions.append(target_position)
+            print("Teleport failed, retrying...")
         self.action.action_mapping["teleport"](self.controller, position=target_position, rotation=target_rotation, horizon=0)
         self.update_event()
         # self.save_frame({"action": "init_agent_view"}, prefix_save_path="./data/init_scene_image")
@@ -239,11 +188,21 @@ class RocAgent(BaseAgent):
         #     item = random.choice(self.objecttype2object[item['objectType']])
         # self.pre_navigate_location = item['name']
         # 如果容器没打开，然后里面存在目标物体，就不能直接导航到目标物体
+        # 预计算的位置 (precompute_poses.py), 物体移动或打开后失效
+        precomputed_pose = None
+        current_item = self.eventobject.get_object_by_id(self.controller.last_event, item["objectId"])
+        # poses.json may not be the same when a recording is replayed, compute the pose instead
+        if item["objectId"] not in self.objid2position and current_item is not None and not is_recorded(self.controller):
+            precomputed_pose = scene_poses.lookup_pose(self.scene, current_item)
         if item["objectId"] in self.objid2position:
             target_position = self.objid2position[item["objectId"]]["agent_teleport_position"]
             target_rotation = self.objid2position[item["objectId"]]["agent_rotation"]
             horizon = self.objid2position[item["objectId"]]["agent_cameraHorizon"]
             print("设定位置", self.objid2position)
+        elif precomputed_pose is not None:
+            target_position = precomputed_pose["agent_teleport_position"]
+            target_rotation = precomputed_pose["agent_rotation"]
+            horizon = precomputed_pose["agent_cameraHorizon"]
         else:
             target_position, target_rotation = self.compute_position_8(item, pre_target_positions=[])
             horizon = 60
@@ -258,12 +217,18 @@ class RocAgent(BaseAgent):
         while not event.metadata['lastActionSuccess']:
             index += 1
             print(f"teleport failed, retrying...{index}")
+            # 预计算位置不可用, 回到运行时计算
+            precomputed_pose = None
             pre_target_positions.append(target_position)
             target_position, target_rotation = self.compute_position_8(item, pre_target_positions)
             event = self.action.action_mapping["teleport"](self.controller, position=target_position, rotation=target_rotation)
             self.update_event()
         
-        if item["objectId"] not in self.objid2position:
+        if precomputed_pose is not None:
+            if precomputed_pose["agent_isstanding"] != self.controller.last_event.metadata["agent"]["isStanding"]:
+                self.action.action_mapping["stand" if precomputed_pose["agent_isstanding"] else "crouch"](self.controller)
+                self.update_event()
+        elif item["objectId"] not in self.objid2position:
             self.adjust_height(item)
             self.adjust_view(item)
 
@@ -283,42 +248,81 @@ class RocAgent(BaseAgent):
         return image_fp, legal_navigations, legal_interactions
     
     def observe(self):
-        image_fp, legal_navigations, legal_interactions = [], None, None
+        images, legal_navigations, legal_interactions = [], None, None
         for i in range(3):
             self.action.action_mapping["rotate_left"](self.controller, 90)
             
-            image_fp.append(self.save_frame({"step_count": str(self.step_count),
-                                        "i": str(i),
-                                        "action": "observe"},
-                                        prefix_save_path=self.result_dir))
+            if OBSERVE_VIEWS:
+                self.save_frame({"step_count": str(self.step_count),
+                                 "i": str(i),
+                                 "action": "observe"},
+                                 prefix_save_path=self.result_dir)
+            # 直接用内存中的画面 (RGB), 转成cv2的BGR
+            images.append(np.ascontiguousarray(self.controller.last_event.frame[:, :, ::-1]))
             legal_navigations = self.get_legal_navigations()
 
-        for i in range(3):
-            images = [cv2.imread(path) for path in image_fp]
-            img1 = add_text_to_image(images[0], "left view", (10, images[0].shape[0] - 20))
-            img2 = add_text_to_image(images[1], "back view", (10, images[1].shape[0] - 20))
-            img3 = add_text_to_image(images[2], "right view", (10, images[2].shape[0] - 25))
-            # 为图片添加边框（注意：只给中间的图片添加左右边框）
-            img2_with_border = add_border(img2, 5, (0, 0, 0))
-            # 水平拼接
-            img_h_concat = np.concatenate((img1, img2_with_border, img3), axis=1)
-            # 保存结果
-            output_path = self.save_frame({"step_count": str(self.step_count),
-                                            # "i": str(i),
+        img1 = add_text_to_image(images[0], "left view", (10, images[0].shape[0] - 20))
+        img2 = add_text_to_image(images[1], "back view", (10, images[1].shape[0] - 20))
+        img3 = add_text_to_image(images[2], "right view", (10, images[2].shape[0] - 25))
+        # 为图片添加边框（注意：只给中间的图片添加左右边框）
+        img2_with_border = add_border(img2, 5, (0, 0, 0))
+        # 水平拼接
+        img_h_concat = np.concatenate((img1, img2_with_border, img3), axis=1)
+        # 保存结果
+        path, image_name = self.frame_path({"step_count": str(self.step_count),
                                             "action": "observe"},
                                             prefix_save_path=self.result_dir)
-            try:
-                cv2.imwrite(output_path, img_h_concat)
-                break
-            except Exception as e:
-                print("try_save_image")
-                print(e)
+        output_path = self.save_image(f"{path}/{self.scene}{image_name}.png", np.ascontiguousarray(img_h_concat[:, :, ::-1]))
         
         self.action.action_mapping["rotate_left"](self.controller, 90)
         legal_interactions = self.get_legal_interactions()
         
         return output_path, legal_navigations, legal_interactions
         
+    def probe_lateral_moves(self, distance, use_grid=reachable.REACHABLE_GRID):
+        """
+        errorMessage and agent x/z after move_right and after move_left, like trying both moves
+        in the simulator. With use_grid the scene's reachable grid answers when it has a free
+        side; it doesn't know about doors opened or objects moved since the scene was loaded,
+        so the caller probes the simulator again when the chosen move fails.
+        """
+        if use_grid:
+            grid = reachable.load_reachable_grid(self.controller, self.scene)
+            agent = self.controller.last_event.metadata["agent"]
+            x, z = agent["position"]["x"], agent["position"]["z"]
+            yaw = math.radians(agent["rotation"]["y"])
+            # move_right/move_left turn 90 degrees and move ahead, a blocked move stays in place
+            xr, zr = x + distance * math.cos(yaw), z - distance * math.sin(yaw)
+            xl, zl = x - distance * math.cos(yaw), z + distance * math.sin(yaw)
+            right_free, left_free = grid.is_free(x, z, xr, zr), grid.is_free(x, z, xl, zl)
+            if right_free or left_free:
+                if not right_free:
+                    xr, zr = x, z
+                if not left_free:
+                    xl, zl = x, z
+                errorMessage1 = "" if right_free else "blocked on the right"
+                errorMessage2 = "" if left_free else "blocked on the left"
+                return errorMessage1, xr, zr, errorMessage2, xl, zl
+
+        self.action.action_mapping["move_right"](self.controller, distance)
+        print("RocAgent",self.controller.last_event)
+        errorMessage1=self.controller.last_event.metadata["errorMessage"]
+        agentxright=self.controller.last_event.metadata["agent"]["position"]["x"]
+        agentzright=self.controller.last_event.metadata["agent"]["position"]["z"]  
+
+        if errorMessage1=="":
+            self.action.action_mapping["move_left"](self.controller, distance)#回到原位
+            
+        self.action.action_mapping["move_left"](self.controller, distance)#左移动
+        print("RocAgent",self.controller.last_event)
+        errorMessage2=self.controller.last_event.metadata["errorMessage"]
+        agentxleft=self.controller.last_event.metadata["agent"]["position"]["x"]
+        agentzleft=self.controller.last_event.metadata["agent"]["position"]["z"] 
+        
+        if errorMessage2=="":
+            self.action.action_mapping["move_right"](self.controller, distance)#回到原位
+        return errorMessage1, agentxright, agentzright, errorMessage2, agentxleft, agentzleft
+
     def move_forward(self, distance=0.5):
         
         image_fp, legal_navigations, legal_interactions = None, None, None
@@ -346,122 +350,113 @@ class RocAgent(BaseAgent):
             # 根据那个位置离目标物体更近
             # import pdb;pdb.set_trace()
             if self.related_objects:
-                distance_right_list = []
-                distance_left_list = []
+                # the grid is the scene as it was loaded, if the move it allowed fails probe the simulator
+                use_grid = reachable.REACHABLE_GRID
+                while True:
+                    distance_right_list = []
+                    distance_left_list = []
                 
-                # move_r_or_l=random.choice(["move_right","move_left"])
-                self.action.action_mapping["move_right"](self.controller, distance)
-                print("RocAgent",self.controller.last_event)
-                errorMessage1=self.controller.last_event.metadata["errorMessage"]
-                agentxright=self.controller.last_event.metadata["agent"]["position"]["x"]
-                agentzright=self.controller.last_event.metadata["agent"]["position"]["z"]  
-
-                if errorMessage1=="":
-                    self.action.action_mapping["move_left"](self.controller, distance)#回到原位
-                    
-                self.action.action_mapping["move_left"](self.controller, distance)#左移动
-                print("RocAgent",self.controller.last_event)
-                errorMessage2=self.controller.last_event.metadata["errorMessage"]
-                agentxleft=self.controller.last_event.metadata["agent"]["position"]["x"]
-                agentzleft=self.controller.last_event.metadata["agent"]["position"]["z"] 
+                    # move_r_or_l=random.choice(["move_right","move_left"])
+                    errorMessage1, agentxright, agentzright, errorMessage2, agentxleft, agentzleft = self.probe_lateral_moves(distance, use_grid)
                 
-                if errorMessage2=="":
-                    self.action.action_mapping["move_right"](self.controller, distance)#回到原位
-                
-                for obj_id in self.related_objects:
-                    item = self.eventobject.get_object_by_id(self.controller.last_event,obj_id)
-                    if item["visible"]==True:
-                        itemx=item["position"]["x"]
-                        itemz=item["position"]["z"]
+                    for obj_id in self.related_objects:
+                        item = self.eventobject.get_object_by_id(self.controller.last_event,obj_id)
+                        if item["visible"]==True:
+                            itemx=item["position"]["x"]
+                            itemz=item["position"]["z"]
                         
-                        # 计算右侧移动后的距离
-                        distance_right = math.sqrt((agentxright - itemx) ** 2 + (agentzright - itemz) ** 2)
-                        distance_right_list.append(distance_right)
-                        # 计算左侧移动后的距离
-                        distance_left = math.sqrt((agentxleft - itemx) ** 2 + (agentzleft - itemz) ** 2)
-                        distance_left_list.append(distance_left)
+                            # 计算右侧移动后的距离
+                            distance_right = math.sqrt((agentxright - itemx) ** 2 + (agentzright - itemz) ** 2)
+                            distance_right_list.append(distance_right)
+                            # 计算左侧移动后的距离
+                            distance_left = math.sqrt((agentxleft - itemx) ** 2 + (agentzleft - itemz) ** 2)
+                            distance_left_list.append(distance_left)
                    
-                if errorMessage1=="" and errorMessage2=="" and distance_right_list and distance_left_list:# 左右都能移动，选择移动后距离目标物体最近的方向
-                    # 1. 选择平均距离所有目标物体最小的方向
-                    # avg_distance_right = sum(distance_right_list) / len(distance_right_list)
-                    # avg_distance_left = sum(distance_left_list) / len(distance_left_list)
-                    # if avg_distance_right < avg_distance_left:
-                    #     direction = "move_right"
-                    # else:
-                    #     direction = "move_left"
+                    if errorMessage1=="" and errorMessage2=="" and distance_right_list and distance_left_list:# 左右都能移动，选择移动后距离目标物体最近的方向
+                        # 1. 选择平均距离所有目标物体最小的方向
+                        # avg_distance_right = sum(distance_right_list) / len(distance_right_list)
+                        # avg_distance_left = sum(distance_left_list) / len(distance_left_list)
+                        # if avg_distance_right < avg_distance_left:
+                        #     direction = "move_right"
+                        # else:
+                        #     direction = "move_left"
                     
-                    # 2. 选择使最近物体距离最小的方向
+                        # 2. 选择使最近物体距离最小的方向
                     
-                    min_distance_right = min(distance_right_list)
-                    min_distance_left = min(distance_left_list)
+                        min_distance_right = min(distance_right_list)
+                        min_distance_left = min(distance_left_list)
                     
-                    if min_distance_right < min_distance_left:
-                        direction = "move_right"
-                    else:
-                        direction = "move_left"
+                        if min_distance_right < min_distance_left:
+                            direction = "move_right"
+                        else:
+                            direction = "move_left"
                     
-                    #向direction侧移动后 距离n个目标物体中 其中1个最近 
-                    self.action.action_mapping[direction](self.controller, distance)
-                    if self.controller.last_event.metadata["errorMessage"]=="":
-                        image_fp = self.save_frame({"step_count": str(self.step_count),
-                                                "action": "move_forward"},
-                                                prefix_save_path=self.result_dir)
-                        legal_navigations = self.get_legal_navigations()
-                        legal_interactions = self.get_legal_interactions()
-                        return image_fp, legal_navigations, legal_interactions  
+                        #向direction侧移动后 距离n个目标物体中 其中1个最近 
+                        self.action.action_mapping[direction](self.controller, distance)
+                        if self.controller.last_event.metadata["errorMessage"]=="":
+                            image_fp = self.save_frame({"step_count": str(self.step_count),
+                                                    "action": "move_forward"},
+                                                    prefix_save_path=self.result_dir)
+                            legal_navigations = self.get_legal_navigations()
+                            legal_interactions = self.get_legal_interactions()
+                            return image_fp, legal_navigations, legal_interactions  
                     
-                elif errorMessage1=="" or errorMessage2=="":  # 左右有一个方向能够移动，选择能够移动的方向
-                    if errorMessage1=="":
-                        self.action.action_mapping["move_right"](self.controller, distance)
+                    elif errorMessage1=="" or errorMessage2=="":  # 左右有一个方向能够移动，选择能够移动的方向
+                        if errorMessage1=="":
+                            self.action.action_mapping["move_right"](self.controller, distance)
                         
-                    elif errorMessage2=="":
-                        self.action.action_mapping["move_left"](self.controller, distance)
+                        elif errorMessage2=="":
+                            self.action.action_mapping["move_left"](self.controller, distance)
                     
-                    print("RocAgent",self.controller.last_event)                  
-                    if self.controller.last_event.metadata["errorMessage"]=="":
-                        image_fp = self.save_frame({"step_count": str(self.step_count),
-                                                "action": "move_forward"},
-                                                prefix_save_path=self.result_dir)
-                        legal_navigations = self.get_legal_navigations()
-                        legal_interactions = self.get_legal_interactions()
-                        return image_fp, legal_navigations, legal_interactions
+                        print("RocAgent",self.controller.last_event)                  
+                        if self.controller.last_event.metadata["errorMessage"]=="":
+                            image_fp = self.save_frame({"step_count": str(self.step_count),
+                                                    "action": "move_forward"},
+                                                    prefix_save_path=self.result_dir)
+                            legal_navigations = self.get_legal_navigations()
+                            legal_interactions = self.get_legal_interactions()
+                            return image_fp, legal_navigations, legal_interactions
                 
-                else:
-                    self.action.action_mapping["move_back"](self.controller, distance)  # 向后移动
-                    print("RocAgent",self.controller.last_event)
-                    if self.controller.last_event.metadata["errorMessage"]=="":
-                        image_fp = self.save_frame({"step_count": str(self.step_count),
-                                        "action": "move_forward"},
-                                        prefix_save_path=self.result_dir)
-                        legal_navigations = self.get_legal_navigations()
-                        legal_interactions = self.get_legal_interactions()
-                        return image_fp, legal_navigations, legal_interactions
-                    
                     else:
-                        self.action.action_mapping["rotate_right"](self.controller,degrees=90)
-                        errorMessage_rotate_right=self.controller.last_event.metadata["errorMessage"]
-                        self.action.action_mapping["move_ahead"](self.controller, distance)
+                        self.action.action_mapping["move_back"](self.controller, distance)  # 向后移动
                         print("RocAgent",self.controller.last_event)
                         if self.controller.last_event.metadata["errorMessage"]=="":
                             image_fp = self.save_frame({"step_count": str(self.step_count),
-                                        "action": "move_forward"},
-                                        prefix_save_path=self.result_dir)
+                                            "action": "move_forward"},
+                                            prefix_save_path=self.result_dir)
                             legal_navigations = self.get_legal_navigations()
                             legal_interactions = self.get_legal_interactions()
                             return image_fp, legal_navigations, legal_interactions
+                    
                         else:
-                            if errorMessage_rotate_right=="":#向左转
-                                self.action.action_mapping["rotate_left"](self.controller,degrees=180)
+                            self.action.action_mapping["rotate_right"](self.controller,degrees=90)
+                            errorMessage_rotate_right=self.controller.last_event.metadata["errorMessage"]
                             self.action.action_mapping["move_ahead"](self.controller, distance)
                             print("RocAgent",self.controller.last_event)
                             if self.controller.last_event.metadata["errorMessage"]=="":
                                 image_fp = self.save_frame({"step_count": str(self.step_count),
-                                        "action": "move_forward"},
-                                        prefix_save_path=self.result_dir)
+                                            "action": "move_forward"},
+                                            prefix_save_path=self.result_dir)
                                 legal_navigations = self.get_legal_navigations()
                                 legal_interactions = self.get_legal_interactions()
                                 return image_fp, legal_navigations, legal_interactions
-                    
+                            else:
+                                if errorMessage_rotate_right=="":#向左转
+                                    self.action.action_mapping["rotate_left"](self.controller,degrees=180)
+                                self.action.action_mapping["move_ahead"](self.controller, distance)
+                                print("RocAgent",self.controller.last_event)
+                                if self.controller.last_event.metadata["errorMessage"]=="":
+                                    image_fp = self.save_frame({"step_count": str(self.step_count),
+                                            "action": "move_forward"},
+                                            prefix_save_path=self.result_dir)
+                                    legal_navigations = self.get_legal_navigations()
+                                    legal_interactions = self.get_legal_interactions()
+                                    return image_fp, legal_navigations, legal_interactions
+                    if not (use_grid and (errorMessage1 == "" or errorMessage2 == "")):
+                        break
+                    use_grid = False
+                    print("RocAgent: lateral move from the reachable grid failed, probe the simulator")
+
             else:
                 self.action.action_mapping["move_right"](self.controller, distance)
                                     
@@ -909,6 +904,7 @@ class RocAgent(BaseAgent):
         return res
     
     # 全局可达位置
+    @perf.timed("legal_objects", "python")
     def get_legal_navigations(self):
         objects = self.get_navigate_location()
         for objectId, obj in objects.items():
@@ -928,6 +924,7 @@ class RocAgent(BaseAgent):
             return []
 
     # 全局可交互位置
+    @perf.timed("legal_objects", "python")
     def get_legal_interactions(self):
         legal_interactions = {}
         objects = self.get_navigate_location()
@@ -1,4 +1,8 @@
-from .utils import EventObject
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from common import frame_writer
+from .utils import EventObject, object_index
 from .components.Action import BaseAction
 import math
 import time
@@ -6,8 +10,124 @@ from PIL import Image
 from ai2thor.controller import Controller
 from ai2thor.platform import CloudRendering
 from abc import ABC, abstractmethod
+import perf
 
 import threading
+import weakref
+import copy
+import numpy as np
+
+# reuse the loaded scene when consecutive tasks share a FloorPlan, set SCENE_RESTORE=0 to always reset
+SCENE_RESTORE = os.getenv("SCENE_RESTORE", "1") == "1"
+STATE_KEYS = ("isOpen", "isToggled", "isPickedUp", "isFilledWithLiquid", "isDirty", "isCooked", "isSliced", "isBroken", "isUsedUp")
+scene_snapshots = weakref.WeakKeyDictionary() # controller -> state of its scene right after reset
+scene_load_stats = {"reset": 0, "restore": 0, "restore_failed": 0}
+# reuse GetInteractablePoses results while the target object hasn't moved or opened, POSE_CACHE=0 to disable
+POSE_CACHE = os.getenv("POSE_CACHE", "1") == "1"
+pose_caches = weakref.WeakKeyDictionary() # controller -> {"scene", "poses": objectId -> (signature, PoseCandidates)}
+pose_cache_stats = {"hit": 0, "miss": 0}
+# OBSERVE_VIEWS=1 also saves the left/back/right frames of observe next to the panorama
+OBSERVE_VIEWS = os.getenv("OBSERVE_VIEWS", "0") == "1"
+
+def scene_signature(event):
+    objects = []
+    for obj in event.metadata["objects"]:
+        objects.append((
+            obj["objectId"],
+            tuple(round(obj["position"][k], 2) for k in "xyz"),
+            tuple(round(obj["rotation"][k]) % 360 for k in "xyz"),
+            tuple(obj.get(k) for k in STATE_KEYS),
+            tuple(sorted(obj["receptacleObjectIds"] or [])),
+        ))
+    return sorted(objects), event.metadata.get("fov")
+
+def snapshot_scene(controller, scene, params):
+    scene_load_stats["reset"] += 1
+    metadata = copy.deepcopy(controller.last_event.metadata)
+    agent = metadata["agent"]
+    scene_snapshots[controller] = {
+        "scene": scene,
+        "params": params,
+        "objects": metadata["objects"],
+        "poses": [{"objectName": obj["name"], "position": obj["position"], "rotation": obj["rotation"]}
+                  for obj in metadata["objects"] if obj["pickupable"] or obj["moveable"]],
+        "agent": {"position": agent["position"], "rotation": agent["rotation"],
+                  "horizon": agent["cameraHorizon"], "standing": agent["isStanding"]},
+        "signature": scene_signature(controller.last_event),
+    }
+
+def restore_scene(controller, scene, params):
+    """
+    Put the already loaded scene back into its post-reset state instead of reloading it.
+    Returns False (caller does a full reset) if the scene or reset parameters differ, or
+    if the restored state doesn't match the snapshot, e.g. after cooking or filling objects.
+    """
+    snapshot = scene_snapshots.get(controller)
+    if not SCENE_RESTORE or snapshot is None or snapshot["scene"] != scene or snapshot["params"] != params:
+        return False
+    try:
+        if controller.last_event.metadata["inventoryObjects"]:
+            controller.step(action="DropHandObject", forceAction=True)
+        current = {obj["objectId"]: obj for obj in controller.last_event.metadata["objects"]}
+        for obj in snapshot["objects"]:
+            cur = current.get(obj["objectId"])
+            if cur is None:
+                continue
+            if obj["openable"] and cur["isOpen"] != obj["isOpen"]:
+                if obj["isOpen"]:
+                    controller.step(action="OpenObject", objectId=obj["objectId"], openness=obj["openness"], forceAction=True)
+                else:
+                    controller.step(action="CloseObject", objectId=obj["objectId"], forceAction=True)
+            if obj["toggleable"] and cur["isToggled"] != obj["isToggled"]:
+                action = "ToggleObjectOn" if obj["isToggled"] else "ToggleObjectOff"
+                controller.step(action=action, objectId=obj["objectId"], forceAction=True)
+        event = controller.step(action="SetObjectPoses", objectPoses=snapshot["poses"])
+        if not event.metadata["lastActionSuccess"]:
+            raise RuntimeError(event.metadata["errorMessage"])
+        event = controller.step(action="TeleportFull", forceAction=True, **snapshot["agent"])
+        if not event.metadata["lastActionSuccess"]:
+            raise RuntimeError(event.metadata["errorMessage"])
+        if scene_signature(controller.last_event) != snapshot["signature"]:
+            raise RuntimeError("scene state differs from snapshot")
+    except Exception as e:
+        print(f"restore scene {scene} failed, reset: {e}")
+        scene_load_stats["restore_failed"] += 1
+        return False
+    scene_load_stats["restore"] += 1
+    return True
+
+class PoseCandidates:
+    """
+    Interactable poses of one object, with their x/z packed into an array for the
+    distance and rotation bucket masks of compute_position_8.
+    """
+    def __init__(self, poses):
+        self.poses = poses
+        self.xz = np.array([(p["x"], p["z"]) for p in poses], dtype=np.float64).reshape(-1, 2)
+
+def pose_signature(event, obj):
+    agent_holding = tuple(o["objectId"] for o in event.metadata["inventoryObjects"])
+    return (tuple(obj["position"][k] for k in "xyz"), tuple(obj["rotation"][k] for k in "xyz"),
+            obj.get("isOpen"), obj.get("openness"), agent_holding)
+
+def interactable_poses(controller, scene, object_id):
+    cache = pose_caches.get(controller)
+    if cache is None or cache["scene"] != scene:
+        cache = pose_caches[controller] = {"scene": scene, "poses": {}}
+    # the caller's item dict may be stale, check the object's current state
+    obj = object_index(controller.last_event).by_id.get(object_id)
+    signature = pose_signature(controller.last_event, obj) if obj is not None else None
+    entry = cache["poses"].get(object_id)
+    if POSE_CACHE and entry is not None and signature is not None and entry[0] == signature:
+        pose_cache_stats["hit"] += 1
+        return entry[1]
+    pose_cache_stats["miss"] += 1
+    event = controller.step(dict(action='GetInteractablePoses', objectId=object_id))
+    candidates = PoseCandidates(event.metadata['actionReturn'] or [])
+    if signature is not None and event.metadata["lastActionSuccess"]:
+        cache["poses"][object_id] = (signature, candidates)
+    return candidates
+
 class BaseAgent(ABC):
 
     def __init__(self, controller: Controller, scene="FloorPlan203", 
@@ -48,38 +168,25 @@ class BaseAgent(ABC):
         self.visibilityDistance = visibilityDistance
         self.gridSize = gridSize
         self.fieldOfView = fieldOfView
-        if platform_type=="GPU":
-            controller.reset(
-                # platform=CloudRendering,
-                snapToGrid=False,
-                quality='Medium',
-                agentMode="default",
-                massThreshold=None,
-                scene=scene,
-                visibilityDistance=visibilityDistance,
-                # gridSize=gridSize,
-                renderDepthImage=False,
-                renderInstanceSegmentation=False,
-                width=800,
-                height=450,
-                fieldOfView=fieldOfView,
-            )
-        else: 
-            controller.reset(
-                snapToGrid=False,
-                quality='Medium',
-                agentMode="default",
-                massThreshold=None,
-                scene=scene,
-                visibilityDistance=visibilityDistance,
-                # gridSize=gridSize,
-                renderDepthImage=False,
-                renderInstanceSegmentation=False,
-                width=800,
-                height=450,
-                fieldOfView=fieldOfView,
-            )   
-        
+        reset_params = dict(
+            snapToGrid=False,
+            quality='Medium',
+            agentMode="default",
+            massThreshold=None,
+            visibilityDistance=visibilityDistance,
+            # gridSize=gridSize,
+            renderDepthImage=False,
+            renderInstanceSegmentation=False,
+            width=800,
+            height=450,
+            fieldOfView=fieldOfView,
+        )
+        if restore_scene(controller, scene, reset_params):
+            print(f"******** Scene {scene} restored without reload ********")
+        else:
+            controller.reset(scene=scene, **reset_params)
+            snapshot_scene(controller, scene, reset_params)
+            
         self.controller = controller
         # self.controller = Controller(
         #     platform=CloudRendering, # 无头模式
@@ -100,6 +207,8 @@ class BaseAgent(ABC):
         # )
         self.eventobject = EventObject()
         self.step_count = 0
+        self.keep_frames = False
+        self.frames = {} # image path -> RGB frame, only filled when keep_frames is set
         self.last_action = "INIT"
         self.mermory = []
         self.action = BaseAction()
@@ -158,8 +267,10 @@ class BaseAgent(ABC):
     def get_camera_rotation(self):
         return self.controller.last_event.pose_discrete[3]
 
-    def save_frame(self, kargs={}, prefix_save_path="./data/item_image"):
-        import os
+    def frame_path(self, kargs={}, prefix_save_path="./data/item_image"):
+        """
+        Directory and file name suffix save_frame uses for kargs, the directory is created.
+        """
         if prefix_save_path != "./data/item_image":
             path = prefix_save_path
         else:
@@ -171,24 +282,28 @@ class BaseAgent(ABC):
         for key in kargs.keys():
             if key != "third_party_camera_frames" and key != "no_agent_view":
                 image_name += f"_{kargs[key]}"
+        return path, image_name
+
+    @perf.timed("save_frame", "io")
+    def save_image(self, image_path, frame):
+        # frame: RGB array, encoded and written by the frame writer, returns the final path
+        image_path = frame_writer.save(image_path, frame)
+        if self.keep_frames:
+            self.frames[image_path] = frame
+        return image_path
+
+    def save_frame(self, kargs={}, prefix_save_path="./data/item_image"):
+        path, image_name = self.frame_path(kargs, prefix_save_path)
                 
         # 获取第三方相机的图像
         if "third_party_camera_frames" in kargs.keys():
-            image = Image.fromarray(self.controller.last_event.third_party_camera_frames[-1])
-            # current_path = os.getcwd()
-            # full_path = os.path.join(current_path, path)
-            # full_path = os.path.normpath(full_path)
-            image.save(f"{path}/{self.scene}_third_party{image_name}.png", format="PNG")
+            frame_writer.save(f"{path}/{self.scene}_third_party{image_name}.png", self.controller.last_event.third_party_camera_frames[-1])
             kargs.pop("third_party_camera_frames")
         
         if "no_agent_view" not in kargs.keys():
-            image = Image.fromarray(self.controller.last_event.frame)
-            # current_path = os.getcwd()
-            # full_path = os.path.join(current_path, path)
-            # full_path = os.path.normpath(full_path)
-            image.save(f"{path}/{self.scene}{image_name}.png", format="PNG")
+            return self.save_image(f"{path}/{self.scene}{image_name}.png", self.controller.last_event.frame)
 
-        return f"{path}/{self.scene}{image_name}.png"
+        return frame_writer.get_writer().frame_path(f"{path}/{self.scene}{image_name}.png")
 
     def arm_reset(self):
         try:
@@ -296,16 +411,19 @@ class BaseAgent(ABC):
     def compute_position_8(self, item, pre_target_positions):
         target_position = None
         target_rotation = None
-        event = self.controller.step(dict(action='GetInteractablePoses', objectId=item['objectId']))
-        # event = self.controller.step(dict(action='GetReachablePositions'))
-        reachable_positions = event.metadata['actionReturn']
-        reachable_positions = [position for position in reachable_positions if math.sqrt((position['x'] - item['position']['x'])**2 + (position['z'] - item['position']['z'])**2) <= 1.5]
-        if len(reachable_positions) == 0:
+        candidates = interactable_poses(self.controller, self.scene, item['objectId'])
+        dx = candidates.xz[:, 0] - item['position']['x']
+        dz = candidates.xz[:, 1] - item['position']['z']
+        # float_power rounds like python's ** so boundary positions are kept as before
+        mask = np.sqrt(np.float_power(dx, 2) + np.float_power(dz, 2)) <= 1.5
+        if not mask.any():
             print("No reachable positions found.")
             return target_position, target_rotation
         if pre_target_positions != []:
-            reachable_positions = [position for position in reachable_positions \
-                               if position not in pre_target_positions]
+            mask &= np.array([position not in pre_target_positions for position in candidates.poses], dtype=bool)
+        index = np.flatnonzero(mask)
+        reachable_positions = [candidates.poses[i] for i in index]
+        dx, dz = dx[index], dz[index]
         # 如果物体体积小于0.01，选择距离最近的位置
         if self.eventobject.get_item_volume(self.controller.last_event, item['name']) <= 0.1 and self.eventobject.get_item_surface_area(self.controller.last_event, item['name']) <= 1:
             target_position, target_rotation = self.compute_position_1(item, reachable_positions)
@@ -315,88 +433,54 @@ class BaseAgent(ABC):
         # 四舍五入(item["rotation"]['y'])
         item_rotation = min(angles, key=lambda angle: abs(angle - round(item["rotation"]['y'])))
         item_rotation = 0 if item_rotation == 360 else item_rotation
-        target_position = None
-        target_rotation = None
-        candidate_positions = []
 
-        if item_rotation == 180: # agent x最接近/相等，z比item小
-            target_rotation = dict(x=0, y=0, z=0)
-            # 将agent的x坐标与item的x坐标相等的位置,或者x坐标位置小于最小距离的位置, 
+        # agent relative to the item, shared by all rotation buckets
+        left, right, below, above = dx < 0, dx > 0, dz < 0, dz > 0
+
+        def take(m):
+            return [reachable_positions[i] for i in np.flatnonzero(m)]
+
+        def aligned(d):
+            # 坐标与item相等的位置, 逐步放宽到0.5
             for tolerance in [0.1, 0.2, 0.3, 0.4, 0.5]:
-                if len(candidate_positions) == 0:
-                    candidate_positions = [position for position in reachable_positions if abs(position['x'] - item['position']['x']) <= tolerance]
-                else:
+                m = np.abs(d) <= tolerance
+                if m.any():
                     break
-            front_positions = []
-            back_positions = []         
-            for position in candidate_positions:
-                if position['z'] < item['position']['z']:
-                    front_positions.append(position)
-                elif position['z'] > item['position']['z']:
-                    back_positions.append(position)
+            return m
 
+        if item_rotation == 180: # agent x最接近/相等，z比item小
+            target_rotation = dict(x=0, y=0, z=0)
+            candidate = aligned(dx)
+            front_positions = take(candidate & below)
             # 如果正面位置存在，选择夹角最小的位置
             if len(front_positions) > 0:
                 target_position = self.compute_closest_positions(item, front_positions)
-            
-            # 如果正面位置不存在，选择夹角最小的背面位置
-            if target_rotation is None and len(back_positions) > 0:
-                target_rotation = dict(x=0, y=180, z=0)
-                target_position = self.compute_closest_positions(item, back_positions)
 
         elif item_rotation == 270: # agent z最接近/相等，x比item小
             target_rotation = dict(x=0, y=90, z=0)
-            # 将agent的z坐标与item的z坐标相等的位置,或者z坐标位置小于最小距离的位置,
-            for tolerance in [0.1, 0.2, 0.3, 0.4, 0.5]:
-                if len(candidate_positions) == 0:
-                    candidate_positions = [position for position in reachable_positions if abs(position['z'] - item['position']['z']) <= tolerance]
-                else:
-                    break
-            front_positions = []
-            back_positions = []
-            for position in candidate_positions:
-                if position['x'] < item['position']['x']:
-                    front_positions.append(position)
-                elif position['x'] > item['position']['x']:
-                    back_positions.append(position)
-
+            candidate = aligned(dz)
+            front_positions = take(candidate & left)
+            back_positions = take(candidate & right)
             # 如果正面位置存在，选择夹角最小的位置
             if len(front_positions) > 0:
                 target_position = self.compute_closest_positions(item, front_positions)
-            
             # 如果正面位置不存在，选择夹角最小的背面位置
             if target_position is None and len(back_positions) > 0:
                 target_rotation = dict(x=0, y=270, z=0)
                 target_position = self.compute_closest_positions(item, back_positions)
-            
+
         elif item_rotation == 0: # agent x最接近/相等，z比item大
             target_rotation = dict(x=0, y=180, z=0)
-            # 将agent的x坐标与item的x坐标相等的位置,或者x坐标位置小于最小距离的位置
-            for tolerance in [0.1, 0.2, 0.3, 0.4, 0.5]:
-                if len(candidate_positions) == 0:
-                    candidate_positions = [position for position in reachable_positions if abs(position['z'] - item['position']['z']) <= tolerance]
-                else:
-                    break
-
-            front_positions = []
-            back_positions = []
-            for position in candidate_positions:
-                if position['z'] > item['position']['z']:
-                    front_positions.append(position)
-                elif position['z'] < item['position']['z']:
-                    back_positions.append(position)
-            
-            # 如果正面位置存在，选择夹角最小的位置
+            candidate = aligned(dz)
+            front_positions = take(candidate & above)
+            back_positions = take(candidate & below)
             target_position_front=None
             if len(front_positions) > 0:
                 target_position_front = self.compute_closest_positions(item, front_positions)
-            
-            # 如果正面位置不存在，选择夹角最小的背面位置
             target_position_back=None
             if len(back_positions) > 0:
                 target_rotation = dict(x=0, y=0, z=0)
                 target_position_back = self.compute_closest_positions(item, back_positions)
-
             # 选择和物品距离最近的位置
             if target_position_front is not None and target_position_back is not None:
                 distance_front = math.sqrt((target_position_front['x'] - item['position']['x'])**2 + (target_position_front['z'] - item['position']['z'])**2)
@@ -412,120 +496,39 @@ class BaseAgent(ABC):
 
         elif item_rotation == 90: # agent z最接近/相等，x比item大
             target_rotation = dict(x=0, y=270, z=0)
-            # 将agent的z坐标与item的z坐标相等的位置,或者z坐标位置小于最小距离的位置, 
-            for tolerance in [0.1, 0.2, 0.3, 0.4, 0.5]:
-                if len(candidate_positions) == 0:
-                    candidate_positions = [position for position in reachable_positions if abs(position['z'] - item['position']['z']) <= tolerance]
-                else:
-                    break
-            front_positions = []
-            back_positions = []
-            for position in candidate_positions:
-                if position['x'] > item['position']['x']:
-                    front_positions.append(position)
-                elif position['x'] < item['position']['x']:
-                    back_positions.append(position)
-            
-            # 如果正面位置存在，选择夹角最小的位置
+            candidate = aligned(dz)
+            front_positions = take(candidate & right)
+            back_positions = take(candidate & left)
             if len(front_positions) > 0:
                 target_position = self.compute_closest_positions(item, front_positions)
-            
-            # 如果正面位置不存在，选择夹角最小的背面位置
             elif len(back_positions) > 0:
                 target_rotation = dict(x=0, y=90, z=0)
                 target_position = self.compute_closest_positions(item, back_positions)
 
-        elif item_rotation == 45: # agent x比item大，z比item大
-            target_rotation = dict(x=0, y=225, z=0)
-            front_positions = []
-            back_positions = []
-            for position in reachable_positions:
-                # 将agent的x坐标大于item的x坐标的位置, 以及agent的z坐标大于item的z坐标的位置加入候选位置
-                if position['x'] > item['position']['x'] and position['z'] > item['position']['z']:
-                    front_positions.append(position)
-                elif position['x'] < item['position']['x'] and position['z'] < item['position']['z']:
-                    back_positions.append(position)
-            
-            # 如果正面位置存在，选择夹角最小的位置
-            if len(front_positions) > 0:
-                target_position = self.compute_closest_positions(item, front_positions)
-
-            # 如果正面位置不存在，选择夹角最小的背面位置
-            if target_position is None and len(back_positions) > 0:
-                target_rotation = dict(x=0, y=45, z=0)
-                target_position = self.compute_closest_positions(item, back_positions)
-
         elif item_rotation == 135: # agent x比item大，z比item小
             target_rotation = dict(x=0, y=315, z=0)
-            front_positions = []
-            back_positions = []
-            front_side_positions = []
-            back_side_positions = []
-            for position in reachable_positions:
-                # 将agent的x坐标小于item的x坐标的位置, 以及agent的z坐标大于item的z坐标的位置加入候选位置
-                if position['x'] > item['position']['x'] and position['z'] < item['position']['z']:
-                    front_positions.append(position)
-                elif position['x'] < item['position']['x'] and position['z'] > item['position']['z']:
-                    back_positions.append(position)
-                # 侧边位置x坐标大于item的x坐标的位置且z坐标大于item的z坐标
-                elif position['x'] > item['position']['x'] and position['z'] > item['position']['z']:
-                    front_side_positions.append(position)
-                # 侧边
-                elif position['x'] < item['position']['x'] and position['z'] < item['position']['z']:
-                    back_side_positions.append(position)
-            # 如果正面位置存在，选择夹角最小的位置
+            # 正面位置, 背面位置, 然后两个侧边位置
+            for rotation, m in [(315, right & below), (135, left & above), (225, right & above), (45, left & below)]:
+                positions = take(m)
+                if len(positions) > 0:
+                    target_rotation = dict(x=0, y=rotation, z=0)
+                    target_position = self.compute_closest_positions(item, positions)
+                    if target_position is not None:
+                        break
+
+        else: # 45, 225, 315: 对角方向, 正面位置优先, 其次背面
+            front_rotation, front_mask, back_mask = {
+                45: (225, right & above, left & below),
+                225: (45, left & below, right & above),
+                315: (135, left & above, right & below),
+            }[item_rotation]
+            target_rotation = dict(x=0, y=front_rotation, z=0)
+            front_positions = take(front_mask)
+            back_positions = take(back_mask)
             if len(front_positions) > 0:
                 target_position = self.compute_closest_positions(item, front_positions)
-            # 如果正面位置不存在，选择夹角最小的背面位置
-            if target_position is None and len(back_positions) > 0:
-                target_rotation = dict(x=0, y=135, z=0)
-                target_position = self.compute_closest_positions(item, back_positions)
-            # 如果正面位置和背面位置都不存在，选择侧边位置
-            if target_position is None and len(front_side_positions) > 0:
-                target_rotation = dict(x=0, y=225, z=0)
-                target_position = self.compute_closest_positions(item, front_side_positions)
-            if target_position is None and len(back_side_positions) > 0:
-                target_rotation = dict(x=0, y=45, z=0)
-                target_position = self.compute_closest_positions(item, back_side_positions)
-
-        elif item_rotation == 225: # agent x比item小，z比item小
-            target_rotation = dict(x=0, y=45, z=0)
-            front_positions = []
-            back_positions = []
-            for position in reachable_positions:
-                # 将agent的x坐标小于item的x坐标的位置, 以及agent的z坐标小于item的z坐标的位置加入候选位置
-                if position['x'] < item['position']['x'] and position['z'] < item['position']['z']:
-                    front_positions.append(position)
-                elif position['x'] > item['position']['x'] and position['z'] > item['position']['z']:
-                    back_positions.append(position)
-
-            # 如果正面位置存在，选择夹角最小的位置
-            if len(front_positions) > 0:
-                target_position = self.compute_closest_positions(item, front_positions)
-            
-            # 如果正面位置不存在，选择夹角最小的背面位置
-            if target_position is None and len(back_positions) > 0:
-                target_rotation = dict(x=0, y=225, z=0)
-                target_position = self.compute_closest_positions(item, back_positions)
-                
-        elif item_rotation == 315: # agent x比item小，z比item大
-            target_rotation = dict(x=0, y=135, z=0)
-            front_positions = []
-            back_positions = []
-            for position in reachable_positions:
-                # 将agent的x坐标大于item的x坐标的位置, 以及agent的z坐标小于item的z坐标的位置加入候选位置
-                if position['x'] < item['position']['x'] and position['z'] > item['position']['z']:
-                    front_positions.append(position)
-                elif position['x'] > item['position']['x'] and position['z'] < item['position']['z']:
-                    back_positions.append(position)
-            
-            # 如果正面位置存在，选择夹角最小的位置
-            if len(front_positions) > 0:
-                target_position = self.compute_closest_positions(item, front_positions)
-
-            # 如果正面位置不存在，选择夹角最小的背面位置
             if target_position is None and len(back_positions) > 0:
-                target_rotation = dict(x=0, y=315, z=0)
+                target_rotation = dict(x=0, y=(front_rotation + 180) % 360, z=0)
                 target_position = self.compute_closest_positions(item, back_positions)
 
         if target_position is None:
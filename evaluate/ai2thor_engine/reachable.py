@@ -0,0 +1,141 @@
+"""
+Reachable positions of a scene, queried once with GetReachablePositions right after the
+scene is loaded and cached in memory and under ./data/scene_cache/<scene>/reachable_positions.json.
+
+ReachableGrid answers nearest-reachable lookups with NumPy and "is this point / segment
+free" with a hash of grid cells, so init and blocked moves don't need simulator probes.
+"""
+import os
+import json
+import math
+import threading
+
+import numpy as np
+
+from .replay import is_recorded
+
+# REACHABLE_GRID=0 queries the simulator every time like before
+REACHABLE_GRID = os.getenv("REACHABLE_GRID", "1") == "1"
+SCENE_CACHE_DIR = os.getenv("SCENE_CACHE_DIR", "./data/scene_cache")
+
+grids = {}
+grids_lock = threading.Lock()
+
+class ReachableGrid:
+    def __init__(self, positions, grid_size=None):
+        self.positions = positions
+        self.xz = np.array([(p["x"], p["z"]) for p in positions], dtype=np.float64).reshape(-1, 2)
+        self.points = self.xz.tolist()
+        self.scene_grid_size = grid_size # gridSize of the controller, None if unknown
+        self.grid_size = grid_size or self.estimate_grid_size()
+        self.cells = {}
+        for i, (x, z) in enumerate(self.points):
+            self.cells.setdefault(self.cell(x, z), []).append(i)
+
+    def estimate_grid_size(self):
+        steps = np.diff(np.unique(np.round(self.xz[:, 0], 3))) if len(self.xz) > 1 else np.array([])
+        steps = steps[steps > 1e-3]
+        return float(steps.min()) if len(steps) else 0.25
+
+    def cell(self, x, z):
+        return (int(math.floor(x / self.grid_size)), int(math.floor(z / self.grid_size)))
+
+    def nearest_to_any(self, points, exclude=()):
+        """
+        (point index, position) of the reachable position closest to any of `points` ([(x, z)]),
+        ties go to the earlier point and then the earlier position. None if nothing is left.
+        """
+        if len(self.positions) == 0 or len(points) == 0:
+            return None
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        distances = np.sqrt(np.float_power(self.xz[None, :, 0] - points[:, None, 0], 2)
+                            + np.float_power(self.xz[None, :, 1] - points[:, None, 1], 2))
+        if exclude:
+            excluded = np.array([position in exclude for position in self.positions], dtype=bool)
+            if excluded.all():
+                return None
+            distances[:, excluded] = np.inf
+        point_index, position_index = np.unravel_index(np.argmin(distances), distances.shape)
+        return int(point_index), self.positions[int(position_index)]
+
+    def nearest(self, x, z, exclude=()):
+        result = self.nearest_to_any([(x, z)], exclude)
+        return result[1] if result is not None else None
+
+    def is_reachable(self, x, z, tolerance=None):
+        tolerance = self.grid_size * 0.75 if tolerance is None else tolerance
+        cx, cz = self.cell(x, z)
+        reach = int(math.ceil(tolerance / self.grid_size))
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cz - reach, cz + reach + 1):
+                for k in self.cells.get((i, j), []):
+                    px, pz = self.points[k]
+                    if (px - x) ** 2 + (pz - z) ** 2 <= tolerance ** 2:
+                        return True
+        return False
+
+    def is_free(self, x0, z0, x1, z1):
+        # every grid step along the segment has to be close to a reachable position
+        steps = max(1, int(math.ceil(math.hypot(x1 - x0, z1 - z0) / self.grid_size)))
+        return all(self.is_reachable(x0 + (x1 - x0) * t / steps, z0 + (z1 - z0) * t / steps) for t in range(1, steps + 1))
+
+def controller_grid_size(controller):
+    # unwrap perf/recording wrappers, replayed controllers don't know their grid size
+    while hasattr(controller, "controller"):
+        controller = controller.controller
+    return getattr(controller, "initialization_parameters", {}).get("gridSize")
+
+def cache_path(scene):
+    return os.path.join(SCENE_CACHE_DIR, scene, "reachable_positions.json")
+
+def load_cached(scene, grid_size):
+    path = cache_path(scene)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"read {path} failed: {e}")
+        return None
+    if grid_size is not None and data.get("gridSize") not in (None, grid_size):
+        return None
+    return ReachableGrid(data["positions"], data.get("gridSize"))
+
+def save_cached(scene, grid_size, positions):
+    path = cache_path(scene)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps({"scene": scene, "gridSize": grid_size, "positions": positions}))
+    os.replace(tmp_path, path)
+
+def query_reachable_positions(controller):
+    event = controller.step(dict(action='GetReachablePositions'))
+    return event.metadata['actionReturn'] or []
+
+def load_reachable_grid(controller, scene):
+    """
+    Grid of the scene as loaded, computed with one GetReachablePositions step per scene.
+    Recorded and replayed runs send the step every time, their step chains can't depend on
+    what was cached before.
+    """
+    grid_size = controller_grid_size(controller)
+    if not REACHABLE_GRID or is_recorded(controller):
+        return ReachableGrid(query_reachable_positions(controller), grid_size)
+    with grids_lock:
+        grid = grids.get(scene)
+    if grid is not None and (grid_size is None or grid.scene_grid_size in (None, grid_size)):
+        return grid
+    grid = load_cached(scene, grid_size)
+    if grid is None:
+        positions = query_reachable_positions(controller)
+        grid = ReachableGrid(positions, grid_size)
+        if positions:
+            try:
+                save_cached(scene, grid_size, positions)
+            except OSError as e:
+                print(f"save reachable positions of {scene} failed: {e}")
+    with grids_lock:
+        grids[scene] = grid
+    return grid
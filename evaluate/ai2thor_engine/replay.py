@@ -0,0 +1,197 @@
+"""
+Record/replay stand-ins for the AI2-THOR controller.
+
+RecordingController wraps a live controller and writes every reset/step request with
+the returned metadata and frame to record_dir. ReplayController serves these recordings
+without Unity, so the python side of the evaluator can be run and profiled on CPU.
+
+Every request is keyed by a hash of the request and the key of the previous request
+(a reset starts a new chain), so identical requests in different states, e.g. two
+RotateLeft steps, get their own recorded result.
+"""
+import os
+import json
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from ai2thor.server import Event
+
+
+class ReplayMissError(KeyError):
+    pass
+
+def canonical_request(method, args, kwargs):
+    if method == "reset":
+        request = {"scene": args[0] if args else kwargs.pop("scene", None)}
+        request.update(kwargs)
+    else:
+        request = dict(args[0]) if args and isinstance(args[0], dict) else {"action": args[0] if args else None}
+        request.update(kwargs)
+        if request.get("action") is None:
+            request.pop("action")
+    return {"method": method, "request": request}
+
+def is_recorded(controller):
+    """
+    True if controller records or replays its steps (through perf/other wrappers). Such runs
+    must not skip steps because of caches on disk, or replays miss their recorded chain.
+    """
+    while controller is not None:
+        if isinstance(controller, (RecordingController, ReplayController)):
+            return True
+        controller = getattr(controller, "controller", None)
+    return False
+
+def chain_key(prev_key, request):
+    if request["method"] == "reset":
+        prev_key = ""
+    data = prev_key + json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+class RecordingController:
+    def __init__(self, controller, record_dir):
+        self.controller = controller
+        self.record_dir = record_dir
+        os.makedirs(os.path.join(record_dir, "frames"), exist_ok=True)
+        # one steps file per process, workers may record into the same directory
+        self.steps_file = open(os.path.join(record_dir, f"steps_{os.getpid()}_{id(self)}.jsonl"), "a")
+        self.key = ""
+        self.lock = threading.Lock()
+
+    @property
+    def last_event(self):
+        return self.controller.last_event
+
+    def save_frame(self, frame):
+        if frame is None:
+            return None
+        frame = np.ascontiguousarray(frame)
+        name = hashlib.sha1(frame.tobytes()).hexdigest()
+        path = os.path.join(self.record_dir, "frames", f"{name}.npy")
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, frame)
+            os.replace(tmp_path, path)
+        return name
+
+    def record(self, method, args, kwargs, event):
+        request = canonical_request(method, args, dict(kwargs))
+        with self.lock:
+            self.key = chain_key(self.key, request)
+            line = {
+                "key": self.key,
+                **request,
+                "metadata": dict(event.metadata),
+                "frame": self.save_frame(event.frame),
+                "third_party_camera_frames": [self.save_frame(f) for f in event.third_party_camera_frames],
+            }
+            self.steps_file.write(json.dumps(line, default=str) + "\n")
+            self.steps_file.flush()
+        return event
+
+    def step(self, *args, **kwargs):
+        return self.record("step", args, kwargs, self.controller.step(*args, **kwargs))
+
+    def reset(self, *args, **kwargs):
+        return self.record("reset", args, kwargs, self.controller.reset(*args, **kwargs))
+
+    def stop(self):
+        self.steps_file.close()
+        self.controller.stop()
+
+recordings = {}
+recordings_lock = threading.Lock()
+
+def load_recordings(replay_dir):
+    """
+    key -> [(steps file, offset)], parsed once per process and shared by restarted
+    replay controllers. Entries are re-read on every replay so that each event gets
+    its own metadata dicts.
+    """
+    with recordings_lock:
+        if replay_dir not in recordings:
+            entries = {}
+            for path in sorted(glob.glob(os.path.join(replay_dir, "steps*.jsonl"))):
+                with open(path, "rb") as f:
+                    offset = f.tell()
+                    for line in iter(f.readline, b""):
+                        try:
+                            key = json.loads(line)["key"]
+                        except (json.JSONDecodeError, KeyError):
+                            continue
+                        finally:
+                            start, offset = offset, f.tell()
+                        entries.setdefault(key, []).append((path, start))
+            if not entries:
+                raise FileNotFoundError(f"no recordings in {replay_dir}")
+            recordings[replay_dir] = entries
+        return recordings[replay_dir]
+
+class ReplayController:
+    """
+    Serves recorded events. A request that was not recorded in the current state raises
+    ReplayMissError, i.e. the evaluator took a different path than during recording.
+    """
+    def __init__(self, replay_dir, frame_cache_size=64):
+        self.replay_dir = replay_dir
+        self.entries = load_recordings(replay_dir)
+        self.served = {}
+        self.key = ""
+        self.frames = OrderedDict()
+        self.frame_cache_size = frame_cache_size
+        self.files = {}
+        self.last_event = None
+
+    def read_entry(self, path, offset):
+        if path not in self.files:
+            self.files[path] = open(path, "rb")
+        f = self.files[path]
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def load_frame(self, name):
+        if name is None:
+            return None
+        if name in self.frames:
+            self.frames.move_to_end(name)
+            return self.frames[name]
+        frame = np.load(os.path.join(self.replay_dir, "frames", f"{name}.npy"))
+        self.frames[name] = frame
+        if len(self.frames) > self.frame_cache_size:
+            self.frames.popitem(last=False)
+        return frame
+
+    def replay(self, method, args, kwargs):
+        request = canonical_request(method, args, dict(kwargs))
+        key = chain_key(self.key, request)
+        if key not in self.entries:
+            raise ReplayMissError(f"no recording for {request['method']} {json.dumps(request['request'], default=str)[:200]}")
+        # the same path recorded several times is served in recording order, the last one repeats
+        entries = self.entries[key]
+        entry = self.read_entry(*entries[min(self.served.get(key, 0), len(entries) - 1)])
+        self.served[key] = self.served.get(key, 0) + 1
+        self.key = key
+        event = Event(entry["metadata"])
+        event.frame = self.load_frame(entry["frame"])
+        event.third_party_camera_frames = [self.load_frame(name) for name in entry["third_party_camera_frames"]]
+        self.last_event = event
+        return event
+
+    def step(self, *args, **kwargs):
+        return self.replay("step", args, kwargs)
+
+    def reset(self, *args, **kwargs):
+        return self.replay("reset", args, kwargs)
+
+    def rewind(self):
+        self.served = {}
+        self.key = ""
+
+    def stop(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
@@ -0,0 +1,121 @@
+"""
+Precomputed navigation poses, written by evaluate/precompute_poses.py to
+./data/scene_cache/<scene>/poses.json:
+
+    {"scene": "FloorPlan1", "objects": {objectId: {"agent_teleport_position", "agent_rotation",
+     "agent_cameraHorizon", "agent_isstanding", "object_position", "object_isOpen"}}}
+
+The agent_* keys are the ones of data/agent_positions.json. A pose is only used while the
+object is still where it was when the pose was computed.
+
+Both files are parsed once per process and again only when they change on disk.
+"""
+import os
+import json
+import threading
+
+from .reachable import SCENE_CACHE_DIR
+
+# SCENE_POSES=0 ignores the precomputed tables
+SCENE_POSES = os.getenv("SCENE_POSES", "1") == "1"
+POSITION_TOLERANCE = 0.01
+AGENT_POSITIONS_PATH = "./data/agent_positions.json"
+
+tables = {} # scene -> (file stamp, objectId -> pose)
+tables_lock = threading.Lock()
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class PoseRegistry:
+    """
+    Hand-set poses of data/agent_positions.json ({taskid: {"scene", objectId: pose}}) by scene.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.scenes = {}
+        self.lock = threading.Lock()
+
+    def reload(self):
+        scenes = {}
+        with open(self.path) as f:
+            data = json.load(f)
+        for taskid, temp_data in data.items():
+            # entries without a scene apply to every scene
+            view = scenes.setdefault(temp_data.get("scene"), {})
+            for objid, pose in temp_data.items():
+                if objid != "scene" and objid != "tasktype" and objid != "taskname":
+                    view[objid] = pose
+        self.scenes = scenes
+
+    def scene_view(self, scene):
+        """
+        objectId -> pose for scene, a copy the caller may change.
+        """
+        stamp = file_stamp(self.path)
+        with self.lock:
+            if stamp != self.stamp:
+                self.scenes = {}
+                if stamp is not None:
+                    self.reload()
+                self.stamp = stamp
+            view = dict(self.scenes.get(None, {}))
+            view.update(self.scenes.get(scene, {}))
+            return view
+
+agent_positions = PoseRegistry(AGENT_POSITIONS_PATH)
+
+def poses_path(scene):
+    return os.path.join(SCENE_CACHE_DIR, scene, "poses.json")
+
+def load_scene_poses(scene):
+    if not SCENE_POSES:
+        return {}
+    stamp = file_stamp(poses_path(scene))
+    with tables_lock:
+        if scene not in tables or tables[scene][0] != stamp:
+            table = {}
+            if stamp is not None:
+                try:
+                    with open(poses_path(scene)) as f:
+                        table = json.load(f)["objects"]
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"read {poses_path(scene)} failed: {e}")
+            tables[scene] = (stamp, table)
+        return tables[scene][1]
+
+def save_scene_poses(scene, objects):
+    path = poses_path(scene)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps({"scene": scene, "objects": objects}, separators=(",", ":")))
+    os.replace(tmp_path, path)
+
+def pose_entry(obj, agent):
+    return {
+        "agent_teleport_position": agent["position"],
+        "agent_rotation": agent["rotation"],
+        "agent_cameraHorizon": agent["cameraHorizon"],
+        "agent_isstanding": agent["isStanding"],
+        "object_position": obj["position"],
+        "object_isOpen": obj.get("isOpen"),
+    }
+
+def lookup_pose(scene, obj):
+    """
+    Pose for obj (its current metadata) or None if there is none or the object has moved or opened.
+    """
+    pose = load_scene_poses(scene).get(obj["objectId"])
+    if pose is None:
+        return None
+    if pose["object_isOpen"] != obj.get("isOpen"):
+        return None
+    if any(abs(pose["object_position"][k] - obj["position"][k]) > POSITION_TOLERANCE for k in "xyz"):
+        return None
+    return pose
@@ -4,161 +4,198 @@ import re
 # from .prompt import INSTRUCTION2ITEM_PROMPT
 import openai
 import cv2
+import weakref
+
+class ObjectIndex:
+    """
+    Lookups over event.metadata["objects"], built once per event and shared by all
+    EventObject helpers. Filters by a boolean property are computed on first use.
+    """
+    def __init__(self, event):
+        self.objects = event.metadata["objects"]
+        self.by_id = {}
+        self.by_name = {}
+        self.by_type = {}
+        self.item2object = {}
+        for obj in self.objects:
+            # first match wins, like the linear scans this replaces
+            self.by_id.setdefault(obj["objectId"], obj)
+            self.by_name.setdefault(obj["name"], obj)
+            self.by_type.setdefault(obj["objectType"], []).append(obj)
+            self.item2object[obj["name"]] = obj
+        self.filters = {}
+        self.volumes = {}
+        self.surface_areas = {}
+
+    def filter(self, prop):
+        if prop not in self.filters:
+            self.filters[prop] = [obj for obj in self.objects if obj[prop]]
+        return self.filters[prop]
+
+    def volume(self, item_name):
+        if item_name not in self.volumes:
+            item_size = self.by_name[item_name]["axisAlignedBoundingBox"]["size"]
+            self.volumes[item_name] = round(item_size["x"] * item_size["y"] * item_size["z"], 4)
+        return self.volumes[item_name]
+
+    def surface_area(self, item_name):
+        if item_name not in self.surface_areas:
+            item_size = self.by_name[item_name]["axisAlignedBoundingBox"]["size"]
+            x = item_size["x"]
+            y = item_size["y"]
+            z = item_size["z"]
+            self.surface_areas[item_name] = round(max(x*y, x*z, y*z), 4)
+        return self.surface_areas[item_name]
+
+object_indexes = weakref.WeakKeyDictionary()
+
+def object_index(event) -> ObjectIndex:
+    index = object_indexes.get(event)
+    # rebuilt if the metadata objects were replaced after the index was built
+    if index is None or index.objects is not event.metadata["objects"]:
+        index = ObjectIndex(event)
+        object_indexes[event] = index
+    return index
+
+scene_type_indexes = {} # scene -> (objectIds, objectType -> objects) of the scene as loaded
+
+def scene_type_index(scene, event):
+    """
+    objectType -> objects of scene right after it was loaded (event), shared by the agents
+    of all tasks in the scene and not to be modified. Rebuilt if the scene has other objects.
+    """
+    object_ids = [obj["objectId"] for obj in event.metadata["objects"]]
+    cached = scene_type_indexes.get(scene)
+    if cached is None or cached[0] != object_ids:
+        cached = (object_ids, dict(object_index(event).by_type))
+        scene_type_indexes[scene] = cached
+    return cached[1]
 
 class EventObject:
     @staticmethod
     def get_objects_type(event) -> List[str]:
-        objects = event.metadata["objects"]
-        return [obj["objectType"] for obj in objects]
+        return [obj["objectType"] for obj in object_index(event).objects]
 
     @staticmethod
     def get_objects(event) -> Tuple[List[dict], Dict[str, dict]]:
-        item2object = {}
-        objects = event.metadata["objects"]
-        for item in objects:
-            item2object[item["name"]] = item
-        return objects, item2object
+        index = object_index(event)
+        return index.objects, dict(index.item2object)
     
     @staticmethod
     def get_object_by_id(event, obj_id):
-        objects = event.metadata["objects"]
-        for obj in objects:
-            if obj["objectId"] == obj_id:
-                return obj
-        return None
+        return object_index(event).by_id.get(obj_id)
+
+    @staticmethod
+    def get_objects_by_type(event, object_type: str) -> List[dict]:
+        return list(object_index(event).by_type.get(object_type, []))
     
     @staticmethod
     def get_all_item_position(event) -> dict:
         item2position = {}
-        objects = event.metadata["objects"]
-        for item in objects:
-            item2position[item["name"]] = item["position"]
+        for name, item in object_index(event).item2object.items():
+            item2position[name] = item["position"]
         return item2position     
 
     @staticmethod
     def get_visible_objects(event) -> Tuple[List[dict],List[dict]]:
-        objects = event.metadata["objects"]
-        return [obj['name'] for obj in objects if obj["visible"]], [obj for obj in objects if obj["visible"]]
+        objects = object_index(event).filter("visible")
+        return [obj['name'] for obj in objects], list(objects)
 
     @staticmethod
     def get_isInteractable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isInteractable"]]
+        return list(object_index(event).filter("isInteractable"))
 
     @staticmethod
     def get_receptacle_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["receptacle"]]
+        return list(object_index(event).filter("receptacle"))
 
     @staticmethod
     def get_toggleable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["toggleable"]]
+        return list(object_index(event).filter("toggleable"))
 
     @staticmethod
     def get_breakable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["breakable"]]
+        return list(object_index(event).filter("breakable"))
 
     @staticmethod
     def get_isToggled_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isToggled"]]
+        return list(object_index(event).filter("isToggled"))
 
     @staticmethod
     def get_isBroken_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isBroken"]]
+        return list(object_index(event).filter("isBroken"))
 
     @staticmethod
     def get_canFillWithLiquid_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["canFillWithLiquid"]]
+        return list(object_index(event).filter("canFillWithLiquid"))
 
     @staticmethod
     def get_isFilledWithLiquid_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isFilledWithLiquid"]]
+        return list(object_index(event).filter("isFilledWithLiquid"))
 
     @staticmethod
     def get_fillLiquid_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["fillLiquid"]]
+        return list(object_index(event).filter("fillLiquid"))
 
     @staticmethod
     def get_dirtyable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["dirtyable"]]
+        return list(object_index(event).filter("dirtyable"))
 
     @staticmethod
     def get_isDirty_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isDirty"]]
+        return list(object_index(event).filter("isDirty"))
 
     @staticmethod
     def get_canBeUsedUp_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["canBeUsedUp"]]
+        return list(object_index(event).filter("canBeUsedUp"))
 
     @staticmethod
     def get_isUsedUp_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isUsedUp"]]
+        return list(object_index(event).filter("isUsedUp"))
 
     @staticmethod
     def get_cookable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["cookable"]]
+        return list(object_index(event).filter("cookable"))
 
     @staticmethod
     def get_isCooked_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isCooked"]]
+        return list(object_index(event).filter("isCooked"))
 
     @staticmethod
     def get_isHeatSource_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isHeatSource"]]
+        return list(object_index(event).filter("isHeatSource"))
 
     @staticmethod
     def get_isColdSource_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isColdSource"]]
+        return list(object_index(event).filter("isColdSource"))
 
     @staticmethod
     def get_sliceable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["sliceable"]]
+        return list(object_index(event).filter("sliceable"))
 
     @staticmethod
     def get_openable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["openable"]]
+        return list(object_index(event).filter("openable"))
 
     @staticmethod
     def get_isOpen_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isOpen"]]
+        return list(object_index(event).filter("isOpen"))
 
     @staticmethod
     def get_pickupable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["pickupable"]]
+        return list(object_index(event).filter("pickupable"))
 
     @staticmethod
     def get_isPickedUp_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isPickedUp"]]
+        return list(object_index(event).filter("isPickedUp"))
 
     @staticmethod
     def get_moveable_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["moveable"]]
-    
+        return list(object_index(event).filter("moveable"))
+
     @staticmethod
     def get_isMoving_objects(event, ) -> List[dict]:
-        objects = event.metadata["objects"]
-        return [obj for obj in objects if obj["isMoving"]]
+        return list(object_index(event).filter("isMoving"))
     
     @staticmethod
     def get_object_color(event, object_id: str) -> str:
@@ -172,50 +209,29 @@ class EventObject:
 
     @staticmethod
     def get_item_mass(event, item_name: str) -> float:
-        objects = event.metadata["objects"]
-        for item in objects:
-            if item["name"] == item_name:
-                return item["mass"]
-        return 0.0
+        item = object_index(event).by_name.get(item_name)
+        return item["mass"] if item is not None else 0.0
     
     @staticmethod
     def get_item_volume(event, item_name: str) -> float:
-        objects = event.metadata["objects"]
-        for item in objects:
-            if item["name"] == item_name:
-                item_size = item["axisAlignedBoundingBox"]["size"]
-                return round(item_size["x"] * item_size["y"] * item_size["z"], 4)
-        return 0.0
+        index = object_index(event)
+        return index.volume(item_name) if item_name in index.by_name else 0.0
     
     @staticmethod
     # 获取物品平面面积
     def get_item_surface_area(event, item_name: str) -> float:
-        objects = event.metadata["objects"]
-        for item in objects:
-            if item["name"] == item_name:
-                item_size = item["axisAlignedBoundingBox"]["size"]
-                x = item_size["x"]
-                y = item_size["y"]
-                z = item_size["z"]
-                max_surface= max(x*y, x*z, y*z)
-                return round(max_surface, 4)
-        return 0.0
+        index = object_index(event)
+        return index.surface_area(item_name) if item_name in index.by_name else 0.0
     
     @staticmethod
     def get_item_position(event, item_name: str) -> dict:
-        objects = event.metadata["objects"]
-        for item in objects:
-            if item["name"] == item_name:
-                return item["position"]
-        return {}
+        item = object_index(event).by_name.get(item_name)
+        return item["position"] if item is not None else {}
     
     @staticmethod
     def get_item_orientation(event, item_name: str) -> dict:
-        objects = event.metadata["objects"]
-        for item in objects:
-            if item["name"] == item_name:
-                return item["rotation"]
-        return {}
+        item = object_index(event).by_name.get(item_name)
+        return item["rotation"] if item is not None else {}
 
 def add_text_to_image(image, text, position):
     """
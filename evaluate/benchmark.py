@@ -0,0 +1,211 @@
+"""
+Evaluator throughput benchmark.
+
+Runs the evaluate.py episode loop against local fake /chat and /match servers that answer
+with each task's key actions, and writes a JSON report with episodes/minute, steps/second
+and the time spent in the simulator, file I/O, image encoding and HTTP. Per-stage
+p50/p95/p99 go into the report and the spans into <report>_trace.json (chrome://tracing).
+
+    python evaluate/benchmark.py --input_path data/test_809.json --limit 20 --chat_latency 0.5
+    python evaluate/benchmark.py --input_path data/test_809.json --limit 20 --record_dir data/benchmark/rec   # live AI2-THOR
+    python evaluate/benchmark.py --input_path data/test_809.json --limit 20 --replay_dir data/benchmark/rec   # CPU only
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FILLER = "I need to think about where the target object could be and what to do next."
+
+class FakeModelServer(ThreadingHTTPServer):
+    """
+    /chat: the n-th assistant turn of a task answers with its n-th key action, then "end".
+    /match: the candidate object mentioned in the description, else "No Suitable Object".
+    """
+    daemon_threads = True
+
+    def __init__(self, port, tasks, chat_latency=0.0, match_latency=0.0, response_words=50):
+        super().__init__(("127.0.0.1", port), FakeModelHandler)
+        self.scripts = [(task["taskquery"], get_key_actions(task) + ["end"]) for task in tasks]
+        self.chat_latency = chat_latency
+        self.match_latency = match_latency
+        self.thinking = " ".join([FILLER] * (response_words // len(FILLER.split()) + 1)).split()[:response_words]
+
+    def chat(self, messages):
+        time.sleep(self.chat_latency)
+        task_text = ""
+        for m in messages:
+            if m["role"] == "user":
+                content = m["content"]
+                task_text = content if isinstance(content, str) else " ".join(c.get("text", "") for c in content)
+                break
+        script = ["end"]
+        for taskquery, actions in self.scripts:
+            if taskquery in task_text:
+                script = actions
+                break
+        turn = sum(1 for m in messages if m["role"] == "assistant")
+        action = script[turn] if turn < len(script) else "end"
+        return f"<Thinking>{' '.join(self.thinking)}</Thinking><DecisionMaking>{action}</DecisionMaking>"
+
+    def match(self, description, objects):
+        time.sleep(self.match_latency)
+        candidates = [obj for obj in objects if obj.lower() in description.lower()]
+        return max(candidates, key=len) if candidates else "No Suitable Object"
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/chat":
+            output = self.server.chat(data["inputs"][0]["messages"])
+            body = {"output_text": [output], "output_len": len(output.split())}
+        elif self.path == "/match":
+            body = {"target_obj": self.server.match(data["s1"][0], data["s2"])}
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ""
+
+def run_serial(data, model, port):
+    controller = evaluate.create_controller()
+    success_count = 0
+    for test_data in data:
+        try:
+            if evaluate.test(controller, test_data, model, port):
+                success_count += 1
+            else:
+                controller = evaluate.restart_controller(controller)
+        except Exception as e:
+            print(e)
+            controller = evaluate.restart_controller(controller)
+    controller.stop()
+    return success_count
+
+def build_report(args, data, model, success_count, wall_time):
+    entries = evaluate.result_index.load_entries(f"./data/{model}")
+    agent_steps = sum(len(e["trajectory"]) for e in entries)
+    timers = evaluate.perf.report()
+    sim_steps = timers.get("sim", {}).get("count", 0)
+    busy = {category: timers.get(category, {}).get("total", 0.0) for category in ("sim", "io", "encode", "http", "python")}
+    report = {
+        "commit": git_commit(),
+        "config": {
+            "input_path": args.input_path,
+            "limit": args.limit,
+            "scheduler": args.scheduler,
+            "workers": args.workers,
+            "max_inflight": args.max_inflight,
+            "chat_latency": args.chat_latency,
+            "match_latency": args.match_latency,
+            "controller": "replay" if args.replay_dir else "record" if args.record_dir else "live",
+            "frame_transport": evaluate.FRAME_TRANSPORT,
+            "frame_codec": evaluate.frame_writer.FRAME_CODEC,
+            "frame_writer_threads": evaluate.frame_writer.FRAME_WRITER_THREADS,
+        },
+        "episodes": len(data),
+        "success": success_count,
+        "wall_time": round(wall_time, 3),
+        "episodes_per_minute": round(len(data) / wall_time * 60, 3) if wall_time > 0 else 0.0,
+        "agent_steps": agent_steps,
+        "agent_steps_per_second": round(agent_steps / wall_time, 3) if wall_time > 0 else 0.0,
+        "sim_steps": sim_steps,
+        "sim_steps_per_second": round(sim_steps / wall_time, 3) if wall_time > 0 else 0.0,
+        # summed over threads, with the async scheduler they can add up to more than wall_time
+        "time": dict(busy, other=round(max(wall_time - sum(busy.values()), 0.0), 3)),
+        "timers": timers,
+        "stages": evaluate.perf.stage_report(),
+        "http": evaluate.http_client.latency_stats(),
+        "scene_loads": dict(evaluate.scene_load_stats),
+        "pose_cache": dict(evaluate.pose_cache_stats),
+        "match_tiers": dict(evaluate.matcher.match_stats),
+        "frame_writer": dict(evaluate.frame_writer.get_writer().stats),
+    }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, default="./data/test_809.json", help="input file path")
+    parser.add_argument("--limit", type=int, default=20, help="number of tasks, taken after grouping by scene")
+    parser.add_argument("--name", type=str, default="fake", help="results go to ./data/benchmark/<name>, cleared before the run")
+    parser.add_argument("--scheduler", type=str, default="serial", choices=["serial", "async"], help="")
+    parser.add_argument("--workers", type=int, default=1, help="async scheduler: number of controllers")
+    parser.add_argument("--max_inflight", type=int, default=None, help="async scheduler: max concurrent model requests")
+    parser.add_argument("--port", type=int, default=10090, help="fake /chat server port")
+    parser.add_argument("--match_port", type=int, default=20090, help="fake /match server port")
+    parser.add_argument("--chat_latency", type=float, default=0.0, help="seconds per /chat request")
+    parser.add_argument("--match_latency", type=float, default=0.0, help="seconds per /match request")
+    parser.add_argument("--response_words", type=int, default=50, help="length of the scripted thinking text")
+    parser.add_argument("--record_dir", type=str, default=None, help="record the simulator steps of this run")
+    parser.add_argument("--replay_dir", type=str, default=None, help="replay recorded simulator steps instead of AI2-THOR")
+    parser.add_argument("--output", type=str, default=None, help="report path, defaults to ./data/benchmark/<name>_report.json")
+    args = parser.parse_args()
+
+    # evaluate reads these at import / controller creation
+    os.environ["MATCH_PORT"] = str(args.match_port)
+    os.environ["PERF"] = "1"
+    if args.record_dir:
+        os.environ["RECORD_DIR"] = args.record_dir
+    if args.replay_dir:
+        os.environ["REPLAY_DIR"] = args.replay_dir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import evaluate
+    from evaluate import get_key_actions
+
+    with open(args.input_path) as f:
+        data = evaluate.group_by_scene(json.load(f))[:args.limit]
+    model = f"benchmark/{args.name}"
+    prefix_path = f"./data/{model}"
+    shutil.rmtree(prefix_path, ignore_errors=True)
+    if os.path.exists(evaluate.result_index.index_path(prefix_path)):
+        os.remove(evaluate.result_index.index_path(prefix_path))
+
+    start_server(FakeModelServer(args.port, data, args.chat_latency, 0.0, args.response_words))
+    start_server(FakeModelServer(args.match_port, [], 0.0, args.match_latency))
+
+    evaluate.perf.reset()
+    start_time = time.time()
+    if args.scheduler == "async":
+        max_inflight = args.max_inflight if args.max_inflight else args.workers
+        success_count = asyncio.run(evaluate.run_async(data, model, args.port, args.workers, max_inflight))
+    else:
+        success_count = run_serial(data, model, args.port)
+    wall_time = time.time() - start_time
+
+    report = build_report(args, data, model, success_count, wall_time)
+    output = args.output if args.output else f"{prefix_path}_report.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        f.write(json.dumps(report, indent=4))
+    with open(f"{os.path.splitext(output)[0]}_trace.json", "w") as f:
+        f.write(json.dumps(evaluate.perf.chrome_trace()))
+    print("="*100)
+    print(json.dumps({k: report[k] for k in ("episodes", "success", "wall_time", "episodes_per_minute", "agent_steps_per_second", "sim_steps_per_second", "time")}, indent=4))
+    print(f"--benchmark report:{output}--")
@@ -1,25 +1,36 @@
 import json
 import random
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from ai2thor_engine.RocAgent import RocAgent
+from ai2thor_engine.baseAgent import scene_load_stats, pose_cache_stats
+from ai2thor_engine.replay import RecordingController, ReplayController
+from common import frame_writer
 from utils import *
+from common import http_client
+import result_index
+import matcher
+import perf
 from prompt import *
 import argparse
 from tqdm import tqdm
-import os
 import time
+import multiprocessing as mp
+import queue
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from ai2thor.controller import Controller
 from ai2thor.platform import CloudRendering
 MODE = "LOCAL" # choose ["LOCAL","API"]
 PLATFORM_TYPE="GPU" 
 
 MAX_MODEL_INFER_COUNT=3
+# seconds run_pool waits for a result before it checks whether the workers are still alive
+WORKER_CHECK_INTERVAL=10
 def load_data(args):
-    cache = {}
     prefix_path = f"./data/{args.model_name}"
-    if os.path.exists(prefix_path):
-        for pre in os.listdir(prefix_path):
-            if "result.json" in os.listdir(os.path.join(prefix_path, pre)):
-                cache[pre] = 1
+    cache = result_index.load_done(prefix_path, args.rebuild_index)
     with open(args.input_path) as f:
         data = json.load(f)
     
@@ -30,6 +41,7 @@ def load_data(args):
         if identity not in cache:
             last_data.append(line)
     print(f"--cache:{len(data)-len(last_data)}---remaining evaluation tasks:{len(last_data)}")
+    last_data = group_by_scene(last_data)
     # random.shuffle(last_data)
     per_group_count = len(last_data)//args.total_count
     group_data = [last_data[i*per_group_count: (i+1)*per_group_count if i !=args.total_count-1 else len(last_data)] for i in range(args.total_count)]
@@ -37,215 +49,259 @@ def load_data(args):
     group_data[args.cur_count-1].reverse()
     return group_data[args.cur_count-1]
 
-def get_trajectory(controller, task, model, max_step=10, port=-1):
-    try:
-        scene = task["scene"]
-        task_name = task["taskquery"]
-        index = task["identity"]
-        if task["tasktype"].startswith("ordered_pickup_two_object_and_put"):
-            tasktype="ordered_pickup_two_object_and_put"
-        else:tasktype=task["tasktype"]
-        max_step=get_max_steps(tasktype)
-
-        save_path=f"./data/{model}/{index}_{task['tasktype']}_{scene}_{task['instruction_idx']}"
-        
-        print(f"******** Task Name: {task_name} *** Max Steps: {max_step} ********")
-        print(f"******** Task Record: {save_path} ********")
-        autogn = RocAgent(controller, save_path, scene, visibilityDistance=20, gridSize=0.1, fieldOfView=90, 
-                            target_objects=task["target_objects"],
-                            related_objects=task["related_objects"],
-                            navigable_objects=task["navigable_objects"],
-                            taskid=task["identity"],
-                            platform_type=PLATFORM_TYPE)
-        print("RoctAgent Initialization successful!!!")
-        objects = autogn.eventobject.get_objects_type(autogn.controller.last_event)
-        action, pre_action = "init", "init"
-        item, pre_item = None, None
-        trajectory = []
-        legal_locations = []
-        legal_objects = []
-        images = []
-        response = ""
-        messages = [{"role": "system","content": EMBODIED_SYSTEM_PROMPT}]
-        call_model_count = 0
-        con_same_action = 0
+def group_by_scene(data):
+    """
+    Order tasks by scene, then by tasktype, keeping first-appearance order, so that
+    consecutive tasks reuse the loaded FloorPlan instead of resetting the controller.
+    """
+    scene_order, tasktype_order = {}, {}
+    for line in data:
+        scene_order.setdefault(line["scene"], len(scene_order))
+        tasktype_order.setdefault(line["tasktype"], len(tasktype_order))
+    return sorted(data, key=lambda line: (scene_order[line["scene"]], tasktype_order[line["tasktype"]]))
+
+def scene_chunks(data):
+    chunks = []
+    for line in data:
+        if chunks and chunks[-1][0]["scene"] == line["scene"]:
+            chunks[-1].append(line)
+        else:
+            chunks.append([line])
+    return chunks
+
+def run_episode(controller, task, model):
+    """
+    Episode loop as a generator: yields the model inputs of every step and
+    receives the model response through send(). Returns (trajectory, messages, result_dir).
+    """
+    scene = task["scene"]
+    task_name = task["taskquery"]
+    index = task["identity"]
+    if task["tasktype"].startswith("ordered_pickup_two_object_and_put"):
+        tasktype="ordered_pickup_two_object_and_put"
+    else:tasktype=task["tasktype"]
+    max_step=get_max_steps(tasktype)
+
+    save_path=f"./data/{model}/{index}_{task['tasktype']}_{scene}_{task['instruction_idx']}"
+    
+    print(f"******** Task Name: {task_name} *** Max Steps: {max_step} ********")
+    print(f"******** Task Record: {save_path} ********")
+    autogn = RocAgent(controller, save_path, scene, visibilityDistance=20, gridSize=0.1, fieldOfView=90, 
+                        target_objects=task["target_objects"],
+                        related_objects=task["related_objects"],
+                        navigable_objects=task["navigable_objects"],
+                        taskid=task["identity"],
+                        platform_type=PLATFORM_TYPE)
+    print("RoctAgent Initialization successful!!!")
+    objects = autogn.eventobject.get_objects_type(autogn.controller.last_event)
+    action, pre_action = "init", "init"
+    item, pre_item = None, None
+    trajectory = []
+    legal_locations = []
+    legal_objects = []
+    images = []
+    response = ""
+    messages = [{"role": "system","content": EMBODIED_SYSTEM_PROMPT}]
+    autogn.keep_frames = FRAME_TRANSPORT=="shm" and MODE=="LOCAL"
+    builder = MessageBuilder("image_url" if MODE=="API" else "image", frames=autogn.frames)
+    call_model_count = 0
+    con_same_action = 0
+    last_step_count = autogn.step_count
+    while action != "end" and autogn.step_count < max_step and call_model_count<MAX_MODEL_INFER_COUNT:
         last_step_count = autogn.step_count
-        while action != "end" and autogn.step_count < max_step and call_model_count<MAX_MODEL_INFER_COUNT:
-            last_step_count = autogn.step_count
-            if action==pre_action and item==pre_item:
-                con_same_action+=1
-                if con_same_action == MAX_MODEL_INFER_COUNT:
-                    dic = {
-                        "response": response,
-                        "action": "end",
-                        "object": None,
-                        "legal_locations": [],
-                        "legal_objects": [],
-                        "success": 0,
-                        "errorInfo": "",
-                        "images": []
-                    }
-                    trajectory.append(dic)
-                    autogn.controller.stop()
-                    result_dir = autogn.result_dir
-                    del autogn
-                    return trajectory, messages, result_dir
-            else:
-                con_same_action = 0
-                pre_action=action
-                pre_item=item
-            if invalid_action(action):
-                user_text = INVALID_ACTION_PROMPT.format() # action=temp_action
+        if action==pre_action and item==pre_item:
+            con_same_action+=1
+            if con_same_action == MAX_MODEL_INFER_COUNT:
                 dic = {
-                        "response": response,
-                        "action": action,
-                        "object": item,
-                        "legal_locations": legal_locations,
-                        "legal_objects": legal_objects,
-                        "success": 0,
-                        "errorInfo": user_text,
-                        "images": []
-                    }
+                    "response": response,
+                    "action": "end",
+                    "object": None,
+                    "legal_locations": [],
+                    "legal_objects": [],
+                    "success": 0,
+                    "errorInfo": "",
+                    "images": []
+                }
                 trajectory.append(dic)
+                result_dir = autogn.result_dir
+                builder.close()
+                del autogn
+                frame_writer.flush(result_dir)
+                return trajectory, messages, result_dir
+        else:
+            con_same_action = 0
+            pre_action=action
+            pre_item=item
+        if invalid_action(action):
+            user_text = INVALID_ACTION_PROMPT.format() # action=temp_action
+            dic = {
+                    "response": response,
+                    "action": action,
+                    "object": item,
+                    "legal_locations": legal_locations,
+                    "legal_objects": legal_objects,
+                    "success": 0,
+                    "errorInfo": user_text,
+                    "images": []
+                }
+            trajectory.append(dic)
+            messages.append({
+                    "role": "user",
+                    "content": user_text+USER_IMAGE_PREFIX_ERROR
+                })
+        
+        else:
+        
+            print(autogn.step_count,"****** begin exec action:",action, item ,"***")
+            success, image_fp, legal_locations, legal_objects = autogn.exec(action, item)
+            print(autogn.step_count,"****** end exec action:",action, item ,"***")
+            user_text = ""
+        
+            if not success or image_fp is None or image_fp == []:
+                if "navigate to" in action:                    
+                    if item=="No Suitable Object":
+                        user_text = f"""<|feedback|>Action: "{action}" is illegal, the name of the navigated object doesn't quite match the obejct in the image, please try navigating to another object first.\n"""
+                    else:                           
+                        user_text = f"""<|feedback|>Action: "{action}" is illegal, "{item}" is the most relevant item in this room and "{raw_action}". Object: "{item}" is not currently navigable, you can try "navigate to <object>" to reach nearby, larger objects for closer observation.\n"""
+
+                else:
+                    if item=="No Suitable Object":    
+                        user_text = f"""<|feedback|>Action: "{action}" is illegal, the name of the object doesn't quite match the obejct in the image, Please try interacting with another object or navigating to another object.\n"""
+                    else:                             
+                        user_text = f"""<|feedback|>Action: {raw_action} is illegal, Object: {item} is currently unavailable for interaction. Possible situations include: {item} does not exist in your current view; you are too far away from {item}; the {item} cannot perform operation {action}.\nYou can try \"move forward\" to approach the target object or \"navigate to <object>\" to reach nearby, larger objects for closer inspection."""
+                    
+                dic = {
+                    "response": response,
+                    "action": action,
+                    "object": item,
+                    "legal_locations": legal_locations,
+                    "legal_objects": legal_objects,
+                    "success": 0,
+                    "errorInfo": user_text,
+                    "images": image_fp
+                }
+                trajectory.append(dic)
+                
                 messages.append({
-                        "role": "user",
-                        "content": user_text+USER_IMAGE_PREFIX_ERROR
-                    })
+                    "role": "user",
+                    "content": user_text+USER_IMAGE_PREFIX_ERROR
+                })
+        
             
             else:
+                dic = {
+                    "response": response,
+                    "action": action,
+                    "object": item,
+                    "legal_locations": legal_locations,
+                    "legal_objects": legal_objects,
+                    "success": 1,
+                    "errorInfo": "",
+                    "images": image_fp
+                }
+                trajectory.append(dic)
+                if isinstance(image_fp, list):
+                    for i in image_fp:
+                        images.append(i)
+                        user_text += "<image>"
+                else:
+                    images.append(image_fp)
+                    user_text += "<image>"
             
-                print(autogn.step_count,"****** begin exec action:",action, item ,"***")
-                success, image_fp, legal_locations, legal_objects = autogn.exec(action, item)
-                print(autogn.step_count,"****** end exec action:",action, item ,"***")
-                user_text = ""
-            
-                if not success or image_fp is None or image_fp == []:
-                    if "navigate to" in action:                    
-                        if item=="No Suitable Object":
-                            user_text = f"""<|feedback|>Action: "{action}" is illegal, the name of the navigated object doesn't quite match the obejct in the image, please try navigating to another object first.\n"""
-                        else:                           
-                            user_text = f"""<|feedback|>Action: "{action}" is illegal, "{item}" is the most relevant item in this room and "{raw_action}". Object: "{item}" is not currently navigable, you can try "navigate to <object>" to reach nearby, larger objects for closer observation.\n"""
-
-                    else:
-                        if item=="No Suitable Object":    
-                            user_text = f"""<|feedback|>Action: "{action}" is illegal, the name of the object doesn't quite match the obejct in the image, Please try interacting with another object or navigating to another object.\n"""
-                        else:                             
-                            user_text = f"""<|feedback|>Action: {raw_action} is illegal, Object: {item} is currently unavailable for interaction. Possible situations include: {item} does not exist in your current view; you are too far away from {item}; the {item} cannot perform operation {action}.\nYou can try \"move forward\" to approach the target object or \"navigate to <object>\" to reach nearby, larger objects for closer inspection."""
-                        
-                    dic = {
-                        "response": response,
-                        "action": action,
-                        "object": item,
-                        "legal_locations": legal_locations,
-                        "legal_objects": legal_objects,
-                        "success": 0,
-                        "errorInfo": user_text,
-                        "images": image_fp
-                    }
-                    trajectory.append(dic)
-                    
+                
+                if action == "init":
+                    if action == "init":
+                        if MODE=="LOCAL":
+                            TASK_PREFIX=TASK_PREFIX_PUT
+                        elif MODE=="API":
+                            TASK_PREFIX=TASK_PREFIX_PUT_IN
+                    messages.append({"role":"user",
+                                    "content":user_text + TASK_PREFIX.format(
+                                        task_name=task_name, )})
+                                        
+                
+                elif "move forward" in action:
                     messages.append({
                         "role": "user",
-                        "content": user_text+USER_IMAGE_PREFIX_ERROR
+                        "content": user_text+USER_IMAGE_PREFIX_MOVE_FORWARD.format(
+                            action=action
+                        )
                     })
-            
-                
                 else:
-                    dic = {
-                        "response": response,
-                        "action": action,
-                        "object": item,
-                        "legal_locations": legal_locations,
-                        "legal_objects": legal_objects,
-                        "success": 1,
-                        "errorInfo": "",
-                        "images": image_fp
-                    }
-                    trajectory.append(dic)
-                    if isinstance(image_fp, list):
-                        for i in image_fp:
-                            images.append(i)
-                            user_text += "<image>"
-                    else:
-                        images.append(image_fp)
-                        user_text += "<image>"
-                
-                    
-                    if action == "init":
-                        if action == "init":
-                            if MODE=="LOCAL":
-                                TASK_PREFIX=TASK_PREFIX_PUT
-                            elif MODE=="API":
-                                TASK_PREFIX=TASK_PREFIX_PUT_IN
-                        messages.append({"role":"user",
-                                        "content":user_text + TASK_PREFIX.format(
-                                            task_name=task_name, )})
-                                            
-                    
-                    elif "move forward" in action:
-                        messages.append({
-                            "role": "user",
-                            "content": user_text+USER_IMAGE_PREFIX_MOVE_FORWARD.format(
-                                action=action
-                            )
-                        })
-                    else:
-                        temp_action = action if item is None else action + " " + item
-                        messages.append({"role":"user",
-                                        "content":user_text+USER_IMAGE_PREFIX.format(
-                                            action=temp_action,
-                                            )})
-                
-            inputs = {"messages": messages, "images": images}
+                    temp_action = action if item is None else action + " " + item
+                    messages.append({"role":"user",
+                                    "content":user_text+USER_IMAGE_PREFIX.format(
+                                        action=temp_action,
+                                        )})
             
-            if MODE=="API":
-                api_messages = prepare_api_messages(inputs)
-                response = call_llm(api_messages, model)
-                call_model_count += 1
-            elif MODE=="LOCAL":
-                local_messages = prepare_deploy_messages(inputs)
-                response = local_model(local_messages, port) #local model predict
-                call_model_count += 1
-            
-            if response == "":
-                print(f"--task{task['identity']}Trajectory acquisition failed -- request timed out, model is not output, end the current evaluation task!!!")
-                return None, None, None
+        inputs = {"messages": messages, "images": images, "builder": builder}
+        
+        response = yield inputs
+        call_model_count += 1
+        
+        if response == "":
+            print(f"--task{task['identity']}Trajectory acquisition failed -- request timed out, model is not output, end the current evaluation task!!!")
+            builder.close()
+            return None, None, None
 
-            if autogn.step_count!=last_step_count:
-                call_model_count = 0
-            else:
-                print(f"******** Action_Execute_Count: {autogn.step_count} *** Call_VLM_Count: {call_model_count} ********")  
-            raw_action, action, item = macth_action_item(response, autogn.action_space, objects,MODE)
+        if autogn.step_count!=last_step_count:
+            call_model_count = 0
+        else:
+            print(f"******** Action_Execute_Count: {autogn.step_count} *** Call_VLM_Count: {call_model_count} ********")  
+        raw_action, action, item = macth_action_item(response, autogn.action_space, objects,MODE)
 
-            messages.append({"role":"assistant","content":response})
-        
-        dic = {
-            "response": response,
-            "action": "end",
-            "object": None,
-            "legal_locations": legal_locations,
-            "legal_objects": legal_objects,
-            "success": 1,
-            "errorInfo": "",
-            "images": []
-        }
-        trajectory.append(dic)
-        autogn.controller.stop()
-        del autogn
-        return trajectory, messages, save_path
+        messages.append({"role":"assistant","content":response})
+    
+    dic = {
+        "response": response,
+        "action": "end",
+        "object": None,
+        "legal_locations": legal_locations,
+        "legal_objects": legal_objects,
+        "success": 1,
+        "errorInfo": "",
+        "images": []
+    }
+    trajectory.append(dic)
+    print(f"******** Message Builder: {builder.stats()} ********")
+    builder.close()
+    del autogn
+    # the images have to be on disk before result.json marks the task as done
+    frame_writer.flush(save_path)
+    return trajectory, messages, save_path
+
+def call_model(inputs, model, port=-1):
+    builder = inputs.get("builder")
+    if MODE=="API":
+        api_messages = prepare_api_messages(inputs)
+        # call_llm is also used by match_item, only time it here
+        with perf.timer("model_http", "http"):
+            response = call_llm(api_messages, model)
+    elif MODE=="LOCAL":
+        local_messages = prepare_deploy_messages(inputs)
+        session = builder if builder is not None and CHAT_SESSIONS else None
+        response = local_model(local_messages, port, session) #local model predict
+    return response
+
+def get_trajectory(controller, task, model, max_step=10, port=-1):
+    try:
+        with perf.episode(task["identity"], task["tasktype"]):
+            episode = run_episode(controller, task, model)
+            inputs = next(episode)
+            while True:
+                response = call_model(inputs, model, port)
+                inputs = episode.send(response)
+    except StopIteration as e:
+        return e.value
     except Exception as e:
         print(e)
-        autogn.controller.stop()
-        del autogn
         print(f"--task{task['identity']}Track acquisition failed -- emulator /api exception, end the current evaluation task!!!--")
+        return None, None, None
 
-def test(controller, test_data, model="Qwen2.5-VL-3B-Instruct", port=-1):
-    save_path=f"./data/{model}/{test_data['identity']}_{test_data['tasktype']}_{test_data['scene']}_{test_data['instruction_idx']}"
-    if os.path.exists(f"{save_path}/result.json"):
-        print(f"""--task{test_data["identity"]}It has been evaluated successfully, skip it.---""")
-        return
-    
-    test_start_time = time.time()
+def get_save_path(test_data, model):
+    return f"./data/{model}/{test_data['identity']}_{test_data['tasktype']}_{test_data['scene']}_{test_data['instruction_idx']}"
+
+def get_key_actions(test_data):
     id = test_data['instruction_idx']
     if 'task_metadata' in test_data:
         scene_metadata = test_data['task_metadata']
@@ -255,32 +311,338 @@ def test(controller, test_data, model="Qwen2.5-VL-3B-Instruct", port=-1):
         with open(f"./data/single_search_task_metadata/{test_data['scene']}.json") as f:
             scene_metadata = json.load(f)[0]
         key_actions = [(a['action']+" "+ a["objectType"]).strip() for a in scene_metadata[id]['actions']]
-    
+    return key_actions
+
+def build_record(test_data, model, trajectory, messages, key_actions, elapsed_time):
+    metric_dic = metric(test_data, trajectory, key_actions)
+    record = {
+        "identity":test_data["identity"],
+        "scene": test_data["scene"],
+        "tasktype": test_data["tasktype"],
+        "instruction_idx": test_data["instruction_idx"],
+        "model": model,
+        "taskname":test_data["taskname"],
+        "trajectory": trajectory,
+        "messages": messages,
+        "key_actions": key_actions,
+        "metrics": metric_dic,
+        "time": elapsed_time,
+        "maxstep": get_max_steps(test_data["tasktype"]),
+    }
+    if perf.enabled():
+        record["perf"] = perf.episode_summary(test_data["identity"])
+    return record
+
+def run_task(controller, test_data, model="Qwen2.5-VL-3B-Instruct", port=-1):
+    test_start_time = time.time()
+    key_actions = get_key_actions(test_data)
     
     trajectory, messages, result_dir = get_trajectory(controller, test_data, model, port=port)
     
     if trajectory is None:
         print(f"--task{test_data['identity']}failed--")
-        return
-    metric_dic = metric(test_data, trajectory, key_actions)
+        return None
     test_end_time = time.time()
     elapsed_time = int(test_end_time - test_start_time)
-    with open(f"{result_dir}/result.json","w") as f:
-        f.write(json.dumps({
-            "identity":test_data["identity"],
-            "scene": test_data["scene"],
-            "tasktype": test_data["tasktype"],
-            "instruction_idx": test_data["instruction_idx"],
-            "model": model,
-            "taskname":test_data["taskname"],
-            "trajectory": trajectory,
-            "messages": messages,
-            "key_actions": key_actions,
-            "metrics": metric_dic,
-            "time": elapsed_time,
-            "maxstep": get_max_steps(test_data["tasktype"]),
-        }, indent=4))
-    print(f"""--task{test_data["identity"]}evaluate successed---""")
+    return result_dir, build_record(test_data, model, trajectory, messages, key_actions, elapsed_time)
+
+def save_result(result_dir, record):
+    with perf.episode(record["identity"], record["tasktype"]), perf.timer("result_write", "io"):
+        with open(f"{result_dir}/result.json","w") as f:
+            f.write(json.dumps(record, indent=4))
+        result_index.append(os.path.dirname(result_dir.rstrip("/")), result_dir, record)
+    print(f"""--task{record["identity"]}evaluate successed---""")
+
+def test(controller, test_data, model="Qwen2.5-VL-3B-Instruct", port=-1):
+    save_path = get_save_path(test_data, model)
+    if os.path.exists(f"{save_path}/result.json"):
+        print(f"""--task{test_data["identity"]}It has been evaluated successfully, skip it.---""")
+        return True
+    
+    result = run_task(controller, test_data, model, port)
+    if result is None:
+        return False
+    save_result(*result)
+    return True
+
+def create_controller():
+    # read at call time so spawned pool workers pick up the --record_dir/--replay_dir flags
+    if os.getenv("REPLAY_DIR"):
+        controller = ReplayController(os.getenv("REPLAY_DIR"))
+    elif os.getenv("RECORD_DIR"):
+        controller = RecordingController(create_live_controller(), os.getenv("RECORD_DIR"))
+    else:
+        controller = create_live_controller()
+    if perf.enabled():
+        controller = perf.TimedController(controller)
+    return controller
+
+def create_live_controller():
+    return Controller(
+        platform=CloudRendering,
+        snapToGrid=False,
+        quality='Medium',
+        agentMode="default",
+        massThreshold=None,
+        scene='FloorPlan1',
+        visibilityDistance=20,
+        gridSize=0.1,
+        renderDepthImage=False,
+        renderInstanceSegmentation=False,
+        width=800,
+        height=450,
+        fieldOfView=90,
+    )
+
+def restart_controller(controller):
+    # the simulator state is unknown after a failed episode, start a fresh one
+    try:
+        controller.stop()
+    except Exception as e:
+        print(e)
+    return create_controller()
+
+def pool_worker(worker_id, task_queue, result_queue, model, port):
+    controller = create_controller()
+    while True:
+        chunk = task_queue.get()
+        if chunk is None:
+            break
+        # the parent counts these as failed if this process dies before reporting them
+        result_queue.put(("chunk", worker_id, [test_data["identity"] for test_data in chunk], None))
+        for test_data in chunk:
+            save_path = get_save_path(test_data, model)
+            if os.path.exists(f"{save_path}/result.json"):
+                print(f"""--task{test_data["identity"]}It has been evaluated successfully, skip it.---""")
+                result_queue.put(("done", test_data["identity"], None, None))
+                continue
+            try:
+                result = run_task(controller, test_data, model, port)
+            except Exception as e:
+                print(e)
+                result = None
+            if result is None:
+                print(f"--worker{worker_id} task{test_data['identity']}failed, restart controller--")
+                controller = restart_controller(controller)
+                result_queue.put(("failed", test_data["identity"], None, None))
+            else:
+                result_queue.put(("done", test_data["identity"], result[0], result[1]))
+    try:
+        controller.stop()
+    except Exception as e:
+        print(e)
+    print(f"--worker{worker_id} http latency: {http_client.latency_stats()}")
+    print(f"--worker{worker_id} scene loads: {scene_load_stats}, interactable pose cache: {pose_cache_stats}")
+    print(f"--worker{worker_id} object match tiers: {matcher.match_stats}, remote calls saved: {matcher.remote_calls_saved()}")
+    result_queue.put(("exit", worker_id, None, perf.export_spans() if perf.enabled() else None))
+
+def run_pool(data, model, port, workers):
+    """
+    Evaluate data with `workers` controller processes pulling tasks from a shared queue.
+    Results are sent back and written by this process only.
+    """
+    ctx = mp.get_context("spawn")
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    # one queue item per scene so a worker keeps its FloorPlan loaded across tasks
+    for chunk in scene_chunks(data):
+        task_queue.put(chunk)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    processes = []
+    for worker_id in range(workers):
+        p = ctx.Process(target=pool_worker, args=(worker_id, task_queue, result_queue, model, port), daemon=True)
+        p.start()
+        processes.append(p)
+
+    success_count = 0
+    alive = workers
+    running = {} # worker_id -> identities of its chunk not reported yet
+    exited = set()
+    pbar = tqdm(total=len(data))
+    while alive > 0:
+        try:
+            status, key, result_dir, record = result_queue.get(timeout=WORKER_CHECK_INTERVAL)
+        except queue.Empty:
+            # a worker killed by a crash (segfault, OOM, Unity) never sends "exit"
+            for worker_id, p in enumerate(processes):
+                if worker_id in exited or p.is_alive():
+                    continue
+                exited.add(worker_id)
+                alive -= 1
+                lost = running.pop(worker_id, [])
+                print(f"--worker{worker_id} died (exitcode {p.exitcode}), {len(lost)} tasks of its chunk failed--")
+                pbar.update(len(lost))
+            continue
+        if status == "chunk":
+            running[key] = list(result_dir)
+            continue
+        if status == "exit":
+            if record is not None:
+                perf.merge_spans(record)
+            exited.add(key)
+            running.pop(key, None)
+            alive -= 1
+            continue
+        for identities in running.values():
+            if key in identities:
+                identities.remove(key)
+                break
+        if status == "done":
+            if record is not None:
+                try:
+                    save_result(result_dir, record)
+                except Exception as e:
+                    print(e)
+                    print(f"--task{key}save result failed--")
+                    pbar.update(1)
+                    continue
+            success_count += 1
+        pbar.update(1)
+    # when every worker died, the chunks still queued were never started
+    while True:
+        try:
+            chunk = task_queue.get(timeout=1)
+        except queue.Empty:
+            break
+        if chunk is not None:
+            print(f"--no worker left, {len(chunk)} tasks of {chunk[0]['scene']} failed--")
+            pbar.update(len(chunk))
+    pbar.close()
+    for p in processes:
+        p.join()
+    return success_count
+
+def advance_episode(episode, response=None, start=False):
+    # StopIteration can't cross an executor future, turn it into a plain return value
+    try:
+        if start:
+            return False, next(episode)
+        return False, episode.send(response)
+    except StopIteration as e:
+        return True, e.value
+
+async def run_async(data, model, port, workers, max_inflight):
+    """
+    Interleave episodes on `workers` controllers: while one episode waits on the model,
+    the others step their simulator. At most `max_inflight` model requests run at once.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=workers + max_inflight)
+    semaphore = asyncio.Semaphore(max_inflight)
+    controllers = asyncio.Queue()
+    for controller in await asyncio.gather(*[loop.run_in_executor(executor, create_controller) for _ in range(workers)]):
+        controllers.put_nowait(controller)
+
+    inflight = {"now": 0, "max": 0}
+    episode_stats = []
+    pbar = tqdm(total=len(data))
+
+    async def run_one(test_data, controller):
+        save_path = get_save_path(test_data, model)
+        if os.path.exists(f"{save_path}/result.json"):
+            print(f"""--task{test_data["identity"]}It has been evaluated successfully, skip it.---""")
+            pbar.update(1)
+            return True, controller
+        stats = {"identity": test_data["identity"], "tasktype": test_data["tasktype"], "scene": test_data["scene"],
+                 "env_time": 0.0, "queue_time": 0.0, "infer_time": 0.0, "model_calls": 0, "success": 0}
+        test_start_time = time.time()
+        result = None
+        # executor threads don't know which episode they are working on
+        tag = (test_data["identity"], test_data["tasktype"])
+        try:
+            key_actions = get_key_actions(test_data)
+            episode = run_episode(controller, test_data, model)
+            t = time.time()
+            done, value = await loop.run_in_executor(executor, perf.in_episode, tag, advance_episode, episode, None, True)
+            stats["env_time"] += time.time() - t
+            while not done:
+                t = time.time()
+                async with semaphore:
+                    stats["queue_time"] += time.time() - t
+                    inflight["now"] += 1
+                    inflight["max"] = max(inflight["max"], inflight["now"])
+                    t = time.time()
+                    try:
+                        response = await loop.run_in_executor(executor, perf.in_episode, tag, call_model, value, model, port)
+                    finally:
+                        inflight["now"] -= 1
+                    stats["infer_time"] += time.time() - t
+                    stats["model_calls"] += 1
+                t = time.time()
+                done, value = await loop.run_in_executor(executor, perf.in_episode, tag, advance_episode, episode, response)
+                stats["env_time"] += time.time() - t
+            trajectory, messages, result_dir = value
+            if trajectory is not None:
+                elapsed_time = int(time.time() - test_start_time)
+                result = result_dir, build_record(test_data, model, trajectory, messages, key_actions, elapsed_time)
+        except Exception as e:
+            print(e)
+            print(f"--task{test_data['identity']}Track acquisition failed -- emulator /api exception, end the current evaluation task!!!--")
+        stats["wall_time"] = time.time() - test_start_time
+        if result is None:
+            print(f"--task{test_data['identity']}failed, restart controller--")
+            controller = await loop.run_in_executor(executor, restart_controller, controller)
+        else:
+            try:
+                save_result(*result)
+                stats["success"] = 1
+            except Exception as e:
+                print(e)
+        episode_stats.append(stats)
+        pbar.update(1)
+        return result is not None, controller
+
+    async def run_chunk(chunk):
+        # tasks of one scene run back to back on the same controller
+        controller = await controllers.get()
+        chunk_results = []
+        for test_data in chunk:
+            success, controller = await run_one(test_data, controller)
+            chunk_results.append(success)
+        controllers.put_nowait(controller)
+        return chunk_results
+
+    run_start_time = time.time()
+    results = [r for chunk_results in await asyncio.gather(*[run_chunk(chunk) for chunk in scene_chunks(data)]) for r in chunk_results]
+    run_time = time.time() - run_start_time
+    pbar.close()
+    while not controllers.empty():
+        controller = controllers.get_nowait()
+        try:
+            controller.stop()
+        except Exception as e:
+            print(e)
+    executor.shutdown(wait=False)
+
+    summary = {
+        "episodes": len(episode_stats),
+        "workers": workers,
+        "max_inflight": max_inflight,
+        "observed_max_inflight": inflight["max"],
+        "run_time": round(run_time, 2),
+        "env_time": round(sum(s["env_time"] for s in episode_stats), 2),
+        "queue_time": round(sum(s["queue_time"] for s in episode_stats), 2),
+        "infer_time": round(sum(s["infer_time"] for s in episode_stats), 2),
+        "model_calls": sum(s["model_calls"] for s in episode_stats),
+    }
+    # >1 means simulator and inference work overlapped
+    summary["overlap"] = round((summary["env_time"] + summary["infer_time"]) / run_time, 2) if run_time > 0 else 0.0
+    summary["http"] = http_client.latency_stats()
+    summary["scene_loads"] = dict(scene_load_stats)
+    summary["pose_cache"] = dict(pose_cache_stats)
+    summary["match_tiers"] = dict(matcher.match_stats)
+    print("="*100)
+    print(f"{'identity':<12}{'tasktype':<60}{'env':<8}{'queue':<8}{'infer':<8}{'calls':<6}")
+    for s in episode_stats:
+        print(f"{str(s['identity']):<12}{s['tasktype']:<60}{s['env_time']:<8.1f}{s['queue_time']:<8.1f}{s['infer_time']:<8.1f}{s['model_calls']:<6}")
+    print("="*100)
+    print(summary)
+    os.makedirs("./data", exist_ok=True)
+    with open(f"./data/{model.replace('/', '_')}_async_stats.json", "w") as f:
+        f.write(json.dumps({"summary": summary, "episodes": episode_stats}, indent=4))
+    return sum(1 for r in results if r)
 
 if __name__ == "__main__":
     
@@ -293,34 +655,57 @@ if __name__ == "__main__":
         parser.add_argument("--port", type=int, default=10000, help="")
         parser.add_argument("--cur_count", type=int, default=1, help="")
         parser.add_argument("--total_count", type=int, default=4, help="")
+        parser.add_argument("--workers", type=int, default=1, help="number of controller processes evaluating in parallel")
+        parser.add_argument("--scheduler", type=str, default="pool", choices=["pool", "async"], help="pool: one process per controller; async: interleave episodes in one process")
+        parser.add_argument("--max_inflight", type=int, default=None, help="async scheduler: max concurrent model requests, defaults to --workers")
+        parser.add_argument("--rebuild_index", action="store_true", help="rebuild ./data/<model>_index.jsonl from the result directories")
+        parser.add_argument("--record_dir", type=str, default=None, help="record every simulator step to this directory")
+        parser.add_argument("--replay_dir", type=str, default=None, help="replay recorded simulator steps instead of running AI2-THOR")
+        parser.add_argument("--perf", action="store_true", help="record per-stage spans, writes ./data/<model>_perf_report.json and _perf_trace.json")
         args = parser.parse_args()
         print(args)
+        if args.perf:
+            # env var for the spawned pool workers
+            os.environ["PERF"] = "1"
+            perf.enable()
+        if args.record_dir:
+            os.environ["RECORD_DIR"] = args.record_dir
+        if args.replay_dir:
+            os.environ["REPLAY_DIR"] = args.replay_dir
         data = load_data(args)
+        if args.scheduler == "async":
+            max_inflight = args.max_inflight if args.max_inflight else args.workers
+            success_count = asyncio.run(run_async(data, args.model_name, args.port, args.workers, max_inflight))
+            if perf.enabled():
+                perf.write_reports(f"./data/{args.model_name}")
+            print(f"--The current process evaluation task end--total task count:{len(data)}successed task count:{success_count}")
+            exit()
+        if args.workers > 1:
+            success_count = run_pool(data, args.model_name, args.port, args.workers)
+            if perf.enabled():
+                perf.write_reports(f"./data/{args.model_name}")
+            print(f"--The current process evaluation task end--total task count:{len(data)}successed task count:{success_count}")
+            exit()
         success_count = 0
         # controller = None
-        controller = Controller(
-            platform=CloudRendering,
-            snapToGrid=False,
-            quality='Medium',
-            agentMode="default",
-            massThreshold=None,
-            scene='FloorPlan1',
-            visibilityDistance=20,
-            gridSize=0.1,
-            renderDepthImage=False,
-            renderInstanceSegmentation=False,
-            width=800,
-            height=450,
-            fieldOfView=90,
-        )
+        controller = create_controller()
         for test_data in tqdm(data):
             try:
-                test(controller, test_data, args.model_name, args.port)
-                success_count += 1
+                if test(controller, test_data, args.model_name, args.port):
+                    success_count += 1
+                else:
+                    controller = restart_controller(controller)
             except Exception as e:
                 print(e)
                 print(f"--task{test_data['identity']}failed, End the current evaluation task!!!--")
+                controller = restart_controller(controller)
                 continue
+        controller.stop()
+        print(f"--http latency: {http_client.latency_stats()}")
+        print(f"--scene loads: {scene_load_stats}, interactable pose cache: {pose_cache_stats}")
+        print(f"--object match tiers: {matcher.match_stats}, remote calls saved: {matcher.remote_calls_saved()}")
+        if perf.enabled():
+            perf.write_reports(f"./data/{args.model_name}")
         print(f"--The current process evaluation task end--total task count:{len(data)}successed task count:{success_count}")
     
     
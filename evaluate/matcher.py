@@ -0,0 +1,132 @@
+"""
+In-process matching of the object named in an action ("navigate to the fridge") against the
+object types of the scene. Tiers, tried in order, each only answers when exactly one type fits:
+
+    exact    the item is an object type as written
+    case     same letters, ignoring case, spaces, "_" and "-"  ("counter top" -> CounterTop)
+    plural   singular form of the item                         ("apples" -> Apple, "knives" -> Knife)
+    camel    the item is the last CamelCase words of one type  ("plant" -> HousePlant)
+    edit     one type within a small edit distance             ("fridg" -> Fridge)
+
+Everything else goes to the embedding server (LOCAL) or the LLM (API), see utils.match_item.
+match_stats counts the tier that resolved each call.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# LEXICAL_MATCH=0 sends every non-exact item to the embedding server / LLM like before
+LEXICAL_MATCH = os.getenv("LEXICAL_MATCH", "1") == "1"
+TIERS = ("exact", "case", "plural", "camel", "edit", "embedding", "llm")
+ARTICLES = ("the ", "a ", "an ")
+
+match_stats = {tier: 0 for tier in TIERS}
+stats_lock = threading.Lock()
+
+def record(tier):
+    with stats_lock:
+        match_stats[tier] += 1
+
+def remote_calls_saved():
+    # calls the lexical tiers answered, each would have been a /match request or an LLM call
+    with stats_lock:
+        return sum(match_stats[tier] for tier in ("exact", "case", "plural", "camel", "edit"))
+
+def normalize(text):
+    return re.sub(r"[\s_\-]+", "", text).lower()
+
+def camel_words(object_type):
+    # "CounterTop" -> ["counter", "top"], "TVStand" -> ["tv", "stand"]
+    return [w.lower() for w in re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", object_type)]
+
+def singular_forms(word):
+    forms = [word]
+    if word.endswith("ies") and len(word) > 4:
+        forms.append(word[:-3] + "y")
+    if word.endswith("ves") and len(word) > 4:
+        forms += [word[:-3] + "f", word[:-3] + "fe"]
+    if word.endswith("es") and len(word) > 3:
+        forms.append(word[:-2])
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 2:
+        forms.append(word[:-1])
+    return forms
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def extract_item(description, action_space=()):
+    """
+    Object part of an action: "navigate to the Fridge" -> "Fridge".
+    """
+    text = description.strip()
+    if "put in" in text:
+        text = text.split("put in", 1)[1]
+    else:
+        for action_name in sorted(action_space, key=len, reverse=True):
+            if text.startswith(action_name):
+                text = text[len(action_name):]
+                break
+    text = text.strip()
+    for article in ARTICLES:
+        if text.lower().startswith(article):
+            text = text[len(article):]
+    return text.strip(" .\"'")
+
+def unique(candidates):
+    candidates = list(OrderedDict.fromkeys(candidates))
+    return candidates[0] if len(candidates) == 1 else None
+
+def lexical_match(item, objects):
+    """
+    (object type, tier) or (None, None) when no tier finds exactly one type.
+    """
+    if not item:
+        return None, None
+    if item in objects:
+        return item, "exact"
+    key = normalize(item)
+    normalized = {}
+    for obj in objects:
+        normalized.setdefault(normalize(obj), []).append(obj)
+    found = unique(normalized.get(key, []))
+    if found is not None:
+        return found, "case"
+
+    words = [w.lower() for w in re.split(r"[\s_\-]+", item) if w]
+    singular_keys = {"".join(words[:-1]) + form for form in singular_forms(words[-1])[1:]} if words else set()
+    found = unique(obj for k in singular_keys for obj in normalized.get(k, []))
+    if found is not None:
+        return found, "plural"
+
+    heads = {"".join(words[:-1]) + form for form in singular_forms(words[-1])} if words else set()
+    found = unique(obj for obj in objects
+                   for n in range(1, len(camel_words(obj)))
+                   if "".join(camel_words(obj)[-n:]) in heads)
+    if found is not None:
+        return found, "camel"
+
+    # at most one edit per 4 letters, and the closest type has to be the only one that close
+    limit = len(key) // 4
+    if limit:
+        distances = sorted((edit_distance(key, k), k) for k in normalized)
+        if distances[0][0] <= limit and (len(distances) == 1 or distances[1][0] > distances[0][0]):
+            found = unique(normalized[distances[0][1]])
+            if found is not None:
+                return found, "edit"
+    return None, None
+
+def match(description, objects, action_space=()):
+    """
+    Lexical match of description against objects, (object type, tier) or (None, None).
+    """
+    if not LEXICAL_MATCH:
+        return None, None
+    objects = list(OrderedDict.fromkeys(objects))
+    return lexical_match(extract_item(description, action_space), objects)
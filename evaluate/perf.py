@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+import numpy as np
+
+# PERF=1 (or perf.enable()) turns on the timers, they are no-ops otherwise
+PERF = os.getenv("PERF", "0") == "1"
+EPOCH = time.time() - time.perf_counter()
+
+# (stage, category, start, duration, self_time, pid, tid, identity, tasktype)
+spans = []
+# identity -> stage -> {"total", "count"}, kept up to date for the per-episode summary in result.json
+episodes = {}
+lock = threading.Lock()
+local = threading.local()
+
+def enable(flag=True):
+    global PERF
+    PERF = flag
+
+def enabled():
+    return PERF
+
+def reset():
+    with lock:
+        spans.clear()
+        episodes.clear()
+
+def add_span(span):
+    # called with lock held
+    spans.append(span)
+    identity = span[7]
+    if identity is not None:
+        r = episodes.setdefault(identity, {}).setdefault(span[0], {"total": 0.0, "count": 0})
+        r["total"] += span[3]
+        r["count"] += 1
+
+@contextmanager
+def episode(identity, tasktype):
+    """
+    Tag the spans recorded by this thread with the episode they belong to.
+    """
+    prev = getattr(local, "episode", None)
+    local.episode = (identity, tasktype)
+    try:
+        yield
+    finally:
+        local.episode = prev
+
+def in_episode(tag, func, *args):
+    # for executor threads, which don't inherit the caller's episode
+    with episode(*tag):
+        return func(*args)
+
+@contextmanager
+def timer(stage, category=None):
+    """
+    Span around one stage of a step. Nested spans are subtracted from the parent's
+    self time, so category totals don't count the same time twice.
+    """
+    if not PERF:
+        yield
+        return
+    stack = getattr(local, "stack", None)
+    if stack is None:
+        stack = local.stack = []
+    children = [0.0]
+    stack.append(children)
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - t
+        stack.pop()
+        if stack:
+            stack[-1][0] += duration
+        identity, tasktype = getattr(local, "episode", None) or (None, None)
+        with lock:
+            add_span((stage, category or stage, EPOCH + t, duration, duration - children[0],
+                      os.getpid(), threading.get_ident(), identity, tasktype))
+
+def timed(stage, category=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PERF:
+                return func(*args, **kwargs)
+            with timer(stage, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def export_spans():
+    with lock:
+        return list(spans)
+
+def merge_spans(other):
+    # spans sent back by pool worker processes
+    with lock:
+        for span in other:
+            add_span(tuple(span))
+
+def report():
+    """
+    Self time per category.
+    """
+    result = {}
+    for stage, category, start, duration, self_time, *_ in export_spans():
+        r = result.setdefault(category, {"total": 0.0, "count": 0})
+        r["total"] += self_time
+        r["count"] += 1
+    for r in result.values():
+        r["avg"] = round(r["total"] / r["count"], 6)
+        r["total"] = round(r["total"], 4)
+    return result
+
+def percentiles(durations):
+    durations = np.asarray(durations)
+    return {
+        "count": int(len(durations)),
+        "total": round(float(durations.sum()), 4),
+        "p50": round(float(np.percentile(durations, 50)), 6),
+        "p95": round(float(np.percentile(durations, 95)), 6),
+        "p99": round(float(np.percentile(durations, 99)), 6),
+    }
+
+def stage_report():
+    """
+    p50/p95/p99 of span durations per stage, for every tasktype and for "all".
+    """
+    groups = {}
+    for stage, category, start, duration, self_time, pid, tid, identity, tasktype in export_spans():
+        for key in ("all", tasktype or "none"):
+            groups.setdefault(key, {}).setdefault(stage, []).append(duration)
+    return {tasktype: {stage: percentiles(d) for stage, d in stages.items()} for tasktype, stages in groups.items()}
+
+def episode_summary(identity):
+    with lock:
+        stages = episodes.get(identity, {})
+        return {stage: {"total": round(r["total"], 4), "count": r["count"]} for stage, r in stages.items()}
+
+def chrome_trace():
+    events = []
+    for stage, category, start, duration, self_time, pid, tid, identity, tasktype in export_spans():
+        events.append({
+            "name": stage,
+            "cat": category,
+            "ph": "X",
+            "ts": round(start * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": pid,
+            "tid": tid,
+            "args": {"identity": identity, "tasktype": tasktype},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def write_reports(prefix_path):
+    """
+    Writes <prefix>_perf_trace.json (chrome://tracing / Perfetto) and <prefix>_perf_report.json.
+    """
+    os.makedirs(os.path.dirname(prefix_path) or ".", exist_ok=True)
+    with open(f"{prefix_path}_perf_trace.json", "w") as f:
+        f.write(json.dumps(chrome_trace()))
+    result = {"categories": report(), "stages": stage_report()}
+    with open(f"{prefix_path}_perf_report.json", "w") as f:
+        f.write(json.dumps(result, indent=4))
+    print("="*100)
+    print(f"{'stage':<24}{'count':<10}{'total':<12}{'p50':<12}{'p95':<12}{'p99':<12}")
+    for stage, r in sorted(result["stages"].get("all", {}).items()):
+        print(f"{stage:<24}{r['count']:<10}{r['total']:<12.3f}{r['p50']:<12.4f}{r['p95']:<12.4f}{r['p99']:<12.4f}")
+    print("="*100)
+    print(f"--perf report:{prefix_path}_perf_report.json, trace:{prefix_path}_perf_trace.json--")
+    return result
+
+class TimedController:
+    """
+    Times reset/step of a live or replayed controller under the "sim" category.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+
+    @property
+    def last_event(self):
+        return self.controller.last_event
+
+    @timed("controller_step", "sim")
+    def step(self, *args, **kwargs):
+        return self.controller.step(*args, **kwargs)
+
+    @timed("controller_reset", "sim")
+    def reset(self, *args, **kwargs):
+        return self.controller.reset(*args, **kwargs)
+
+    def stop(self):
+        self.controller.stop()
@@ -0,0 +1,121 @@
+"""
+Precompute the navigation pose of every object the evaluator can navigate to.
+
+For each scene, runs the same compute_position_8 / adjust_height / adjust_view steps as
+RocAgent.navigate on the freshly loaded scene, keeps the poses from which the object is
+visible and writes them to ./data/scene_cache/<scene>/poses.json. RocAgent.navigate then
+teleports straight to the stored pose.
+
+    python evaluate/precompute_poses.py --input_path data/test_809.json
+    python evaluate/precompute_poses.py --scenes FloorPlan1 FloorPlan2 --overwrite
+"""
+import os
+import json
+import glob
+import argparse
+
+from tqdm import tqdm
+
+import evaluate
+from ai2thor_engine.RocAgent import RocAgent
+from ai2thor_engine import scene_poses
+
+MAX_TELEPORT_RETRIES = 5
+
+def collect_scenes(args):
+    scene2tasks = {}
+    if args.input_path:
+        with open(args.input_path) as f:
+            for task in json.load(f):
+                scene2tasks.setdefault(task["scene"], []).append(task)
+    if args.metadata_dir:
+        paths = sorted(glob.glob(os.path.join(args.metadata_dir, "FloorPlan*.json")))
+        if not paths:
+            print(f"--no FloorPlan*.json in {args.metadata_dir}--")
+        for path in paths:
+            scene2tasks.setdefault(os.path.splitext(os.path.basename(path))[0], [])
+    for scene in args.scenes or []:
+        scene2tasks.setdefault(scene, [])
+    return scene2tasks
+
+def navigable_items(agent, tasks):
+    """
+    Objects RocAgent.navigate can be sent to: the first object of every type, plus the
+    target and related objects of the scene's tasks.
+    """
+    object_ids = [objs[0]["objectId"] for object_type, objs in agent.objecttype2object.items() if object_type != "Floor"]
+    for task in tasks:
+        object_ids += task["target_objects"] + task["related_objects"]
+    items = []
+    for object_id in dict.fromkeys(object_ids):
+        item = agent.eventobject.get_object_by_id(agent.controller.last_event, object_id)
+        if item is not None:
+            items.append(item)
+    return items
+
+def compute_pose(agent, item):
+    target_position, target_rotation = agent.compute_position_8(item, pre_target_positions=[])
+    pre_target_positions = []
+    for _ in range(MAX_TELEPORT_RETRIES):
+        if target_position is None:
+            return None
+        event = agent.action.action_mapping["teleport"](agent.controller, position=target_position, rotation=target_rotation, horizon=60)
+        if event.metadata["lastActionSuccess"]:
+            break
+        pre_target_positions.append(target_position)
+        target_position, target_rotation = agent.compute_position_8(item, pre_target_positions)
+    else:
+        return None
+    agent.adjust_height(item)
+    agent.adjust_view(item)
+    event = agent.controller.last_event
+    current = agent.eventobject.get_object_by_id(event, item["objectId"])
+    if current is None or not current["visible"]:
+        return None
+    return scene_poses.pose_entry(current, event.metadata["agent"])
+
+def compute_scene(controller, scene, tasks):
+    agent = RocAgent(controller, "./data/precompute_poses", scene, visibilityDistance=20, gridSize=0.1, fieldOfView=90)
+    # hand-set poses in agent_positions.json are used as they are
+    agent.objid2position = {}
+    objects = {}
+    failed = []
+    for item in navigable_items(agent, tasks):
+        try:
+            pose = compute_pose(agent, item)
+        except Exception as e:
+            print(f"{scene} {item['objectId']}: {e}")
+            pose = None
+        if pose is None:
+            failed.append(item["objectId"])
+        else:
+            objects[item["objectId"]] = pose
+    return objects, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_path", type=str, default="./data/test_809.json", help="tasks whose scenes and target objects are precomputed")
+    parser.add_argument("--metadata_dir", type=str, default=None, help="optional, also precompute the scenes of a data engine task metadata dir (one FloorPlan*.json per scene), e.g. ./data_engine/pickup_and_put_task_metadata")
+    parser.add_argument("--scenes", type=str, nargs="*", default=None, help="additional scenes")
+    parser.add_argument("--overwrite", action="store_true", help="recompute scenes that already have a poses.json")
+    args = parser.parse_args()
+
+    scene2tasks = collect_scenes(args)
+    controller = evaluate.create_controller()
+    summary = {}
+    for scene, tasks in tqdm(sorted(scene2tasks.items())):
+        if os.path.exists(scene_poses.poses_path(scene)) and not args.overwrite:
+            print(f"--{scene} poses exist, skip it--")
+            continue
+        try:
+            objects, failed = compute_scene(controller, scene, tasks)
+        except Exception as e:
+            print(e)
+            print(f"--{scene} failed, restart controller--")
+            controller = evaluate.restart_controller(controller)
+            continue
+        scene_poses.save_scene_poses(scene, objects)
+        summary[scene] = {"poses": len(objects), "failed": len(failed)}
+        print(f"--{scene} poses:{len(objects)} failed:{failed}--")
+    controller.stop()
+    print(summary)
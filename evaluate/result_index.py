@@ -0,0 +1,79 @@
+import os
+import json
+import fcntl
+
+# fields of a trajectory step needed to recompute metrics, images and messages stay in result.json
+TRAJECTORY_KEYS = ("response", "action", "object", "legal_objects", "success")
+
+def index_path(prefix_path):
+    """
+    prefix_path: ./data/{model}, the index sits next to it like show_result's {model}.jsonl
+    """
+    return prefix_path.rstrip("/") + "_index.jsonl"
+
+def index_entry(result_dir, record):
+    entry = {k: v for k, v in record.items() if k not in ("trajectory", "messages")}
+    entry["key"] = os.path.basename(result_dir.rstrip("/"))
+    entry["trajectory"] = [{k: t.get(k) for k in TRAJECTORY_KEYS} for t in record["trajectory"]]
+    return entry
+
+def append(prefix_path, result_dir, record):
+    os.makedirs(os.path.dirname(index_path(prefix_path)) or ".", exist_ok=True)
+    line = json.dumps(index_entry(result_dir, record), ensure_ascii=False) + "\n"
+    with open(index_path(prefix_path), "a") as f:
+        # several evaluation processes may append to the same index
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.write(line)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def iter_index(prefix_path):
+    with open(index_path(prefix_path)) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a partially written last line from an interrupted run
+                continue
+
+def rebuild(prefix_path):
+    """
+    Recreate the index from the result.json files under prefix_path.
+    """
+    entries = []
+    if os.path.exists(prefix_path):
+        for pre in os.listdir(prefix_path):
+            file_path = os.path.join(prefix_path, pre, "result.json")
+            if not os.path.exists(file_path):
+                continue
+            try:
+                with open(file_path) as f:
+                    entries.append(index_entry(pre, json.load(f)))
+            except Exception as e:
+                print(e)
+    os.makedirs(os.path.dirname(index_path(prefix_path)) or ".", exist_ok=True)
+    tmp_path = index_path(prefix_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, index_path(prefix_path))
+    print(f"--rebuild result index:{index_path(prefix_path)}, count:{len(entries)}--")
+    return entries
+
+def load_entries(prefix_path, rebuild_index=False):
+    """
+    Latest entry per task. Falls back to scanning the result directories when there is no index yet.
+    """
+    if rebuild_index or not os.path.exists(index_path(prefix_path)):
+        entries = rebuild(prefix_path)
+    else:
+        entries = iter_index(prefix_path)
+    key2entry = {}
+    for entry in entries:
+        key2entry[entry["key"]] = entry
+    return list(key2entry.values())
+
+def load_done(prefix_path, rebuild_index=False):
+    return {entry["key"] for entry in load_entries(prefix_path, rebuild_index)}
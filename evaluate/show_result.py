@@ -12,6 +12,7 @@ import copy
 import base64
 import tiktoken
 import argparse
+from result_index import load_entries
 
 
 model = "gpt-4o"
@@ -138,18 +139,13 @@ def metric(tasktype, taskname, trajectory, key_actions):
     step2count[str(len(key_actions)-1)] += 1
     return metric_dic
 
-def load_data(prefix_path):
+def load_data(prefix_path, rebuild_index=False):
     data_temp = []
     exsit_task = 0
     try:
-        for pre in os.listdir(prefix_path):
-            mid_path = os.path.join(prefix_path, pre)
-            exsit_task+=1
-            for path in os.listdir(mid_path):
-                file_path = os.path.join(mid_path, path)
-                if file_path.endswith(".json"):
-                    with open(file_path, 'r') as f:
-                        data_temp.append(json.load(f))
+        exsit_task = len(os.listdir(prefix_path))
+        # slim records from ./data/<model>_index.jsonl, without re-reading every result.json
+        data_temp = load_entries(prefix_path, rebuild_index)
     except Exception as e:
         print(e)
     print(f"--evaluate success count:{len(data_temp)}, evaluating count:{exsit_task-len(data_temp)},last count:{784-exsit_task}--")
@@ -186,13 +182,13 @@ def load_data(prefix_path):
         
     return data_temp
 
-def main(model_list):
+def main(model_list, rebuild_index=False):
     data = []
     for model in model_list:
         prefix_path = f"data/{model}"
         if os.path.exists(prefix_path):
             print(f"--model:{model}--evaluate--")
-            data.extend(load_data(prefix_path))
+            data.extend(load_data(prefix_path, rebuild_index))
 
     model2data = {}
     model2result = {}
@@ -332,6 +328,7 @@ def show_result(model2result):
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_name", type=str, default=None, help="")
+    parser.add_argument("--rebuild_index", action="store_true", help="rebuild data/<model>_index.jsonl from the result directories")
     
     args = parser.parse_args()
     if args.model_name is None:
@@ -339,4 +336,4 @@ if __name__=="__main__":
         exit()
     model_list = args.model_name.split(",")
     # model_list = ["Qwen/Qwen2.5-VL-3B-Instruct"]
-    main(model_list)
\ No newline at end of file
+    main(model_list, args.rebuild_index)
\ No newline at end of file
@@ -1,14 +1,24 @@
 import random
 import re
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import copy
 import base64
 # from openai import OpenAI
 import http.client
 import json
 import requests
+from common import http_client
+import perf
+import matcher
+from common import frame_writer
 from collections import OrderedDict
+from multiprocessing import shared_memory
 from prompt import MATCH_PROMPT
-import os
+import numpy as np
+import weakref
+import uuid
 try:
     from VLMCall import VLMAPI,VLMRequestError
 except Exception as e:
@@ -22,6 +32,12 @@ if DEPLOY_MODEL_COUNT is None:
     DEPLOY_MODEL_COUNT = 4 
 print(f"evaluate utils:{DEPLOY_MODEL_COUNT}")
 print(f"evaluate utils:{LOCAL_PORT}")
+# "shm": hand frames to a local inference server on the same host through shared memory
+FRAME_TRANSPORT = os.getenv("FRAME_TRANSPORT", "http")
+FRAME_RING_MB = int(os.getenv("FRAME_RING_MB", 256))
+MATCH_PORT = os.getenv("MATCH_PORT", "20000")
+# CHAT_SESSIONS=0 always sends the whole conversation to /chat
+CHAT_SESSIONS = os.getenv("CHAT_SESSIONS", "1") == "1"
 
 def metric(task, trajectory, key_actions):
     shortest_actions = copy.deepcopy(key_actions)
@@ -129,50 +145,65 @@ def call_llm(messages, model,retry_limit=3):
     return content
 
 def prepare_deploy_messages(inputs_):
-    inputs = copy.deepcopy(inputs_)
-    images = inputs["images"]
-    messages = inputs["messages"]
-    image_index = 0
-    for m in messages:
-        if "<image>" in m["content"]:
-            count = m["content"].count("<image>")
-            user_text = m['content'].replace("<image>", "")
-            content = []
-            for i in range(count):
-                content.append({"type": "image", "image": f"data:image/png;base64,{encode_image(images[image_index])}"})
-                image_index += 1
-            content.append({"type": "text", "text": user_text})
-            m['content'] = content
-    return messages
-
-def local_model(messages, port):
+    # the episode's builder (and its FrameRing) if inputs_ has one
+    builder = inputs_.get("builder") or MessageBuilder("image")
+    return builder.build(inputs_)
+
+@perf.timed("model_http", "http")
+def local_model(messages, port, session=None):
+    """
+    session: the episode's MessageBuilder. If the server keeps /chat sessions only the
+    messages it doesn't have yet are sent.
+    """
+    line = {"messages": messages}
+    if session is not None and session.session_supported is not False:
+        line = {"messages": messages[session.sent:], "session_id": session.session_id, "offset": session.sent}
     data = {
-        "inputs":[{"messages": messages}]
+        "inputs":[line]
     }
     
     url = f"http://127.0.0.1:{port}/chat"
 
     print("url:",url)
-    response = requests.post(url, json=data, timeout=300) 
-    print(response.json())
-    if isinstance(response.json()["output_text"],list):
-        return response.json()["output_text"][0]
+    response = http_client.post(url, json=data)
+    if response.status_code == 409 and session is not None:
+        # the server dropped the session (restart, eviction), start it over
+        data = {"inputs":[{"messages": messages, "session_id": session.session_id, "offset": 0}]}
+        response = http_client.post(url, json=data)
+    output = response.json()
+    print(output)
+    if session is not None:
+        # servers without sessions ignore session_id and don't answer with session_length
+        session.session_supported = "session_length" in output
+        session.sent = len(messages) if session.session_supported else 0
+    if isinstance(output["output_text"],list):
+        return output["output_text"][0]
     else:
-        return response.json()["output_text"]
+        return output["output_text"]
 
 def match_item(description, objects,action_space,MODE,match_item_model="default"):
     if description.startswith("observe") or description.startswith("move forward"):
         return None
+    # match lexically in-process first, only ambiguous items go to the embedding server / LLM
+    item, tier = matcher.match(description, objects, action_space)
+    if item is not None:
+        matcher.record(tier)
+        return item
+    return remote_match_item(description, objects, action_space, MODE, match_item_model)
+
+@perf.timed("match", "http")
+def remote_match_item(description, objects,action_space,MODE,match_item_model="default"):
     target_obj = "No Suitable Object"
     objects_unique = list(OrderedDict.fromkeys(objects))
     
     if MODE=="LOCAL": 
+        matcher.record("embedding")
         data = {
                     "s1":[description], 
                     "s2":objects_unique
                 }
         try:
-            response = requests.post("http://127.0.0.1:20000/match", json=data)
+            response = http_client.post(f"http://127.0.0.1:{MATCH_PORT}/match", json=data)
             target_obj = response.json()["target_obj"]
         except:
             print("embedding match failed")
@@ -191,6 +222,7 @@ def match_item(description, objects,action_space,MODE,match_item_model="default"
                 item_lower = item.lower()
                 for obj in objects_unique:
                     if obj.lower() == item_lower:
+                        matcher.record("case")
                         return obj
             if description.startswith(action_name):
                 item=description.replace(action_name,"")
@@ -198,8 +230,10 @@ def match_item(description, objects,action_space,MODE,match_item_model="default"
                 item_lower = item.lower()
                 for obj in objects_unique: 
                     if obj.lower() == item_lower:
+                        matcher.record("case")
                         return obj
                     
+        matcher.record("llm")
         if item!="":# 
             target_obj = call_llm([
                     {"role": "user", 
@@ -219,26 +253,123 @@ def match_item(description, objects,action_space,MODE,match_item_model="default"
         
 
 def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+    # frames the frame writer hasn't written yet are read from its memory
+    return base64.b64encode(frame_writer.read(image_path)).decode("utf-8")
 
 def prepare_api_messages(inputs_):
-    inputs = copy.deepcopy(inputs_)
-    images = inputs["images"]
-    messages = inputs["messages"]
-    image_index = 0
-    for m in messages:
-        if "<image>" in m["content"]:
-            count = m["content"].count("<image>")
-            user_text = m['content'].replace("<image>", "")
-            content = []
-            for i in range(count):
-                content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(images[image_index])}"}})
-                image_index += 1
-            content.append({"type": "text", "text": user_text})
-            m['content'] = content
-    
-    return messages
+    builder = inputs_.get("builder") or MessageBuilder("image_url")
+    return builder.build(inputs_)
+
+class FrameRing:
+    """
+    Shared-memory arena for handing raw RGB frames to a local inference server on the
+    same host. Frames are appended and addressed by "shm://<name>/<offset>/<h>x<w>x<c>"
+    handles; every episode has its own ring, unlinked when the episode is done.
+    """
+    def __init__(self, size=FRAME_RING_MB * 1024 * 1024):
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.size = size
+        self.offset = 0
+
+    def put(self, frame):
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if self.offset + frame.nbytes > self.size:
+            return None
+        np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=self.offset)[:] = frame
+        handle = f"shm://{self.shm.name}/{self.offset}/{'x'.join(str(i) for i in frame.shape)}"
+        self.offset += frame.nbytes
+        return handle
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+class MessageBuilder:
+    """
+    Episode-scoped message builder. Messages and images of an episode are append-only,
+    so every frame is encoded once and already built messages are reused on later steps.
+    image_type: "image" for the local deploy server, "image_url" for the openai api.
+    frames: image path -> RGB frame; with FRAME_TRANSPORT=shm these frames are passed
+    through a FrameRing instead of being base64 encoded. Without frames there is no ring.
+    """
+    def __init__(self, image_type="image", frames=None):
+        self.image_type = image_type
+        self.frames = frames if frames is not None else {}
+        self.ring = None
+        if FRAME_TRANSPORT == "shm" and image_type == "image" and frames is not None:
+            self.ring = FrameRing()
+            # also runs if the builder is dropped without close() or at interpreter exit
+            self.release = weakref.finalize(self, self.ring.close)
+        self.messages = []
+        self.image_index = 0
+        self.urls = {}
+        self.bytes_encoded = 0
+        self.bytes_shared = 0
+        self.images_encoded = 0
+        self.cache_hits = 0
+        self.step_bytes_encoded = []
+        # /chat session: messages the server already has, None until the first reply tells
+        # whether the server keeps sessions
+        self.session_id = uuid.uuid4().hex
+        self.sent = 0
+        self.session_supported = None
+
+    def url(self, image_path):
+        if image_path in self.urls:
+            self.cache_hits += 1
+            return self.urls[image_path]
+        url = None
+        if self.ring is not None and image_path in self.frames:
+            url = self.ring.put(self.frames[image_path])
+            if url is not None:
+                self.bytes_shared += self.frames[image_path].nbytes
+        if url is None: # no frame kept or the ring is full
+            data = encode_image(image_path)
+            self.bytes_encoded += len(data)
+            url = f"data:{frame_writer.mime_type(image_path)};base64,{data}"
+        self.urls[image_path] = url
+        self.images_encoded += 1
+        return url
+
+    def image_block(self, image_path):
+        url = self.url(image_path)
+        if self.image_type == "image_url":
+            return {"type": "image_url", "image_url": {"url": url}}
+        return {"type": "image", "image": url}
+
+    @perf.timed("message_build", "encode")
+    def build(self, inputs):
+        images = inputs["images"]
+        messages = inputs["messages"]
+        bytes_encoded = self.bytes_encoded
+        for m in messages[len(self.messages):]:
+            m = dict(m)
+            if "<image>" in m["content"]:
+                count = m["content"].count("<image>")
+                user_text = m["content"].replace("<image>", "")
+                content = []
+                for i in range(count):
+                    content.append(self.image_block(images[self.image_index]))
+                    self.image_index += 1
+                content.append({"type": "text", "text": user_text})
+                m["content"] = content
+            self.messages.append(m)
+        self.step_bytes_encoded.append(self.bytes_encoded - bytes_encoded)
+        return list(self.messages)
+
+    def close(self):
+        if self.ring is not None:
+            self.release()
+
+    def stats(self):
+        return {
+            "steps": len(self.step_bytes_encoded),
+            "images_encoded": self.images_encoded,
+            "bytes_encoded": self.bytes_encoded,
+            "bytes_shared": self.bytes_shared,
+            "cache_hits": self.cache_hits,
+            "max_step_bytes_encoded": max(self.step_bytes_encoded, default=0),
+        }
 
 def invalid_action(action):
     # "put in" for MODE=API
@@ -262,6 +393,7 @@ def macth_action_item(response, action_space, objects,MODE="LOCAL"):
     else:
         raw_item = raw_action.split(" ")[-1].strip()
         if raw_item in objects:
+            matcher.record("exact")
             item = raw_item
         else:
             item = match_item(raw_action.strip(), objects,action_space,MODE)
@@ -0,0 +1,92 @@
+"""
+HfServer throughput at several batch sizes.
+
+Generates the same synthetic conversations (images and a question each) with
+HfServer.chat_batch, batch_size conversations per generate, and reports conversations/s and
+generated tokens/s per batch size. Images are preprocessed before timing, greedy decoding.
+
+    python benchmark_hf.py --model_type qwen2_vl --model_name Qwen/Qwen2-VL-2B-Instruct --batch_sizes 1,4,8
+"""
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+from predictor.hf_infer import HfServer
+
+QUESTIONS = [
+    "Describe this image.",
+    "What objects can you see in the image?",
+    "Which colors dominate the image?",
+    "Where could a robot find an apple in this room?",
+    "Is there a table in the image? Answer and explain.",
+    "Describe the layout of the scene from left to right.",
+    "What should a robot do first to tidy up this room?",
+    "Summarize the image in one sentence.",
+]
+
+def make_conversations(count, images_per_conversation, width, height, seed=0):
+    rng = np.random.RandomState(seed)
+    conversations = []
+    for i in range(count):
+        content = [{"type": "image", "image": Image.fromarray(rng.randint(0, 255, (height, width, 3), dtype=np.uint8))}
+                   for _ in range(images_per_conversation)]
+        content.append({"type": "text", "text": QUESTIONS[i % len(QUESTIONS)]})
+        conversations.append([{"messages": [{"role": "user", "content": content}]}])
+    return conversations
+
+def run(server, conversations, batch_size, generation_params):
+    tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(conversations), batch_size):
+        for _, output_len in server.chat_batch(conversations[i:i + batch_size], generation_params):
+            tokens += output_len
+    seconds = time.perf_counter() - start
+    return {
+        "batch_size": batch_size,
+        "conversations": len(conversations),
+        "seconds": round(seconds, 3),
+        "conversations_per_s": round(len(conversations) / seconds, 3),
+        "tokens_per_s": round(tokens / seconds, 1),
+        "generated_tokens": tokens,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_type", type=str, default="qwen2_vl", help="The model type to be used.")
+    parser.add_argument("--model_name", type=str, default="Qwen/Qwen2-VL-2B-Instruct", help="A small local model.")
+    parser.add_argument("--batch_sizes", type=str, default="1,4,8", help="")
+    parser.add_argument("--conversations", type=int, default=32, help="conversations per batch size")
+    parser.add_argument("--images", type=int, default=1, help="images per conversation")
+    parser.add_argument("--image_size", type=str, default="640x480", help="width x height of the synthetic images")
+    parser.add_argument("--max_new_tokens", type=int, default=128, help="")
+    parser.add_argument("--output", type=str, default="./benchmark_hf_report.json", help="report path")
+    args = parser.parse_args()
+
+    width, height = (int(i) for i in args.image_size.split("x"))
+    batch_sizes = [int(i) for i in args.batch_sizes.split(",")]
+    server = HfServer(args.model_type, args.model_name)
+    conversations = make_conversations(args.conversations, args.images, width, height)
+    generation_params = {"do_sample": False, "max_new_tokens": args.max_new_tokens, "temperature": None, "top_p": None, "top_k": None}
+    for inputs in conversations:
+        inputs[0]["preprocessed_images"] = server.chat_images(inputs[0]["messages"])
+    # warm up the kernels
+    server.chat_batch(conversations[:max(batch_sizes)], {**generation_params, "max_new_tokens": 8})
+
+    results = []
+    for batch_size in batch_sizes:
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        result = run(server, conversations, batch_size, generation_params)
+        if torch.cuda.is_available():
+            result["peak_memory_gb"] = round(torch.cuda.max_memory_allocated() / 1024 ** 3, 2)
+        result["speedup"] = round(result["conversations_per_s"] / results[0]["conversations_per_s"], 2) if results else 1.0
+        results.append(result)
+        print(result)
+
+    report = {"model_name": args.model_name, "model_type": args.model_type, "images": args.images,
+              "image_size": args.image_size, "max_new_tokens": args.max_new_tokens, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"report: {args.output}")
@@ -2,6 +2,10 @@ from flask import Flask, request, jsonify
 from predictor.hf_infer import HfServer
 from predictor.vllm_infer import VllmServer
 from predictor.embedding_server import EmbeddingServer
+from predictor.utils import resolve_shm_images
+from predictor.batching import BatchQueue
+from predictor.sessions import SessionStore, SessionMismatch
+from predictor.image_cache import image_cache
 import os
 import argparse
 # os.environ["CUDA_VISIBLE_DEVICES"] = "5"
@@ -11,6 +15,12 @@ def http_server(args):
         model_server = HfServer(args.model_type, args.model_name)
     elif args.frame == "vllm":
         model_server = VllmServer(args.model_type, args.model_name)
+    # concurrent /chat requests are generated together when the backend can batch them
+    batch_queue = None
+    if args.max_batch_size > 1 and hasattr(model_server, "chat_batch"):
+        batch_queue = BatchQueue(model_server.chat_batch, args.max_batch_size, args.batch_window_ms)
+    # conversations of session /chat requests, their images are preprocessed once
+    sessions = SessionStore(getattr(model_server, "chat_images", None), args.max_sessions, args.session_ttl)
     
     @app.route("/generate", methods=["POST"])
     def generate():
@@ -26,12 +36,34 @@ def http_server(args):
     def chat():
         data = request.json
         generation_parms = data['generation_parms'] if "generation_parms" in data else None
-        outputs, outputs_length = model_server.chat(data['inputs'], generation_parms)
+        session_length = None
+        for line in data['inputs']:
+            resolve_shm_images(line["messages"])
+            if "session_id" in line:
+                # only the messages after "offset" are sent, the session has the rest
+                try:
+                    messages, images = sessions.extend(line["session_id"], line.get("offset", 0), line["messages"])
+                except SessionMismatch as e:
+                    return jsonify({"error": "session_mismatch", "session_length": e.length}), 409
+                line["messages"] = messages
+                if images is not None:
+                    line["preprocessed_images"] = images
+                session_length = len(messages)
+        if batch_queue is not None:
+            outputs, outputs_length = batch_queue.submit(data['inputs'], generation_parms)
+        else:
+            outputs, outputs_length = model_server.chat(data['inputs'], generation_parms)
         if isinstance(outputs,list):
             outputs = outputs[0]
+        if session_length is not None:
+            return jsonify({"output_text":outputs, "output_len":outputs_length, "session_length":session_length})
         return jsonify({"output_text":outputs, "output_len":outputs_length})
 
-    app.run(port=args.port)
+    @app.route("/stats", methods=["GET"])
+    def stats():
+        return jsonify({"batching": batch_queue.stats if batch_queue is not None else None, "sessions": sessions.stats, "image_cache": image_cache.stats})
+
+    app.run(port=args.port, threaded=True)
 
 def embedding_http_server(args):
     app = Flask(__name__)
@@ -56,6 +88,10 @@ if __name__ == "__main__":
     parser.add_argument("--model_type", type=str, default="qwen2_5_vl", help="The model type to be used.")
     parser.add_argument("--model_name", type=str, default="Qwen/Qwen2.5-VL-3B-Instruct", help="The model name to be used.")
     parser.add_argument("--port", type=int, default=10000, help="The port to be used.")
+    parser.add_argument("--max_batch_size", type=int, default=8, help="Max /chat requests generated together, 1 disables batching.")
+    parser.add_argument("--batch_window_ms", type=float, default=10, help="How long a batch waits for more /chat requests after the first one.")
+    parser.add_argument("--max_sessions", type=int, default=32, help="Max /chat sessions kept, least recently used ones are dropped.")
+    parser.add_argument("--session_ttl", type=float, default=600, help="Seconds an idle /chat session is kept.")
     args = parser.parse_args()
 
     if args.embedding==1:
@@ -0,0 +1,68 @@
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+class BatchQueue:
+    """
+    Collects concurrent /chat requests for up to `window_ms` after the first one (or until
+    `max_batch_size` requests are waiting) and runs them with one run_batch call.
+
+    run_batch(requests, generation_params) -> [(outputs, output_len)], one per request, where
+    requests is a list of the "inputs" lists of the individual requests. Only requests with
+    the same generation_parms share a batch.
+    """
+    def __init__(self, run_batch, max_batch_size=8, window_ms=10):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "max_batch": 0}
+        self.lock = threading.Lock()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, inputs, generation_params=None):
+        """
+        Blocks until the batch the request went into is done, returns (outputs, output_len).
+        """
+        future = Future()
+        self.queue.put((inputs, generation_params, future))
+        return future.result()
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            groups = {}
+            for request in batch:
+                key = json.dumps(request[1], sort_keys=True)
+                groups.setdefault(key, []).append(request)
+            for requests in groups.values():
+                self.run_group(requests)
+
+    def run_group(self, requests):
+        with self.lock:
+            self.stats["requests"] += len(requests)
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(requests))
+        try:
+            results = self.run_batch([r[0] for r in requests], requests[0][1])
+        except Exception as e:
+            for r in requests:
+                r[2].set_exception(e)
+            return
+        for r, result in zip(requests, results):
+            r[2].set_result(result)
@@ -0,0 +1,98 @@
+"""
+Fit a chat into max_model_len before it is generated, instead of retrying generate with
+smaller images after it fails.
+
+Qwen2-VL / Qwen2.5-VL resize every image to multiples of 28 pixels (14 pixel patches,
+2x2 merged) within [min_pixels, max_pixels] and spend one token per 28x28 block. The
+planner counts those tokens plus the text tokens of the prompt, and while the total plus
+max_tokens doesn't fit it
+    1. halves the pixels of the older images, second image first, the task image last,
+    2. drops the oldest assistant/user turns after the task message,
+never touching the images of the last message.
+"""
+import math
+
+from .utils import preprocess_image
+
+IMAGE_FACTOR = 28
+IMAGE_PAD = "<|image_pad|>"
+
+def smart_resize(height, width, factor=IMAGE_FACTOR, min_pixels=4 * 28 * 28, max_pixels=16384 * 28 * 28):
+    # qwen_vl_utils / Qwen2VLImageProcessor
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt((height * width) / max_pixels)
+        h_bar = math.floor(height / beta / factor) * factor
+        w_bar = math.floor(width / beta / factor) * factor
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+def message_image_count(message):
+    if not isinstance(message["content"], list):
+        return 0
+    return sum(1 for c in message["content"] if c.get("type") in ("image", "image_url"))
+
+class ContextPlanner:
+    def __init__(self, processor, max_model_len, max_pixels, min_pixels=4 * 28 * 28):
+        self.processor = processor
+        self.tokenizer = getattr(processor, "tokenizer", processor)
+        self.max_model_len = max_model_len
+        self.max_pixels = int(max_pixels)
+        image_processor = getattr(processor, "image_processor", None)
+        # the processor's own bounds, the images are resized once more in vLLM
+        self.min_pixels = getattr(image_processor, "min_pixels", None) or int(min_pixels)
+        self.processor_max_pixels = getattr(image_processor, "max_pixels", None) or 16384 * 28 * 28
+
+    def image_tokens(self, image):
+        h, w = smart_resize(image.height, image.width, IMAGE_FACTOR, self.min_pixels, self.processor_max_pixels)
+        return (h // IMAGE_FACTOR) * (w // IMAGE_FACTOR)
+
+    def build_prompt(self, messages):
+        return self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def text_tokens(self, prompt):
+        # every image is one <|image_pad|> in the prompt, vLLM expands it to image_tokens()
+        return len(self.tokenizer(prompt)["input_ids"]) - prompt.count(IMAGE_PAD)
+
+    def plan(self, messages, images, max_tokens):
+        """
+        (prompt, messages, images, info) that fit max_model_len - max_tokens when possible.
+        images are the preprocessed images of messages, in order; neither list is modified.
+        """
+        budget = self.max_model_len - max_tokens
+        messages, images = list(messages), list(images)
+        prompt = self.build_prompt(messages)
+        text = self.text_tokens(prompt)
+        visual = [self.image_tokens(img) for img in images]
+        info = {"budget": budget, "tokens": text + sum(visual), "downscaled": 0, "dropped_messages": 0}
+        if text + sum(visual) <= budget:
+            return prompt, messages, images, info
+
+        last = message_image_count(messages[-1])
+        older = list(range(len(images) - last))
+        for i in older[1:] + older[:1]:
+            if text + sum(visual) <= budget:
+                break
+            images[i] = preprocess_image(images[i], self.max_pixels // 2)
+            visual[i] = self.image_tokens(images[i])
+            info["downscaled"] += 1
+
+        # messages: system, task (user), then assistant/user turns
+        while text + sum(visual) > budget and len(messages) > 4:
+            dropped = messages[2:4]
+            count = sum(message_image_count(m) for m in dropped)
+            first = sum(message_image_count(m) for m in messages[:2])
+            del messages[2:4]
+            del images[first:first + count]
+            del visual[first:first + count]
+            prompt = self.build_prompt(messages)
+            text = self.text_tokens(prompt)
+            info["dropped_messages"] += 2
+        info["tokens"] = text + sum(visual)
+        if info["tokens"] > budget:
+            print(f"context planner: {info['tokens']} tokens don't fit {budget}")
+        return prompt, messages, images, info
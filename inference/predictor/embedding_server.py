@@ -2,9 +2,47 @@ import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 from FlagEmbedding import FlagAutoModel
 import numpy as np
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+# object type embeddings are kept in <EMBEDDING_CACHE_DIR>/<model>.npz across restarts
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 4096))
+# new candidates are written to the cache file in the background, after EMBEDDING_SAVE_EVERY
+# of them or every EMBEDDING_SAVE_INTERVAL seconds, and on exit
+EMBEDDING_SAVE_EVERY = int(os.getenv("EMBEDDING_SAVE_EVERY", 32))
+EMBEDDING_SAVE_INTERVAL = float(os.getenv("EMBEDDING_SAVE_INTERVAL", 60))
+MATCH_THRESHOLD = 0.2
+
+# iTHOR object types, /match candidates are (almost always) among these
+OBJECT_TYPES = [
+    "AlarmClock", "AluminumFoil", "Apple", "AppleSliced", "ArmChair", "BaseballBat", "BasketBall", "Bathtub",
+    "BathtubBasin", "Bed", "Blinds", "Book", "Boots", "Bottle", "Bowl", "Box", "Bread", "BreadSliced",
+    "ButterKnife", "Cabinet", "Candle", "CD", "CellPhone", "Chair", "Cloth", "CoffeeMachine", "CoffeeTable",
+    "CounterTop", "CreditCard", "Cup", "Curtains", "Desk", "DeskLamp", "Desktop", "DiningTable", "DishSponge",
+    "DogBed", "Drawer", "Dresser", "Dumbbell", "Egg", "EggCracked", "Faucet", "Floor", "FloorLamp", "Footstool",
+    "Fork", "Fridge", "GarbageBag", "GarbageCan", "HandTowel", "HandTowelHolder", "HousePlant", "Kettle",
+    "KeyChain", "Knife", "Ladle", "Laptop", "LaundryHamper", "Lettuce", "LettuceSliced", "LightSwitch",
+    "Microwave", "Mirror", "Mug", "Newspaper", "Ottoman", "Painting", "Pan", "PaperTowelRoll", "Pen", "Pencil",
+    "PepperShaker", "Pillow", "Plate", "Plunger", "Poster", "Pot", "Potato", "PotatoSliced", "RemoteControl",
+    "RoomDecor", "Safe", "SaltShaker", "ScrubBrush", "Shelf", "ShelvingUnit", "ShowerCurtain", "ShowerDoor",
+    "ShowerGlass", "ShowerHead", "SideTable", "Sink", "SinkBasin", "SoapBar", "SoapBottle", "Sofa", "Spatula",
+    "Spoon", "SprayBottle", "Statue", "Stool", "StoveBurner", "StoveKnob", "TableTopDecor", "TargetCircle",
+    "TeddyBear", "Television", "TennisRacket", "TissueBox", "Toaster", "Toilet", "ToiletPaper",
+    "ToiletPaperHanger", "Tomato", "TomatoSliced", "Towel", "TowelHolder", "TVStand", "VacuumCleaner", "Vase",
+    "Watch", "WateringCan", "Window", "WineBottle",
+]
 
 class EmbeddingServer:
-    def __init__(self, model_path="BAAI/bge-small-en-v1.5"):
+    """
+    Candidate embeddings live in one pre-normalized matrix (warmed with OBJECT_TYPES and saved
+    to disk), query embeddings in an LRU, so a /match call is one matrix-vector product unless
+    it brings a new query or candidate.
+    """
+    def __init__(self, model_path="BAAI/bge-small-en-v1.5", cache_dir=EMBEDDING_CACHE_DIR, query_cache_size=QUERY_CACHE_SIZE):
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
         self.model = FlagAutoModel.from_finetuned(
                                     model_path,
@@ -13,23 +51,112 @@ class EmbeddingServer:
                                     devices=["cpu"])
         # self.model = AutoModelForSequenceClassification.from_pretrained(
         #     model_path).eval()
+        self.model_path = model_path
+        self.cache_path = os.path.join(cache_dir, model_path.strip("/").replace("/", "_") + ".npz") if cache_dir else None
+        self.vocab = {} # text -> row of self.matrix
+        self.matrix = None
+        self.queries = OrderedDict() # query text -> embedding, least recently used first
+        self.query_cache_size = query_cache_size
+        self.stats = {"query_hit": 0, "query_miss": 0, "candidate_miss": 0, "saves": 0}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.unsaved = 0 # candidates added since the last save
+        self.save_event = threading.Event()
+        self.load_table()
+        self.add_candidates(OBJECT_TYPES)
+        self.save_table()
+        threading.Thread(target=self.save_periodically, daemon=True).start()
+        atexit.register(self.save_table)
 
-    def get_most_similar_pair(self, s1, s2):
-        # pairs = [['what is panda?', 'hi'], ['what is panda?', 'The giant panda (Ailuropoda melanoleuca), sometimes called a panda bear or simply panda, is a bear species endemic to China.']]
-        
+    def encode(self, texts):
         with torch.no_grad():
-            # inputs = self.tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=512).to(self.model.device)
-            # scores = self.model(**inputs, return_dict=True).logits.view(-1, ).float()
-            embeddings_1 = self.model.encode(s1)
-            embeddings_2 = self.model.encode(s2)
-
-        similarity = embeddings_1 @ embeddings_2.T
-        index = np.argmax(similarity[0])
-        if list(similarity[0])[index] > 0.2:
-            return s2[index], list(similarity[0])
+            embeddings = np.asarray(self.model.encode(texts), dtype=np.float32).reshape(len(texts), -1)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def load_table(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            data = np.load(self.cache_path, allow_pickle=False)
+            if str(data["model_path"]) != self.model_path:
+                return
+            texts, matrix = [str(t) for t in data["texts"]], data["embeddings"].astype(np.float32)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"read {self.cache_path} failed: {e}")
+            return
+        self.vocab = {text: i for i, text in enumerate(texts)}
+        self.matrix = matrix
+        print(f"embedding table: {len(texts)} candidates from {self.cache_path}")
+
+    def save_table(self):
+        if self.cache_path is None:
+            return
+        # the table is copied under self.lock and written without it, /match doesn't wait on the disk
+        with self.save_lock:
+            with self.lock:
+                if self.unsaved == 0:
+                    return
+                unsaved, texts, matrix = self.unsaved, list(self.vocab), self.matrix
+                self.unsaved = 0
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, model_path=np.array(self.model_path), texts=np.array(texts), embeddings=matrix)
+                os.replace(tmp_path, self.cache_path)
+                self.stats["saves"] += 1
+            except OSError as e:
+                print(f"save {self.cache_path} failed: {e}")
+                with self.lock:
+                    self.unsaved += unsaved
+
+    def save_periodically(self):
+        while True:
+            self.save_event.wait(EMBEDDING_SAVE_INTERVAL)
+            self.save_event.clear()
+            self.save_table()
+
+    def add_candidates(self, texts):
+        # called with self.lock held or before the server starts
+        missing = [text for text in dict.fromkeys(texts) if text not in self.vocab]
+        if not missing:
+            return
+        self.stats["candidate_miss"] += len(missing)
+        embeddings = self.encode(missing)
+        self.matrix = embeddings if self.matrix is None else np.concatenate((self.matrix, embeddings))
+        for text in missing:
+            self.vocab[text] = len(self.vocab)
+        self.unsaved += len(missing)
+        if self.unsaved >= EMBEDDING_SAVE_EVERY:
+            self.save_event.set()
+
+    def query_embedding(self, text):
+        if text in self.queries:
+            self.stats["query_hit"] += 1
+            self.queries.move_to_end(text)
+            return self.queries[text]
+        self.stats["query_miss"] += 1
+        embedding = self.encode([text])[0]
+        self.queries[text] = embedding
+        if len(self.queries) > self.query_cache_size:
+            self.queries.popitem(last=False)
+        return embedding
+
+    def get_most_similar_pair(self, s1, s2):
+        # only the first query is matched, like before
+        if len(s2) == 0:
+            return "No Suitable Object", []
+        with self.lock:
+            query = self.query_embedding(s1[0])
+            self.add_candidates(s2)
+            rows = [self.vocab[text] for text in s2]
+            similarity = self.matrix[rows] @ query
+        index = int(np.argmax(similarity))
+        if similarity[index] > MATCH_THRESHOLD:
+            return s2[index], list(similarity)
         else:
-            print(s2[index], list(similarity[0])[index])
-            return "No Suitable Object", list(similarity[0])
+            print(s2[index], similarity[index])
+            return "No Suitable Object", list(similarity)
 
 if __name__=="__main__":
     server = EmbeddingServer()
@@ -38,4 +165,4 @@ if __name__=="__main__":
     s1 = ["fridge"]
     s2 = ["CounterTop","Book","HousePlant","Cabinet","Window","Stool","ShelvingUnit","Fridge"]
     a  = server.get_most_similar_pair(s1, s2)
-    print(a)
\ No newline at end of file
+    print(a)
@@ -3,6 +3,7 @@ from transformers import Qwen2_5_VLForConditionalGeneration, AutoTokenizer, Auto
 from qwen_vl_utils import process_vision_info
 from .base_infer import BaseServer
 from .utils import preprocess_image
+from .image_cache import image_cache, load_videos
 import torch
 import os
 import math
@@ -24,6 +25,8 @@ class HfServer(BaseServer):
             "qwen2_5_vl": HfServer.load_qwen2_5_vl
         }
         self.llm, self.processor = self.model_example_map[model_type](model_path)
+        # batched prompts are padded on the left so that every row generates from its last token
+        self.processor.tokenizer.padding_side = "left"
 
     @staticmethod
     def load_qwen2_5_vl(model_path):
@@ -59,11 +62,7 @@ class HfServer(BaseServer):
         # processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-2B-Instruct", min_pixels=min_pixels, max_pixels=max_pixels)
         return model, processor
     
-    def chat(self, inputs, generation_params=None):
-        if isinstance(inputs, list):
-            messages = inputs[0]["messages"]
-        else:
-            messages = inputs["messages"]
+    def chat_generation_params(self, generation_params=None):
         if generation_params is None:
             generation_params={"do_sample":True,
                                 # "max_length":32768, # defaults to model.config.max_length
@@ -83,6 +82,89 @@ class HfServer(BaseServer):
             #                     # "repetition_penalty":1.01,
             #                     # "length_penalty":1.01,
             #                     }
+        return generation_params
+
+    def chat_images(self, messages, max_pixels=MAX_PIXELS):
+        return image_cache.load(messages, max_pixels)
+
+    def stop_token_ids(self, generation_params):
+        eos = generation_params.get("eos_token_id", self.llm.generation_config.eos_token_id)
+        if eos is None:
+            eos = self.processor.tokenizer.eos_token_id
+        return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+    def generate_batch(self, lines, generation_params):
+        """
+        One left padded generate for several conversations, images are passed in message order.
+        Returns [(output_text, output_len)] in the order of lines.
+        """
+        texts, images, videos = [], [], []
+        for line in lines:
+            texts.append(self.processor.apply_chat_template(line["messages"], tokenize=False, add_generation_prompt=True))
+            preprocessed = line.get("preprocessed_images")
+            images += list(preprocessed) if preprocessed is not None else self.chat_images(line["messages"])
+            videos += load_videos(line["messages"]) or []
+        inputs = self.processor(
+            text=texts,
+            images=images or None,
+            videos=videos or None,
+            padding=True,
+            return_tensors="pt",
+        ).to(self.llm.device)
+        print("input tokens shape:",inputs['input_ids'].shape)
+        with torch.no_grad():
+            generated_ids = self.llm.generate(**inputs, **generation_params)
+        # every row keeps generating (padding) until the last one stops, cut each after its own eos
+        stop_ids = self.stop_token_ids(generation_params)
+        results = []
+        for out_ids in generated_ids[:, inputs["input_ids"].shape[1]:].tolist():
+            for i, token in enumerate(out_ids):
+                if token in stop_ids:
+                    out_ids = out_ids[:i + 1]
+                    break
+            output_text = self.processor.decode(out_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+            results.append((output_text, len(out_ids)))
+        return results
+
+    def chat_batch(self, requests, generation_params=None):
+        """
+        requests: the "inputs" of several /chat requests, generated with one llm.generate call.
+        Returns [(outputs, output_len)] in request order, what chat() returns for each of them.
+        """
+        generation_params = self.chat_generation_params(generation_params)
+        lines, owners = [], []
+        for i, inputs in enumerate(requests):
+            if not isinstance(inputs, list):
+                inputs = [inputs]
+            lines += inputs
+            owners += [i] * len(inputs)
+        try:
+            outputs = self.generate_batch(lines, generation_params)
+        except Exception as e:
+            # e.g. out of memory, chat() retries each conversation with smaller images
+            print(e)
+            print(f"batch of {len(lines)} conversations failed, run them one by one")
+            outputs = []
+            for line in lines:
+                output_text, output_len = self.chat([line], generation_params)
+                outputs.append((output_text[0] if output_text else "", output_len))
+        results = [([], 0) for _ in requests]
+        for owner, (output_text, output_len) in zip(owners, outputs):
+            texts, first_len = results[owner]
+            if not texts:
+                first_len = output_len
+            texts.append(output_text)
+            results[owner] = (texts, first_len)
+        return results
+
+    def chat(self, inputs, generation_params=None):
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+        generation_params = self.chat_generation_params(generation_params)
+        if len(inputs) > 1:
+            return self.chat_batch([inputs], generation_params)[0]
+        messages = inputs[0]["messages"]
+        preprocessed = inputs[0].get("preprocessed_images")
         # messages = [
         #     {
         #         "role": "user",
@@ -96,11 +178,10 @@ class HfServer(BaseServer):
                 messages, tokenize=False, add_generation_prompt=True
             )
         # print(text)
-        image_inputs, video_inputs = process_vision_info(messages)
-        # print(len(image_inputs),"image_inputs")
-        # align training data
-        image_inputs = [preprocess_image(img, MAX_PIXELS) for img in image_inputs]
-        image_count = len(image_inputs)
+        # align training data, images of earlier requests are reused from image_cache
+        image_inputs = (list(preprocessed) if preprocessed is not None else self.chat_images(messages)) or None
+        video_inputs = load_videos(messages)
+        image_count = len(image_inputs or [])
         try_num = 0
         ratio = 0
         while True:
@@ -123,16 +204,17 @@ class HfServer(BaseServer):
             except Exception as e:
                 print(e)
                 print(f"resize image resolution...{try_num}")
-                print(f"total images:{len(image_inputs)}")
+                print(f"total images:{len(image_inputs or [])}")
                 # 如果所有的图像分辨率都降低一次了，则删掉前面的messages
                 if len(messages) > 2*try_num+2 and ratio==1:
                     messages = messages[2:2*try_num:]
                     text = self.processor.apply_chat_template(
                         messages, tokenize=False, add_generation_prompt=True
                     )
-                    image_inputs, video_inputs = process_vision_info(messages)
+                    image_inputs = self.chat_images(messages) or None
+                    video_inputs = load_videos(messages)
                 # 降低第try_num张图片的分辨率,不会降低第1张的分辨率
-                elif len(image_inputs) > try_num:
+                elif len(image_inputs or []) > try_num:
                     image_inputs[try_num] = preprocess_image(image_inputs[try_num], int(MAX_PIXELS)//2)
                     # image_inputs[try_num].resize((image_inputs[try_num].size[0]//2, image_inputs[try_num].size[1]//2),resample=Image.Resampling.NEAREST)                
                     print("image shape:",image_inputs[try_num].size[0],",",image_inputs[try_num].size[1])
@@ -0,0 +1,124 @@
+"""
+Decoded and preprocessed chat images, kept across requests.
+
+On step k of an episode the first k-1 images of /chat are the ones of the previous request,
+so every image is decoded (process_vision_info) and resized (preprocess_image) once and
+looked up afterwards by a hash of its content, its resize options and the target resolution.
+Least recently used images are dropped beyond IMAGE_CACHE_SIZE images or IMAGE_CACHE_MB.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+from qwen_vl_utils import process_vision_info
+from .utils import preprocess_image
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 512))
+IMAGE_CACHE_MB = float(os.getenv("IMAGE_CACHE_MB", 512))
+# per image options of qwen_vl_utils.fetch_image
+RESIZE_KEYS = ("resized_height", "resized_width", "min_pixels", "max_pixels")
+
+def vision_elements(messages):
+    # the same elements, in the same order, as qwen_vl_utils.extract_vision_info
+    elements = []
+    for m in messages:
+        if not isinstance(m["content"], list):
+            continue
+        for ele in m["content"]:
+            if "image" in ele or "image_url" in ele or "video" in ele or ele.get("type", "text") in ("image", "image_url", "video"):
+                elements.append(ele)
+    return elements
+
+def is_video(ele):
+    return "video" in ele or ele.get("type") == "video"
+
+def load_videos(messages):
+    """
+    The video inputs of process_vision_info(messages), or None. Videos aren't cached.
+    """
+    videos = [ele for ele in vision_elements(messages) if is_video(ele)]
+    if not videos:
+        return None
+    _, video_inputs = process_vision_info([{"role": "user", "content": videos}])
+    return video_inputs
+
+def content_hash(ele):
+    image = ele["image"] if "image" in ele else ele.get("image_url")
+    h = hashlib.sha1()
+    if isinstance(image, Image.Image):
+        # shm frames are already PIL images
+        h.update(f"{image.mode}{image.size}".encode())
+        h.update(image.tobytes())
+    elif isinstance(image, str) and not image.startswith(("http://", "https://", "data:")):
+        path = image[len("file://"):] if image.startswith("file://") else image
+        with open(path, "rb") as f:
+            h.update(f.read())
+    else:
+        # base64 data URLs are the content, urls are trusted not to change
+        h.update(str(image).encode())
+    for key in RESIZE_KEYS:
+        h.update(f"{key}={ele.get(key)}".encode())
+    return h.hexdigest()
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+class ImageCache:
+    def __init__(self, max_images=IMAGE_CACHE_SIZE, max_mb=IMAGE_CACHE_MB):
+        self.max_images = max_images
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.images = OrderedDict() # (content hash, max_pixels) -> preprocessed image
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "hit_rate": 0.0, "images": 0, "mb": 0.0}
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.images.move_to_end(key)
+            self.stats["hit_rate"] = round(self.stats["hits"] / (self.stats["hits"] + self.stats["misses"]), 4)
+            return image
+
+    def put(self, key, image):
+        size = image_bytes(image)
+        if self.max_images <= 0 or size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = image
+            self.size += size
+            while len(self.images) > self.max_images or self.size > self.max_bytes:
+                _, old = self.images.popitem(last=False)
+                self.size -= image_bytes(old)
+                self.stats["evictions"] += 1
+            self.stats["images"] = len(self.images)
+            self.stats["mb"] = round(self.size / 1024 / 1024, 2)
+
+    def load(self, messages, max_pixels):
+        """
+        Preprocessed images of messages, like
+            [preprocess_image(img, max_pixels) for img in process_vision_info(messages)[0]]
+        Videos are left out, see load_videos.
+        The cached images are shared between requests and must not be modified.
+        """
+        images = []
+        for ele in vision_elements(messages):
+            if is_video(ele):
+                continue
+            key = (content_hash(ele), int(max_pixels))
+            image = self.get(key)
+            if image is None:
+                # decoded outside the lock, two requests may both decode a new image
+                image_data, _ = process_vision_info([{"role": "user", "content": [ele]}])
+                image = preprocess_image(image_data[0], max_pixels)
+                self.put(key, image)
+            images.append(image)
+        return images
+
+image_cache = ImageCache()
@@ -0,0 +1,80 @@
+import time
+import threading
+from collections import OrderedDict
+
+class SessionMismatch(Exception):
+    def __init__(self, session_id, length):
+        super().__init__(f"session {session_id} has {length} messages")
+        self.length = length
+
+class Session:
+    def __init__(self):
+        self.messages = []
+        self.image_counts = [] # images of every message, to cut self.images along with self.messages
+        self.images = [] # preprocessed images of self.messages, in order
+        self.last_used = time.time()
+
+class SessionStore:
+    """
+    Conversations of /chat sessions: a request carries session_id, offset (the number of
+    messages it builds on) and only the messages after offset. The images of the stored
+    messages are preprocessed once, with `preprocess(messages) -> [image]`.
+
+    Least recently used sessions beyond max_sessions and sessions idle for ttl seconds are
+    dropped; the client then gets SessionMismatch and sends the whole conversation again.
+    """
+    def __init__(self, preprocess=None, max_sessions=32, ttl=600):
+        self.preprocess = preprocess
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "messages_received": 0, "messages_reused": 0, "mismatches": 0}
+
+    def evict(self):
+        now = time.time()
+        for session_id in [k for k, s in self.sessions.items() if now - s.last_used > self.ttl]:
+            del self.sessions[session_id]
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def extend(self, session_id, offset, messages):
+        """
+        Append messages after the first `offset` messages of the session (offset 0 starts it
+        over). Returns (all messages, preprocessed images or None), raises SessionMismatch
+        when the session doesn't have `offset` messages.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None and offset == 0:
+                session = self.sessions[session_id] = Session()
+            if session is None or len(session.messages) < offset:
+                self.stats["mismatches"] += 1
+                raise SessionMismatch(session_id, len(session.messages) if session else 0)
+            self.sessions.move_to_end(session_id)
+            session.last_used = time.time()
+            # a retried request may resend messages the session already has
+            del session.messages[offset:]
+            dropped_images = sum(session.image_counts[offset:])
+            if dropped_images:
+                del session.images[-dropped_images:]
+            del session.image_counts[offset:]
+            self.stats["requests"] += 1
+            self.stats["messages_received"] += len(messages)
+            self.stats["messages_reused"] += offset
+            self.evict()
+        # images are preprocessed outside the lock, a session only has one request at a time
+        counts, images = [], []
+        for m in messages:
+            new_images = self.preprocess([m]) if self.preprocess is not None else []
+            counts.append(len(new_images))
+            images += new_images
+        with self.lock:
+            session.messages += messages
+            session.image_counts += counts
+            session.images += images
+            return list(session.messages), list(session.images) if self.preprocess is not None else None
+
+    def end(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
@@ -1,11 +1,55 @@
 import copy, base64
 import math
+from collections import OrderedDict
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import threading
 from PIL import Image
 
+SHM_CACHE_SIZE = 16
+shm_segments = OrderedDict()
+shm_lock = threading.Lock()
+
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
+def attach_shm(name):
+    with shm_lock:
+        if name in shm_segments:
+            shm_segments.move_to_end(name)
+            return shm_segments[name]
+        shm = shared_memory.SharedMemory(name=name)
+        # the evaluator owns the segment, don't let this process unlink it on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm_segments[name] = shm
+        if len(shm_segments) > SHM_CACHE_SIZE:
+            _, old = shm_segments.popitem(last=False)
+            old.close()
+        return shm
+
+def load_shm_image(handle):
+    """
+    handle: shm://<name>/<offset>/<h>x<w>x<c> written by the evaluator's FrameRing
+    """
+    name, offset, shape = handle[len("shm://"):].split("/")
+    shape = tuple(int(i) for i in shape.split("x"))
+    shm = attach_shm(name)
+    frame = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=int(offset)).copy()
+    return Image.fromarray(frame)
+
+def resolve_shm_images(messages):
+    """
+    Replace shared-memory image handles in chat messages with PIL images.
+    """
+    for m in messages:
+        if not isinstance(m["content"], list):
+            continue
+        for c in m["content"]:
+            if c.get("type") == "image" and isinstance(c.get("image"), str) and c["image"].startswith("shm://"):
+                c["image"] = load_shm_image(c["image"])
+    return messages
+
 def preprocess_image(image: Image, image_resolution=180000) -> Image:
     r"""
     Pre-processes a single image. for qwen2-vl
@@ -13,6 +13,8 @@ from vllm import LLM, SamplingParams
 from vllm.multimodal.utils import fetch_image
 from qwen_vl_utils import process_vision_info
 from .utils import preprocess_image
+from .context_planner import ContextPlanner
+from .image_cache import image_cache
 # from vllm.utils import FlexibleArgumentParser
 import os, torch
 TP = len(os.getenv("CUDA_VISIBLE_DEVICES").split(",")) if os.getenv("CUDA_VISIBLE_DEVICES") else 1
@@ -25,6 +27,7 @@ if MAX_PIXELS is None:
     MAX_PIXELS = 180000
 if MIN_PIXELS is None:
     MIN_PIXELS = 3136
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN", 32768))
 # export VLLM_WORKER_MULTIPROC_METHOD=spawn
 # torch.multiprocessing.set_start_method('spawn')
 # import multiprocessing as mp
@@ -50,6 +53,8 @@ class VllmServer(BaseServer):
             "qwen2_5_vl": VllmServer.load_qwen2_5_vl,
         }
         self.llm, self.processor = self.model_example_map[model_type](model_name)
+        # long chats are fitted into max_model_len before generate
+        self.planner = ContextPlanner(self.processor, MAX_MODEL_LEN, MAX_PIXELS, MIN_PIXELS)
 
     def chat_0(self, inputs, generation_params=None):
         if generation_params is None:
@@ -84,7 +89,7 @@ class VllmServer(BaseServer):
         results = [o.outputs[0].text for o in outputs]
         return results
 
-    def chat(self, inputs, generation_params=None):
+    def chat_sampling_params(self, generation_params=None):
         if generation_params is None:
             sampling_params = SamplingParams(
                 temperature=0.6, max_tokens=1024, top_k=10, repetition_penalty=1.1, )#stop_token_ids=[]
@@ -93,6 +98,53 @@ class VllmServer(BaseServer):
             
         else:
             sampling_params = SamplingParams(**generation_params)
+        return sampling_params
+
+    def chat_images(self, messages, max_pixels=MAX_PIXELS):
+        return image_cache.load(messages, max_pixels)
+
+    def chat_prompt(self, messages, max_pixels=MAX_PIXELS, images=None, max_tokens=0):
+        """
+        images: the preprocessed images of messages if they are known (/chat sessions)
+        Older images are downscaled or old turns dropped so that the prompt and max_tokens fit.
+        """
+        image_data = list(images) if images is not None else self.chat_images(messages, max_pixels)
+        prompt, messages, image_data, info = self.planner.plan(messages, image_data, max_tokens)
+        if info["downscaled"] or info["dropped_messages"]:
+            print(f"context planner: {info}")
+        return {"prompt": prompt, "multi_modal_data": {"image": image_data}}
+
+    def chat_batch(self, requests, generation_params=None):
+        """
+        requests: the "inputs" of several /chat requests, generated with one llm.generate call.
+        Returns [(outputs, output_len)] in request order, what chat() returns for each of them.
+        """
+        sampling_params = self.chat_sampling_params(generation_params)
+        prompts, owners = [], []
+        for i, inputs in enumerate(requests):
+            if not isinstance(inputs, list):
+                inputs = [inputs]
+            for line in inputs:
+                prompts.append(self.chat_prompt(line["messages"], images=line.get("preprocessed_images"), max_tokens=sampling_params.max_tokens or 0))
+                owners.append(i)
+        try:
+            outputs = self.llm.generate(prompts, sampling_params=sampling_params)
+        except Exception as e:
+            # one bad request shouldn't fail the others
+            print(e)
+            print(f"batch of {len(requests)} requests failed, run them one by one")
+            return [self.chat(inputs, generation_params) for inputs in requests]
+        results = [([], 0) for _ in requests]
+        for owner, o in zip(owners, outputs):
+            texts, output_len = results[owner]
+            if not texts:
+                output_len = len(o.outputs[0].token_ids)
+            texts.append(o.outputs[0].text)
+            results[owner] = (texts, output_len)
+        return results
+
+    def chat(self, inputs, generation_params=None):
+        sampling_params = self.chat_sampling_params(generation_params)
         
         if not isinstance(inputs, list):
             inputs = [inputs]
@@ -117,56 +169,14 @@ class VllmServer(BaseServer):
         '''
         prompts = []
         for line in inputs:
-            messages = line["messages"]
-            prompt = self.processor.apply_chat_template(
-                                                messages,
-                                                tokenize=False,
-                                                add_generation_prompt=True)
-        
-            image_data, _ = process_vision_info(messages)
-            image_data = [preprocess_image(img, MAX_PIXELS) for img in image_data]
-            dic= {"prompt": prompt, "multi_modal_data": {"image": image_data}}
-            prompts.append(dic)
-            
-        image_count = len(image_data)
+            prompts.append(self.chat_prompt(line["messages"], images=line.get("preprocessed_images"), max_tokens=sampling_params.max_tokens or 0))
 
-        try_num = 0
-        ratio=0
-        while True:
-            if try_num > 2*image_count:
-                return "", 0
-            try:
-                try_num+=1
-                outputs = self.llm.generate(prompts, sampling_params=sampling_params)
-                break
-            except Exception as e:
-                print(e)
-                print(f"resize image resolution...{try_num}")
-                print(f"total images:{len(image_data)}")
-                if ratio ==1:
-                    prompts = []
-                    for line in inputs:
-                        messages = line["messages"]
-                        if len(messages) > 2*try_num+2:
-                            messages = messages[2:2*try_num:]
-                        prompt = self.processor.apply_chat_template(
-                                                            messages,
-                                                            tokenize=False,
-                                                            add_generation_prompt=True)
-                    
-                        image_data, _ = process_vision_info(messages)
-                        image_data = [preprocess_image(img, int(MAX_PIXELS)//2) for img in image_data]
-                        dic= {"prompt": prompt, "multi_modal_data": {"image": image_data}}
-                        prompts.append(dic)
-                else:
-                    for prompt in prompts:
-                        multi_modal_data = prompt["multi_modal_data"]
-                        image_data = multi_modal_data["image"]
-                        if len(image_data) > try_num:
-                            image_data[try_num] = preprocess_image(image_data[try_num], int(MAX_PIXELS)//2)
-                        else:
-                            ratio = 1
-                        prompt["multi_modal_data"]["image"] = image_data
+        # the planner already fitted the prompts, a failure here isn't fixed by retrying
+        try:
+            outputs = self.llm.generate(prompts, sampling_params=sampling_params)
+        except Exception as e:
+            print(e)
+            return "", 0
 
         print(len(outputs[0].outputs[0].token_ids), outputs[0].outputs[0].text)
         results = [o.outputs[0].text for o in outputs]
@@ -270,11 +280,13 @@ class VllmServer(BaseServer):
         llm = LLM(
             model=model_name,
             tokenizer=model_name,
-            max_model_len=32768, # if process_vision_info is None else 10240,
+            max_model_len=MAX_MODEL_LEN, # if process_vision_info is None else 10240,
             # max_num_seqs=5,
             # limit_mm_per_prompt={"image": len(image_urls)},
             tensor_parallel_size=1,
             gpu_memory_utilization=0.8,
+            # /chat sessions resend the same history, only the new turn is prefilled
+            enable_prefix_caching=True,
             swap_space=8,
             cpu_offload_gb=8,
             trust_remote_code=True,
@@ -289,11 +301,12 @@ class VllmServer(BaseServer):
         llm = LLM(
             model=model_name,
             tokenizer=model_name,
-            max_model_len=32768, # if process_vision_info is None else 10240,
+            max_model_len=MAX_MODEL_LEN, # if process_vision_info is None else 10240,
             # max_num_seqs=5,
             # limit_mm_per_prompt={"image": len(image_urls)},
             tensor_parallel_size=TP,
             gpu_memory_utilization=0.8,
+            enable_prefix_caching=True,
             trust_remote_code=True,
             limit_mm_per_prompt={"image": 32}
         )